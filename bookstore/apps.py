@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class BookstoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'bookstore'
+
+    def ready(self):
+        from .db import configure_sqlite, install_query_observers
+        connection_created.connect(configure_sqlite, dispatch_uid='bookstore.configure_sqlite')
+        connection_created.connect(install_query_observers, dispatch_uid='bookstore.install_query_observers')
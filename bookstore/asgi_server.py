@@ -0,0 +1,204 @@
+"""
+A minimal HTTP/1.1 server for running the ASGI application locally.
+
+It exists so the async views can be run and load-tested without installing
+uvicorn or daphne: one asyncio event loop, keep-alive connections, request
+bodies with a Content-Length, and chunked responses when the application does
+not send a length. It does not serve static files, TLS or websockets, and is
+not meant for production.
+"""
+import asyncio
+import logging
+from urllib.parse import unquote
+
+
+logger = logging.getLogger('bookstore.asgi_server')
+
+MAX_HEAD_BYTES = 64 * 1024
+
+REASONS = {
+    200: 'OK', 201: 'Created', 204: 'No Content', 301: 'Moved Permanently', 302: 'Found',
+    304: 'Not Modified', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found',
+    405: 'Method Not Allowed', 409: 'Conflict', 412: 'Precondition Failed', 500: 'Internal Server Error',
+}
+
+
+class BadRequest(Exception):
+    pass
+
+
+def parse_head(head):
+    """(method, target, http_version, [(name, value), ...]) from a request head, names lowercased."""
+    lines = head.decode('latin-1').split('\r\n')
+    try:
+        method, target, protocol = lines[0].split(' ')
+    except ValueError:
+        raise BadRequest(f"Malformed request line {lines[0]!r}.")
+    if not protocol.startswith('HTTP/'):
+        raise BadRequest(f"Unsupported protocol {protocol!r}.")
+    headers = []
+    for line in lines[1:]:
+        if not line:
+            continue
+        name, separator, value = line.partition(':')
+        if not separator:
+            raise BadRequest(f"Malformed header {line!r}.")
+        headers.append((name.strip().lower().encode('latin-1'), value.strip().encode('latin-1')))
+    return method, target, protocol[len('HTTP/'):], headers
+
+
+def build_scope(method, target, http_version, headers, client, server):
+    path, _, query = target.partition('?')
+    return {
+        'type': 'http',
+        'asgi': {'version': '3.0', 'spec_version': '2.3'},
+        'http_version': http_version,
+        'method': method,
+        'scheme': 'http',
+        'path': unquote(path),
+        'raw_path': path.encode('latin-1'),
+        'query_string': query.encode('latin-1'),
+        'root_path': '',
+        'headers': headers,
+        'client': client,
+        'server': server,
+    }
+
+
+class Connection:
+    """Serves the requests of one client connection, one after the other."""
+
+    def __init__(self, app, reader, writer):
+        self.app = app
+        self.reader = reader
+        self.writer = writer
+        self.client = writer.get_extra_info('peername')[:2]
+        self.server = writer.get_extra_info('sockname')[:2]
+
+    async def serve(self):
+        try:
+            while await self.serve_one():
+                pass
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.writer.close()
+
+    async def serve_one(self):
+        """Handles one request; returns whether the connection stays open."""
+        try:
+            head = await self.reader.readuntil(b'\r\n\r\n')
+        except asyncio.IncompleteReadError as exc:
+            if exc.partial:
+                raise
+            return False
+        except asyncio.LimitOverrunError:
+            await self.reject(431, 'Request Header Fields Too Large')
+            return False
+        try:
+            method, target, http_version, headers = parse_head(head[:-4])
+            values = dict(headers)
+            length = int(values.get(b'content-length', b'0'))
+            if b'transfer-encoding' in values:
+                raise BadRequest("Chunked request bodies are not supported.")
+        except (BadRequest, ValueError) as exc:
+            logger.warning("Bad request from %s: %s", self.client, exc)
+            await self.reject(400, 'Bad Request')
+            return False
+        body = await self.reader.readexactly(length) if length else b''
+
+        keep_alive = http_version == '1.1' and values.get(b'connection', b'').lower() != b'close'
+        response = Response(self.writer, http_version, keep_alive)
+        scope = build_scope(method, target, http_version, headers, self.client, self.server)
+        received = False
+        disconnected = asyncio.Event()
+
+        async def receive():
+            nonlocal received
+            if not received:
+                received = True
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+            await disconnected.wait()
+            return {'type': 'http.disconnect'}
+
+        try:
+            await self.app(scope, receive, response.send)
+        except Exception:
+            logger.exception("Error handling %s %s", method, target)
+            if not response.started:
+                await self.reject(500, 'Internal Server Error')
+            return False
+        finally:
+            disconnected.set()
+        if not response.finished:
+            return False
+        return response.keep_alive
+
+    async def reject(self, status, reason):
+        self.writer.write(
+            f'HTTP/1.1 {status} {reason}\r\nContent-Length: 0\r\nConnection: close\r\n\r\n'.encode('latin-1')
+        )
+        await self.writer.drain()
+
+
+class Response:
+    """The ASGI `send` callable for one response."""
+
+    def __init__(self, writer, http_version, keep_alive):
+        self.writer = writer
+        self.http_version = http_version
+        self.keep_alive = keep_alive
+        self.status = None
+        self.headers = []
+        self.chunked = False
+        self.started = False
+        self.finished = False
+
+    async def send(self, message):
+        if message['type'] == 'http.response.start':
+            self.status = message['status']
+            self.headers = list(message.get('headers', []))
+            return
+        if message['type'] != 'http.response.body':
+            return
+        if not self.started:
+            self.write_head()
+        body = message.get('body', b'')
+        more_body = message.get('more_body', False)
+        if self.chunked:
+            if body:
+                self.writer.write(b'%x\r\n%s\r\n' % (len(body), body))
+            if not more_body:
+                self.writer.write(b'0\r\n\r\n')
+        elif body:
+            self.writer.write(body)
+        self.finished = not more_body
+        await self.writer.drain()
+
+    def write_head(self):
+        self.started = True
+        names = {name.lower() for name, _ in self.headers}
+        headers = list(self.headers)
+        if b'content-length' not in names and self.status not in (204, 304):
+            if self.http_version == '1.1':
+                self.chunked = True
+                headers.append((b'transfer-encoding', b'chunked'))
+            else:
+                self.keep_alive = False
+        if not self.keep_alive:
+            headers.append((b'connection', b'close'))
+        lines = [f'HTTP/1.1 {self.status} {REASONS.get(self.status, "Unknown")}'.encode('latin-1')]
+        lines += [name + b': ' + value for name, value in headers]
+        self.writer.write(b'\r\n'.join(lines) + b'\r\n\r\n')
+
+
+async def serve(app, host='127.0.0.1', port=8000, ready=None):
+    """Serves `app` until cancelled. `ready`, if given, is called with the listening server."""
+    async def handle(reader, writer):
+        await Connection(app, reader, writer).serve()
+
+    server = await asyncio.start_server(handle, host, port, limit=MAX_HEAD_BYTES)
+    if ready:
+        ready(server)
+    async with server:
+        await server.serve_forever()
@@ -0,0 +1,170 @@
+"""
+Helpers shared by the benchmark management commands (bench_views and friends).
+
+Benchmarks run against a throwaway test database, never the configured one, so
+they can seed large catalogs freely.
+"""
+import gc
+import json
+import random
+import statistics
+import time
+import tracemalloc
+from contextlib import contextmanager
+from decimal import Decimal
+from pathlib import Path
+
+from django.db import connection
+from django.test.utils import (
+    CaptureQueriesContext, setup_databases, setup_test_environment, teardown_databases,
+    teardown_test_environment,
+)
+
+from bookstore import facets
+from bookstore.models import Book
+
+
+SEED_BATCH_SIZE = 10000
+# Enough copies that benchmarks never run a title out of stock.
+SEED_STOCK = 100_000
+
+_WORDS = (
+    "shadow river garden winter empire silent golden last secret city night ocean "
+    "iron glass stone forest paper crown storm letter house island memory fire"
+).split()
+
+
+@contextmanager
+def bench_environment(verbosity=0, test_database_name=None):
+    """
+    Sets up the test environment and a fresh test database for the duration of a benchmark.
+
+    SQLite test databases live in memory unless `test_database_name` names a file,
+    which benchmarks that need several connections (and real locking) must do.
+    """
+    test_settings = connection.settings_dict.setdefault('TEST', {})
+    old_test_name = test_settings.get('NAME')
+    if test_database_name:
+        test_settings['NAME'] = str(test_database_name)
+    setup_test_environment(debug=False)
+    old_config = setup_databases(verbosity=verbosity, interactive=False, aliases={'default'})
+    try:
+        yield
+    finally:
+        teardown_databases(old_config, verbosity=verbosity)
+        teardown_test_environment()
+        test_settings['NAME'] = old_test_name
+
+
+def seed_catalog(size, seed=0):
+    """Adds `size` generated books in batches; deterministic for a given seed."""
+    rng = random.Random(seed)
+    start = Book.objects.count()
+    created = 0
+    while created < size:
+        batch = []
+        for i in range(start + created, start + min(created + SEED_BATCH_SIZE, size)):
+            title = ' '.join(rng.choice(_WORDS).capitalize() for _ in range(rng.randint(1, 4)))
+            book = Book(
+                title=f"{title} {i}",
+                author=f"Author {rng.randint(1, max(1, size // 20))}",
+                description=' '.join(rng.choice(_WORDS) for _ in range(rng.randint(20, 120))),
+                price=Decimal(rng.randint(100, 9999)) / 100,
+                stock=SEED_STOCK,
+            )
+            book.content_hash = book.compute_content_hash()
+            batch.append(book)
+        Book.objects.bulk_create(batch)
+        facets.apply_counts(facets.count_books((book.author, book.price) for book in batch))
+        created += len(batch)
+    return created
+
+
+def percentile(samples, pct):
+    """The pct-th percentile (0-100) of `samples`, interpolated."""
+    if not samples:
+        return 0.0
+    if len(samples) == 1:
+        return samples[0]
+    return statistics.quantiles(samples, n=100, method='inclusive')[max(0, min(98, int(pct) - 1))]
+
+
+def measure(func, iterations, warmup=3, before_each=None):
+    """
+    Calls `func` repeatedly and reports latency percentiles, queries per call and
+    peak Python memory per call.
+
+    Timing and memory are measured in separate passes, since tracemalloc slows
+    allocation-heavy code down considerably.
+    """
+    for _ in range(warmup):
+        if before_each:
+            before_each()
+        func()
+
+    timings = []
+    queries = []
+    for _ in range(iterations):
+        if before_each:
+            before_each()
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - started) * 1000)
+        queries.append(len(captured))
+
+    peaks = []
+    for _ in range(min(iterations, 5)):
+        if before_each:
+            before_each()
+        gc.collect()
+        tracemalloc.start()
+        func()
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    return {
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'queries': max(queries),
+        'peak_kb': round(max(peaks) / 1024, 1),
+    }
+
+
+def load_baseline(path):
+    path = Path(path)
+    if not path.exists():
+        return None
+    return json.loads(path.read_text())
+
+
+def save_results(path, results):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(results, indent=2, sort_keys=True) + '\n')
+
+
+def find_regressions(results, baseline, threshold):
+    """
+    Compares two {group: {name: metrics}} result sets.
+
+    A route regresses when its p95 latency or peak memory grows by more than
+    `threshold` (a fraction), or when it runs more queries than before.
+    """
+    regressions = []
+    for group, routes in results.items():
+        for name, metrics in routes.items():
+            before = (baseline.get(group) or {}).get(name)
+            if not before:
+                continue
+            for key in ('p95_ms', 'peak_kb'):
+                if before.get(key) and metrics[key] > before[key] * (1 + threshold):
+                    regressions.append(
+                        f"{group}/{name}: {key} {metrics[key]} vs baseline {before[key]} "
+                        f"(+{(metrics[key] / before[key] - 1) * 100:.0f}%)"
+                    )
+            if 'queries' in before and metrics['queries'] > before['queries']:
+                regressions.append(
+                    f"{group}/{name}: queries {metrics['queries']} vs baseline {before['queries']}"
+                )
+    return regressions
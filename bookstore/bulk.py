@@ -0,0 +1,124 @@
+from collections import Counter
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models import F, Max, Min, Value
+from django.db.models.functions import Now, Round
+
+from . import facets, typeahead
+from .cache import bump_catalog_version
+from .models import Book
+from .validation import PRICE_QUANTUM, clean_text, max_price
+
+
+class BulkActionError(Exception):
+    """Raised when a bulk action is rejected before anything is written."""
+
+
+def _parse_decimal(value, label):
+    try:
+        number = Decimal(str(value).strip())
+    except (InvalidOperation, ValueError):
+        raise BulkActionError(f"Invalid {label}.")
+    if not number.is_finite():
+        raise BulkActionError(f"Invalid {label}.")
+    return number
+
+
+def _round_price(price):
+    """Rounds half away from zero to cents, as SQL's ROUND() does in the UPDATE."""
+    return price.quantize(PRICE_QUANTUM, rounding=ROUND_HALF_UP)
+
+
+def _reprice(books, new_price, price_expression):
+    """
+    Applies `price_expression`, rounded to cents, to every selected book in one UPDATE.
+
+    `new_price` maps an old price to the new one in Python, before rounding.
+    Both price changes are monotonic, so the new prices of the current MIN and
+    MAX bound every row's, and checking them is enough to know that no row
+    would leave the DecimalField(max_digits=6) range.
+    """
+    bounds = books.aggregate(low=Min('price'), high=Max('price'))
+    if bounds['low'] is None:
+        return 0
+    # A negative percentage below -100 reverses the order.
+    low, high = sorted(_round_price(new_price(bounds[end])) for end in ('low', 'high'))
+    if low < 0:
+        raise BulkActionError(f"The change would make a price negative ({low}).")
+    if high >= max_price():
+        raise BulkActionError(f"The change would push a price to {high}, above the {max_price()} limit.")
+    new_price_expression = Round(price_expression, 2)
+    # Counted before the UPDATE, which may move books out of a filtered selection.
+    delta = facets.count_queryset(books, price=new_price_expression)
+    delta.subtract(facets.count_queryset(books))
+    # content_hash cannot be computed in SQL; clearing it makes ETags fall back
+    # to updated_at until the book is next saved.
+    count = books.update(price=new_price_expression, updated_at=Now(), content_hash='')
+    facets.apply_counts(delta)
+    return count
+
+
+def change_price_by_percent(books, percent):
+    factor = 1 + _parse_decimal(percent, "percentage") / 100
+    return _reprice(
+        books,
+        lambda price: price * factor,
+        F('price') * factor,
+    )
+
+
+def change_price_by_amount(books, amount):
+    delta = _parse_decimal(amount, "amount")
+    return _reprice(
+        books,
+        lambda price: price + delta,
+        F('price') + delta,
+    )
+
+
+def set_author(books, author):
+    author = (author or '').strip()
+    error = clean_text('author', author)
+    if error:
+        raise BulkActionError(error)
+    delta = facets.count_queryset(books, author=Value(author))
+    delta.subtract(facets.count_queryset(books))
+    count = books.update(author=author, updated_at=Now(), content_hash='')
+    facets.apply_counts(delta)
+    return count
+
+
+def delete_books(books):
+    delta = Counter()
+    delta.subtract(facets.count_queryset(books))
+    deleted, per_model = books.delete()
+    facets.apply_counts(delta)
+    return per_model.get(Book._meta.label, 0)
+
+
+ACTIONS = {
+    'price_percent': change_price_by_percent,
+    'price_amount': change_price_by_amount,
+    'set_author': set_author,
+}
+
+
+def apply_bulk_action(books, action, value=None):
+    """
+    Runs one bulk action on the `books` queryset inside a transaction.
+
+    Returns the number of books changed; raises BulkActionError without writing
+    anything if the action or its value is invalid.
+    """
+    with transaction.atomic():
+        if action == 'delete':
+            count = delete_books(books)
+        elif action in ACTIONS:
+            count = ACTIONS[action](books, value)
+        else:
+            raise BulkActionError("Unknown action.")
+        bump_catalog_version(all_books=True)
+        if action in ('delete', 'set_author'):
+            typeahead.invalidate()
+    return count
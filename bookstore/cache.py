@@ -0,0 +1,82 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+
+CATALOG_VERSION_KEY = 'bookstore:catalog:version'
+BOOK_VERSION_KEY = 'bookstore:book:{book_id}:version'
+# Bumped by bulk operations to invalidate every detail page at once.
+ALL_BOOKS_VERSION_KEY = 'bookstore:books:version'
+
+DEFAULT_TIMEOUT = 60 * 60
+
+
+def catalog_cache():
+    """The cache backend that holds catalog versions and cached catalog pages."""
+    return caches[getattr(settings, 'CATALOG_CACHE_ALIAS', 'default')]
+
+
+def catalog_cache_timeout():
+    return getattr(settings, 'CATALOG_CACHE_TIMEOUT', DEFAULT_TIMEOUT)
+
+
+def _get_version(key):
+    # Seeding a missing (or evicted) counter from the clock means it can never
+    # fall back to a value that older cache entries were stored under.
+    return catalog_cache().get_or_set(key, time.time_ns(), timeout=None)
+
+
+def _bump_version(key):
+    cache = catalog_cache()
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), timeout=None)
+
+
+def get_catalog_version():
+    return _get_version(CATALOG_VERSION_KEY)
+
+
+def get_book_version(book_id):
+    return _get_version(BOOK_VERSION_KEY.format(book_id=book_id))
+
+
+def get_all_books_version():
+    return _get_version(ALL_BOOKS_VERSION_KEY)
+
+
+def bump_catalog_version(book_id=None, all_books=False, related_ids=()):
+    """
+    Invalidates every cached catalog list page and, if `book_id` is given, that
+    book's cached detail page, plus those of `related_ids` (pages that show the
+    book, such as its recommenders'). Bulk operations pass `all_books=True` to
+    invalidate every detail page instead of bumping each book.
+
+    The bump is deferred until the surrounding transaction commits so a reader
+    can never cache the old rows under the new version.
+    """
+    def bump():
+        _bump_version(CATALOG_VERSION_KEY)
+        if book_id is not None:
+            _bump_version(BOOK_VERSION_KEY.format(book_id=book_id))
+        for related_id in related_ids:
+            _bump_version(BOOK_VERSION_KEY.format(book_id=related_id))
+        if all_books:
+            _bump_version(ALL_BOOKS_VERSION_KEY)
+
+    transaction.on_commit(bump)
+
+
+def catalog_list_key(*parts):
+    """Cache key for a catalog list page, e.g. one keyset page of BookListView."""
+    digest = hashlib.md5(repr(parts).encode('utf-8')).hexdigest()
+    return f'bookstore:books:v{get_catalog_version()}:{digest}'
+
+
+def book_detail_key(book_id):
+    all_books_version = get_all_books_version()
+    return f'bookstore:book:{book_id}:v{get_book_version(book_id)}.{all_books_version}'
@@ -0,0 +1,319 @@
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, DecimalField, ExpressionWrapper, F, Sum, Value, When
+
+from .inventory import OutOfStock, release, release_many, reservation_expiry, reserve
+from .models import Book, Cart, CartItem
+
+
+# Wide enough for any realistic basket of DecimalField(max_digits=6) prices.
+MONEY_FIELD = DecimalField(max_digits=14, decimal_places=2)
+
+LINE_TOTAL = ExpressionWrapper(F('quantity') * F('book__price'), output_field=MONEY_FIELD)
+
+SUMMARY = {'lines': Count('id'), 'items': Sum('quantity'), 'total': Sum(LINE_TOTAL)}
+
+CENT = Decimal('0.01')
+
+
+class TooManyCopies(Exception):
+    """Raised when a cart line would hold more copies than allowed."""
+
+    def __init__(self, book_id, limit):
+        self.book_id = book_id
+        self.limit = limit
+        super().__init__(f"A cart line holds at most {limit} copies of book {book_id}.")
+
+
+def to_money(value):
+    """
+    Rounds an SQL money result to cents.
+
+    SQLite evaluates the arithmetic in floating point, which is exact to the
+    cent for any cart total, so rounding recovers the exact Decimal.
+    """
+    if value is None:
+        return Decimal('0.00')
+    return Decimal(value).quantize(CENT)
+
+
+def _owner_filter(request):
+    if request.user.is_authenticated:
+        return {'user': request.user}
+    if request.session.session_key:
+        return {'session_key': request.session.session_key}
+    return None
+
+
+def get_cart(request):
+    """Returns the visitor's cart, or None if they have not added anything yet."""
+    owner = _owner_filter(request)
+    if owner is None:
+        return None
+    return Cart.objects.filter(**owner).first()
+
+
+async def aget_cart(request):
+    """get_cart() for async views; reads the user and session without blocking."""
+    user = await request.auser()
+    if user.is_authenticated:
+        owner = {'user': user}
+    elif request.session.session_key:
+        owner = {'session_key': request.session.session_key}
+    else:
+        return None
+    return await Cart.objects.filter(**owner).afirst()
+
+
+def get_or_create_cart(request):
+    """Returns the visitor's cart, creating it (and an anonymous session) on first use."""
+    if not request.user.is_authenticated and not request.session.session_key:
+        # Anonymous carts are keyed on the session, so it needs a key.
+        request.session.save()
+    cart, _ = Cart.objects.get_or_create(**_owner_filter(request))
+    return cart
+
+
+def _held_line(cart, book_id):
+    """(quantity, reserved_until) of a cart line, locked for the rest of the transaction; None if absent."""
+    return (
+        CartItem.objects.select_for_update()
+        .filter(cart=cart, book_id=book_id)
+        .values_list('quantity', 'reserved_until')
+        .first()
+    )
+
+
+def add_item(cart, book_id, quantity=1, max_quantity=None):
+    """
+    Adds `quantity` copies of a book to the cart, reserving them; raises OutOfStock if too few are left,
+    or TooManyCopies if the line would then hold more than `max_quantity`.
+
+    One transaction locks the line (select_for_update), takes the copies out of
+    stock with a conditional UPDATE (plus the line's earlier copies if its
+    reservation lapsed), then bumps the line's quantity and reservation expiry
+    in SQL or inserts it. If a concurrent add inserts the line first, the
+    INSERT's IntegrityError turns into an UPDATE, so no increment is lost.
+    """
+    with transaction.atomic():
+        line = _held_line(cart, book_id)
+        if max_quantity is not None and (line[0] if line is not None else 0) + quantity > max_quantity:
+            raise TooManyCopies(book_id, max_quantity)
+        # A line whose reservation was released holds no copies; take all of them again.
+        unreserved = line[0] if line is not None and line[1] is None else 0
+        reserve(book_id, quantity + unreserved)
+        until = reservation_expiry()
+        lines = CartItem.objects.filter(cart=cart, book_id=book_id)
+        if line is not None:
+            lines.update(quantity=F('quantity') + quantity, reserved_until=until)
+            return
+        try:
+            with transaction.atomic():
+                CartItem.objects.create(cart=cart, book_id=book_id, quantity=quantity, reserved_until=until)
+        except IntegrityError:
+            # Another request inserted (and reserved) the line first; add to it instead.
+            if max_quantity is not None:
+                lines = lines.filter(quantity__lte=max_quantity - quantity)
+            if not lines.update(quantity=F('quantity') + quantity, reserved_until=until):
+                raise TooManyCopies(book_id, max_quantity)
+
+
+def set_quantity(cart, book_id, quantity):
+    """Sets a line's quantity outright, reserving or releasing the difference; zero or less removes the line."""
+    if quantity <= 0:
+        remove_item(cart, book_id)
+        return
+    try:
+        _set_quantity(cart, book_id, quantity)
+    except IntegrityError:
+        # Another request inserted the line first; the whole change was rolled back, so redo it.
+        _set_quantity(cart, book_id, quantity)
+
+
+def _set_quantity(cart, book_id, quantity):
+    with transaction.atomic():
+        line = _held_line(cart, book_id)
+        held = line[0] if line is not None and line[1] is not None else 0
+        if quantity > held:
+            reserve(book_id, quantity - held)
+        else:
+            release(book_id, held - quantity)
+        until = reservation_expiry()
+        if line is not None:
+            CartItem.objects.filter(cart=cart, book_id=book_id).update(quantity=quantity, reserved_until=until)
+        else:
+            CartItem.objects.create(cart=cart, book_id=book_id, quantity=quantity, reserved_until=until)
+
+
+def remove_item(cart, book_id):
+    """Removes a line and returns the copies it held to stock."""
+    with transaction.atomic():
+        line = _held_line(cart, book_id)
+        if line is None:
+            return
+        CartItem.objects.filter(cart=cart, book_id=book_id).delete()
+        if line[1] is not None:
+            release(book_id, line[0])
+
+
+def cart_lines(cart):
+    """Cart lines with their books and SQL-computed `line_total`, ordered by title."""
+    if cart is None:
+        return CartItem.objects.none()
+    return (
+        CartItem.objects.filter(cart=cart)
+        .select_related('book')
+        .only('id', 'quantity', 'book__id', 'book__title', 'book__price')
+        .annotate(line_total=LINE_TOTAL)
+        .order_by('book__title', 'book_id')
+    )
+
+
+def cart_total(cart):
+    """The cart's total as an exact Decimal, computed by one SUM aggregate."""
+    if cart is None:
+        return Decimal('0.00')
+    return to_money(CartItem.objects.filter(cart=cart).aggregate(total=Sum(LINE_TOTAL))['total'])
+
+
+def cart_summary(cart):
+    """Line count, item count and total for the cart in one aggregate query."""
+    if cart is None:
+        return _summary(None)
+    return _summary(CartItem.objects.filter(cart=cart).aggregate(**SUMMARY))
+
+
+async def acart_summary(cart):
+    """cart_summary() for async views."""
+    if cart is None:
+        return _summary(None)
+    return _summary(await CartItem.objects.filter(cart=cart).aaggregate(**SUMMARY))
+
+
+def _summary(summary):
+    if summary is None:
+        return {'lines': 0, 'items': 0, 'total': Decimal('0.00')}
+    return {
+        'lines': summary['lines'],
+        'items': summary['items'] or 0,
+        'total': to_money(summary['total']),
+    }
+
+
+def line_summary(cart, book_id):
+    """A single cart line as a dict, or None if the book is not in the cart."""
+    if cart is None:
+        return None
+    line = (
+        CartItem.objects.filter(cart=cart, book_id=book_id)
+        .annotate(line_total=LINE_TOTAL)
+        .values('book_id', 'book__title', 'book__price', 'quantity', 'line_total')
+        .first()
+    )
+    if line is not None:
+        line['line_total'] = to_money(line['line_total'])
+    return line
+
+
+def clear_cart(cart):
+    """Empties the cart and returns the copies its lines held to stock."""
+    if cart is None:
+        return
+    with transaction.atomic():
+        lines = CartItem.objects.select_for_update().filter(cart=cart)
+        held = dict(lines.filter(reserved_until__isnull=False).values_list('book_id', 'quantity'))
+        lines.delete()
+        release_many(held)
+
+
+def merge_anonymous_cart(session_key, user):
+    """
+    Moves the cart of an anonymous session into `user`'s cart after login.
+
+    Call with the session key captured *before* login(), which rotates it.
+    The lines are merged in a fixed number of queries however many there are;
+    lines whose book has too few copies left are dropped.
+    """
+    if not session_key:
+        return
+    with transaction.atomic():
+        anonymous_cart = Cart.objects.filter(session_key=session_key, user__isnull=True).first()
+        if anonymous_cart is None:
+            return
+        user_cart = Cart.objects.filter(user=user).first()
+        if user_cart is None:
+            # Nothing to merge into: the anonymous cart simply changes owner.
+            anonymous_cart.user = user
+            anonymous_cart.session_key = None
+            anonymous_cart.save(update_fields=['user', 'session_key'])
+            return
+        lines = list(anonymous_cart.items.values_list('book_id', 'quantity', 'reserved_until'))
+        anonymous_cart.delete()
+        try:
+            with transaction.atomic():
+                _merge_lines(user_cart, lines)
+        except (_StockChanged, IntegrityError):
+            # Stock or the user's cart changed under the merge; redo it one line at a time.
+            _merge_lines_one_by_one(user_cart, lines)
+
+
+class _StockChanged(Exception):
+    pass
+
+
+def _merge_lines(user_cart, lines):
+    """Merges the lines in one pass: a stock read, one conditional UPDATE of stock, a bulk update and insert."""
+    held = {book_id: quantity for book_id, quantity, until in lines if until is not None}
+    existing = {
+        book_id: (pk, quantity, until)
+        for book_id, pk, quantity, until in CartItem.objects.select_for_update()
+        .filter(cart=user_cart, book_id__in=[book_id for book_id, _, _ in lines])
+        .values_list('book_id', 'pk', 'quantity', 'reserved_until')
+    }
+    # Copies to take from stock per book: the merged line's need, less what the anonymous line held.
+    taken = {}
+    for book_id, quantity, _ in lines:
+        line = existing.get(book_id)
+        # A user's line whose reservation lapsed takes its own copies again too.
+        unreserved = line[1] if line is not None and line[2] is None else 0
+        taken[book_id] = quantity + unreserved - held.get(book_id, 0)
+    needed = [book_id for book_id, count in taken.items() if count > 0]
+    stock = dict(Book.objects.filter(pk__in=needed).values_list('pk', 'stock')) if needed else {}
+    dropped = {book_id for book_id in needed if stock.get(book_id, 0) < taken[book_id]}
+    for book_id in dropped:
+        # The line is dropped; its anonymous copies still go back.
+        taken[book_id] = -held.get(book_id, 0)
+    taken = {book_id: count for book_id, count in taken.items() if count}
+    if taken:
+        change = Case(*[When(pk=book_id, then=Value(count)) for book_id, count in taken.items()])
+        minimum = Case(*[When(pk=book_id, then=Value(max(count, 0))) for book_id, count in taken.items()])
+        if Book.objects.filter(pk__in=taken, stock__gte=minimum).update(stock=F('stock') - change) != len(taken):
+            raise _StockChanged
+
+    until = reservation_expiry()
+    merged, added = [], []
+    for book_id, quantity, _ in lines:
+        if book_id in dropped:
+            continue
+        line = existing.get(book_id)
+        if line is not None:
+            merged.append(CartItem(pk=line[0], quantity=line[1] + quantity, reserved_until=until))
+        else:
+            added.append(CartItem(cart=user_cart, book_id=book_id, quantity=quantity, reserved_until=until))
+    if merged:
+        CartItem.objects.bulk_update(merged, ['quantity', 'reserved_until'])
+    if added:
+        CartItem.objects.bulk_create(added)
+
+
+def _merge_lines_one_by_one(user_cart, lines):
+    # Give the anonymous lines' copies back, then take them again for the user's lines,
+    # whose own reservations may have lapsed.
+    release_many({book_id: quantity for book_id, quantity, until in lines if until is not None})
+    for book_id, quantity, _ in lines:
+        try:
+            add_item(user_cart, book_id, quantity)
+        except OutOfStock:
+            # Somebody else bought the copies in the meantime; the line is dropped.
+            pass
@@ -0,0 +1,117 @@
+import hashlib
+
+from django.conf import settings
+from django.db.models import Max
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+from .cache import get_all_books_version, get_book_version, get_catalog_version
+from .models import Book
+
+
+class Validators:
+    """The ETag and Last-Modified a page is served with."""
+
+    def __init__(self, etag, last_modified):
+        self.etag = etag
+        self.last_modified = last_modified
+
+    @property
+    def last_modified_timestamp(self):
+        return int(self.last_modified.timestamp()) if self.last_modified else None
+
+
+class PublicPageMixin:
+    """
+    Serves a view's pages identically to every visitor, so shared caches can store them.
+
+    Templates leave out the visitor's nav menu, messages and CSRF tokens when
+    `request.public_page` is set, and the page fills them in from SessionView.
+    Nothing then reads the session or the user, so the response has no
+    Set-Cookie and no Vary: Cookie.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        request.public_page = True
+        if self.view_is_async:
+            return self._adispatch_public(request, *args, **kwargs)
+        return self.mark_public(request, super().dispatch(request, *args, **kwargs))
+
+    async def _adispatch_public(self, request, *args, **kwargs):
+        return self.mark_public(request, await super().dispatch(request, *args, **kwargs))
+
+    def mark_public(self, request, response):
+        if request.method in ('GET', 'HEAD') and response.status_code in (200, 304):
+            patch_cache_control(response, public=True, max_age=getattr(settings, 'PUBLIC_PAGE_MAX_AGE', 60))
+        return response
+
+
+def _book_validators(book_id, updated_at, content_hash):
+    # Bulk staff actions clear content_hash (it cannot be computed in SQL), so
+    # fall back to the modification time until the book is saved again.
+    fingerprint = content_hash or f'u{updated_at.timestamp():.6f}'
+    # Recomputed recommendations, and edits to a recommended book, change the
+    # page without touching the book; both bump its cached detail version.
+    return Validators(f'{fingerprint}-{get_book_version(book_id)}.{get_all_books_version()}', updated_at)
+
+
+def book_validators(book_id):
+    """Validators for a book's detail page, from a single primary-key lookup. None if missing."""
+    row = Book.objects.filter(pk=book_id).values_list('updated_at', 'content_hash').first()
+    if row is None:
+        return None
+    return _book_validators(book_id, *row)
+
+
+async def abook_validators(book_id):
+    """book_validators() for async views."""
+    row = await Book.objects.filter(pk=book_id).values_list('updated_at', 'content_hash').afirst()
+    if row is None:
+        return None
+    return _book_validators(book_id, *row)
+
+
+def catalog_validators(*parts):
+    """
+    Validators for a catalog list page from one indexed aggregate over Book.
+
+    MAX(updated_at) catches edits and additions. Deletions are caught through
+    the catalog cache version, which every staff delete bumps; a COUNT(*) would
+    scan the whole table. Only the ETag carries both, so list pages send no
+    Last-Modified: a deletion does not move MAX(updated_at), and a client
+    revalidating with If-Modified-Since would keep the deleted book.
+    """
+    last_modified = Book.objects.aggregate(last_modified=Max('updated_at'))['last_modified']
+    return _catalog_validators(last_modified, parts)
+
+
+async def acatalog_validators(*parts):
+    """catalog_validators() for async views."""
+    last_modified = (await Book.objects.aaggregate(last_modified=Max('updated_at')))['last_modified']
+    return _catalog_validators(last_modified, parts)
+
+
+def _catalog_validators(last_modified, parts):
+    fingerprint = repr((get_catalog_version(), last_modified, parts))
+    etag = hashlib.md5(fingerprint.encode('utf-8')).hexdigest()
+    return Validators(etag, None)
+
+
+def not_modified_response(request, validators):
+    """Returns a 304 (or 412) response if the client's copy is current, otherwise None."""
+    if validators is None:
+        return None
+    return get_conditional_response(
+        request,
+        etag=quote_etag(validators.etag),
+        last_modified=validators.last_modified_timestamp,
+    )
+
+
+def set_validator_headers(response, validators):
+    if validators is None:
+        return response
+    response.headers['ETag'] = quote_etag(validators.etag)
+    if validators.last_modified:
+        response.headers['Last-Modified'] = http_date(validators.last_modified_timestamp)
+    return response
@@ -0,0 +1,123 @@
+"""
+SQLite connection tuning, query observers and SQLITE_BUSY handling.
+
+configure_sqlite() runs on every new connection (wired up in BookstoreConfig.ready)
+and applies settings.SQLITE_PRAGMAS. observe_queries() passes the queries run in
+a context to an execute wrapper, whichever thread runs them. RetryOnBusyMixin
+re-runs the write requests of a view when SQLite still reports the database as
+locked after busy_timeout.
+"""
+import logging
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial, wraps
+
+from django.conf import settings
+from django.db import OperationalError, connections
+
+
+logger = logging.getLogger('bookstore.db')
+
+# Applied in this order: journal_mode first, since some PRAGMAs behave differently under WAL.
+PRAGMA_ORDER = ('journal_mode', 'synchronous', 'busy_timeout', 'cache_size', 'mmap_size', 'temp_store')
+
+BUSY_MESSAGES = ('database is locked', 'database table is locked', 'database is busy')
+
+
+def sqlite_pragmas():
+    return getattr(settings, 'SQLITE_PRAGMAS', {})
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """connection_created receiver applying settings.SQLITE_PRAGMAS to SQLite connections."""
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = sqlite_pragmas()
+    if not pragmas:
+        return
+    names = [name for name in PRAGMA_ORDER if name in pragmas]
+    names += sorted(name for name in pragmas if name not in PRAGMA_ORDER)
+    with connection.cursor() as cursor:
+        for name in names:
+            cursor.execute(f'PRAGMA {name} = {pragmas[name]}')
+
+
+_query_observers = ContextVar('bookstore_query_observers', default=())
+
+
+def _notify_observers(execute, sql, params, many, context):
+    for observer in reversed(_query_observers.get()):
+        execute = partial(observer, execute)
+    return execute(sql, params, many, context)
+
+
+def install_query_observers(sender, connection, **kwargs):
+    """connection_created receiver routing the connection's queries through observe_queries()."""
+    if _notify_observers not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_notify_observers)
+
+
+@contextmanager
+def observe_queries(observer):
+    """
+    Passes every query run in this context to `observer`, an execute wrapper.
+
+    Unlike connection.execute_wrapper(), which only sees the current thread's
+    connections, this follows the context: async views run their queries
+    through sync_to_async() on another thread, which inherits it.
+    """
+    token = _query_observers.set(_query_observers.get() + (observer,))
+    try:
+        yield
+    finally:
+        _query_observers.reset(token)
+
+
+def is_busy_error(exc):
+    return isinstance(exc, OperationalError) and any(msg in str(exc).lower() for msg in BUSY_MESSAGES)
+
+
+def _in_transaction():
+    return any(conn.in_atomic_block for conn in connections.all(initialized_only=True))
+
+
+def retry_on_busy(func=None, attempts=None, delay=None):
+    """
+    Retries `func` when SQLite reports the database as locked.
+
+    Only retries outside transactions: inside one the failed statement's
+    transaction is already broken, so the caller has to start over.
+    """
+    if func is None:
+        return lambda f: retry_on_busy(f, attempts=attempts, delay=delay)
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        max_attempts = attempts or getattr(settings, 'SQLITE_BUSY_RETRIES', 3)
+        base_delay = delay if delay is not None else getattr(settings, 'SQLITE_BUSY_RETRY_DELAY', 0.05)
+        for attempt in range(1, max_attempts + 1):
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as exc:
+                if not is_busy_error(exc) or attempt == max_attempts or _in_transaction():
+                    raise
+                # Jittered exponential backoff so competing writers do not retry in lockstep.
+                pause = base_delay * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+                logger.warning(
+                    "Database busy (attempt %d of %d), retrying in %.0f ms", attempt, max_attempts, pause * 1000
+                )
+                time.sleep(pause)
+
+    return wrapper
+
+
+class RetryOnBusyMixin:
+    """Retries a view's unsafe (writing) requests when the database is locked."""
+    retry_methods = ('post', 'put', 'patch', 'delete')
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method.lower() not in self.retry_methods:
+            return super().dispatch(request, *args, **kwargs)
+        return retry_on_busy(super().dispatch)(request, *args, **kwargs)
@@ -0,0 +1,35 @@
+import csv
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .filters import filter_books
+
+
+EXPORT_FIELDS = ['id', 'title', 'author', 'description', 'price', 'stock', 'updated_at']
+
+# Rows pulled from the database cursor per fetch while streaming.
+EXPORT_CHUNK_SIZE = 2000
+
+
+class Echo:
+    """A file-like object whose write() hands the line back instead of buffering it."""
+    def write(self, value):
+        return value
+
+
+def export_rows(**filters):
+    """Streams catalog rows as tuples, filtered in SQL, without materializing any Book."""
+    return filter_books(**filters).order_by('id').values_list(*EXPORT_FIELDS).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+
+def csv_lines(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def ndjson_lines(rows):
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    for row in rows:
+        yield encoder.encode(dict(zip(EXPORT_FIELDS, row))) + '\n'
@@ -0,0 +1,176 @@
+"""
+Author and price-band facet counts.
+
+BookFacet holds the number of books for every (author, price band) pair, plus
+the "any author" and "any price" roll-ups, so the author index and the book
+list filters read counts instead of running GROUP BY over Book. Every write
+that changes a book's author or price applies the difference here in the same
+transaction; `manage.py rebuild_facets` recounts from scratch to repair drift.
+"""
+from collections import Counter
+
+from django.db import connection, transaction
+from django.db.models import Case, CharField, Count, F, Q, Value, When
+from django.db.models.lookups import LessThan
+
+from .models import Book, BookFacet
+from .typeahead import normalize
+
+
+ANY = ''
+
+# (key, label, lowest price, first price above the band). Bounds are whole
+# dollars, so SQL compares them with prices as numbers.
+PRICE_BANDS = [
+    ('under-10', "Under $10", 0, 10),
+    ('10-25', "$10 to $25", 10, 25),
+    ('25-50', "$25 to $50", 25, 50),
+    ('50-100', "$50 to $100", 50, 100),
+    ('100-up', "$100 and up", 100, None),
+]
+BAND_LABELS = {key: label for key, label, _, _ in PRICE_BANDS}
+
+INITIALS = [chr(code) for code in range(ord('A'), ord('Z') + 1)] + ['#']
+
+# Keeps "IN (...)" lookups under SQLite's bound-parameter limit.
+LOOKUP_CHUNK_SIZE = 500
+
+
+def price_band(price):
+    for key, _, _, high in PRICE_BANDS:
+        if high is None or price < high:
+            return key
+    return PRICE_BANDS[-1][0]
+
+
+def band_filter(band):
+    """Q selecting the books in a price band; None for an unknown band."""
+    for key, _, low, high in PRICE_BANDS:
+        if key == band:
+            return Q(price__gte=low) & Q(price__lt=high) if high is not None else Q(price__gte=low)
+    return None
+
+
+def band_expression(price):
+    """SQL CASE mapping a price expression to its band key."""
+    return Case(
+        *[When(LessThan(price, Value(high)), then=Value(key)) for key, _, _, high in PRICE_BANDS if high is not None],
+        default=Value(PRICE_BANDS[-1][0]),
+        output_field=CharField(),
+    )
+
+
+def author_initial(author):
+    """The A-Z index letter an author is listed under ('#' for anything else)."""
+    initial = normalize(author)[:1].upper()
+    return initial if initial in INITIALS else '#'
+
+
+def _add(counts, author, band, number):
+    for key in ((author, band), (author, ANY), (ANY, band), (ANY, ANY)):
+        counts[key] += number
+
+
+def count_books(books):
+    """Facet counts of (author, price) pairs, e.g. books about to be written."""
+    counts = Counter()
+    for author, price in books:
+        _add(counts, author, price_band(price), 1)
+    return counts
+
+
+def count_queryset(books, author=F('author'), price=F('price')):
+    """
+    Facet counts of the books in a queryset, from one GROUP BY.
+
+    Passing the `author` or `price` expression of a pending bulk UPDATE counts
+    the books as they will be after it.
+    """
+    counts = Counter()
+    rows = (
+        books.order_by()
+        .annotate(facet_author=author, facet_band=band_expression(price))
+        .values('facet_author', 'facet_band')
+        .annotate(number=Count('id'))
+        .values_list('facet_author', 'facet_band', 'number')
+    )
+    for facet_author, band, number in rows:
+        _add(counts, facet_author, band, number)
+    return counts
+
+
+def count_ids(book_ids):
+    counts = Counter()
+    book_ids = list(book_ids)
+    for start in range(0, len(book_ids), LOOKUP_CHUNK_SIZE):
+        counts.update(count_queryset(Book.objects.filter(pk__in=book_ids[start:start + LOOKUP_CHUNK_SIZE])))
+    return counts
+
+
+def apply_counts(delta):
+    """
+    Adds {(author, band): number} to the facet table.
+
+    One executemany() upsert whatever the number of facets, plus a DELETE of
+    the facets that dropped to zero. Call inside the transaction that changes
+    the books.
+    """
+    changes = sorted(
+        (author, band, author_initial(author) if author else ANY, number)
+        for (author, band), number in delta.items() if number
+    )
+    if not changes:
+        return
+    quote = connection.ops.quote_name
+    table = quote(BookFacet._meta.db_table)
+    sql = (
+        f"INSERT INTO {table} ({quote('author')}, {quote('price_band')}, {quote('initial')}, {quote('book_count')}) "
+        f"VALUES (%s, %s, %s, %s) "
+        f"ON CONFLICT ({quote('author')}, {quote('price_band')}) "
+        f"DO UPDATE SET {quote('book_count')} = {table}.{quote('book_count')} + excluded.{quote('book_count')}"
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, changes)
+    if any(number < 0 for *_, number in changes):
+        BookFacet.objects.filter(book_count__lte=0).delete()
+
+
+def record_change(old=None, new=None):
+    """Applies one book's change; `old` and `new` are its (author, price), None when created or deleted."""
+    delta = count_books([new] if new else [])
+    delta.subtract(count_books([old] if old else []))
+    apply_counts(delta)
+
+
+def rebuild():
+    """Recounts every facet from Book. Returns the number of facet rows."""
+    with transaction.atomic():
+        BookFacet.objects.all().delete()
+        apply_counts(count_queryset(Book.objects.all()))
+        return BookFacet.objects.count()
+
+
+def band_counts(author=ANY):
+    """(total, [(band, label, count), ...]) for one author or the whole catalog, from one indexed query."""
+    counts = dict(BookFacet.objects.filter(author=author).values_list('price_band', 'book_count'))
+    return _band_counts(counts)
+
+
+async def aband_counts(author=ANY):
+    """band_counts() for async views."""
+    rows = BookFacet.objects.filter(author=author).values_list('price_band', 'book_count')
+    counts = {band: count async for band, count in rows}
+    return _band_counts(counts)
+
+
+def _band_counts(counts):
+    bands = [(key, label, counts.get(key, 0)) for key, label, _, _ in PRICE_BANDS]
+    return counts.get(ANY, 0), bands
+
+
+def authors_by_initial(initial, after=None, limit=100):
+    """Up to `limit` (author, book count) pairs listed under `initial`, after the author `after`."""
+    authors = BookFacet.objects.filter(price_band=ANY, initial=initial)
+    if after:
+        authors = authors.filter(author__gt=after)
+    return list(authors.order_by('author').values_list('author', 'book_count')[:limit])
@@ -0,0 +1,34 @@
+from .models import Book
+from .validation import clean_price
+
+
+def parse_book_filters(params):
+    """
+    Reads the staff catalog filters (author, min_price, max_price) from a QueryDict.
+
+    Returns (filters, error); filters only holds the ones that were given.
+    """
+    filters = {}
+    author = params.get('author', '').strip()
+    if author:
+        filters['author'] = author
+    for name in ('min_price', 'max_price'):
+        value = params.get(name, '').strip()
+        if value:
+            price, error = clean_price(value)
+            if error:
+                return {}, f"{name}: {error}"
+            filters[name] = price
+    return filters, None
+
+
+def filter_books(queryset=None, author=None, min_price=None, max_price=None):
+    """Applies the staff catalog filters to `queryset` (all books by default) in SQL."""
+    books = Book.objects.all() if queryset is None else queryset
+    if author:
+        books = books.filter(author__iexact=author)
+    if min_price is not None:
+        books = books.filter(price__gte=min_price)
+    if max_price is not None:
+        books = books.filter(price__lte=max_price)
+    return books
@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+
+
+class ConfigurablePBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    Django's PBKDF2-SHA256 hasher with the iteration count taken from
+    PASSWORD_HASH_ITERATIONS (Django's default when it is None).
+
+    It shares the pbkdf2_sha256 algorithm name, so it reads existing hashes.
+    A hash stored with a different count is rehashed with the current one at
+    the user's next successful login, by Django's check_password().
+    """
+
+    @property
+    def iterations(self):
+        return getattr(settings, 'PASSWORD_HASH_ITERATIONS', None) or PBKDF2PasswordHasher.iterations
@@ -0,0 +1,86 @@
+"""
+Liveness and readiness probes for load balancers and container orchestrators.
+
+HEALTH_LIVE_PATH answers as long as the process can serve requests at all.
+HEALTH_READY_PATH also reads one catalog row from every configured database,
+which proves the file is there, migrated and not locked, and answers 503 when
+any of them fails. HealthCheckMiddleware sits first in MIDDLEWARE, so probes
+skip sessions, auth and the request metrics, and are answered whatever Host
+header the prober sends.
+"""
+import logging
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, connections
+from django.http import JsonResponse
+from django.utils.cache import add_never_cache_headers
+
+from .models import Book
+
+
+logger = logging.getLogger('bookstore.health')
+
+
+def check_databases():
+    """{alias: 'ok' or 'error'} after reading one catalog row from every database."""
+    results = {}
+    for alias in connections:
+        try:
+            list(Book.objects.using(alias).values_list('pk', flat=True)[:1])
+        except DatabaseError as exc:
+            logger.error("Readiness check failed on database %r: %s", alias, exc)
+            results[alias] = 'error'
+        else:
+            results[alias] = 'ok'
+    return results
+
+
+def probe_response(status, **extra):
+    response = JsonResponse({'status': 'ok' if status == 200 else 'unavailable', **extra}, status=status)
+    add_never_cache_headers(response)
+    return response
+
+
+def readiness_response(databases):
+    healthy = all(result == 'ok' for result in databases.values())
+    return probe_response(200 if healthy else 503, databases=databases)
+
+
+class HealthCheckMiddleware:
+    """Answers GET and HEAD on the probe paths; passes every other request on."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.live_path = getattr(settings, 'HEALTH_LIVE_PATH', '/health/live/')
+        self.ready_path = getattr(settings, 'HEALTH_READY_PATH', '/health/ready/')
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def probe(self, request):
+        """'live', 'ready' or None for requests that are not probes."""
+        if request.method not in ('GET', 'HEAD'):
+            return None
+        return {self.live_path: 'live', self.ready_path: 'ready'}.get(request.path_info)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        probe = self.probe(request)
+        if probe == 'live':
+            return probe_response(200)
+        if probe == 'ready':
+            return readiness_response(check_databases())
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        probe = self.probe(request)
+        if probe == 'live':
+            return probe_response(200)
+        if probe == 'ready':
+            return readiness_response(await sync_to_async(check_databases)())
+        return await self.get_response(request)
@@ -0,0 +1,99 @@
+"""
+Stock reservations.
+
+Adding a book to a cart takes its copies out of Book.stock straight away and
+marks the cart line reserved until settings.CART_RESERVATION_SECONDS from now;
+every later change to the line renews it. Checkout consumes the reservation.
+Lines left alone longer are released by sweep_expired_reservations() (run
+`manage.py release_expired_reservations` periodically). A released line stays
+in the cart and reserves its copies again when it is next changed or checked out.
+
+Stock only ever changes through conditional UPDATEs
+(SET stock = stock - n WHERE stock >= n), so concurrent buyers can never take
+more copies than exist. Several books are always updated in book id order, so
+two transactions never wait on each other's rows.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.utils import timezone
+
+from .models import Book, CartItem
+
+
+DEFAULT_RESERVATION_SECONDS = 15 * 60
+
+
+class OutOfStock(Exception):
+    """Raised when fewer copies of a book are available than requested."""
+
+    def __init__(self, book_id, quantity):
+        self.book_id = book_id
+        self.quantity = quantity
+        super().__init__(f"Not enough copies of book {book_id} in stock for {quantity} more.")
+
+
+def reservation_expiry(now=None):
+    seconds = getattr(settings, 'CART_RESERVATION_SECONDS', DEFAULT_RESERVATION_SECONDS)
+    return (now or timezone.now()) + timedelta(seconds=seconds)
+
+
+def reserve(book_id, quantity):
+    """Takes `quantity` copies out of stock, or raises OutOfStock and takes none."""
+    if quantity <= 0:
+        return
+    taken = Book.objects.filter(pk=book_id, stock__gte=quantity).update(stock=F('stock') - quantity)
+    if not taken:
+        raise OutOfStock(book_id, quantity)
+
+
+def release(book_id, quantity):
+    """Puts `quantity` copies back into stock."""
+    if quantity > 0:
+        Book.objects.filter(pk=book_id).update(stock=F('stock') + quantity)
+
+
+def adjust_stock(book_id, delta):
+    """Adds `delta` copies to stock, or removes -delta; raises OutOfStock if fewer are left."""
+    if delta >= 0:
+        release(book_id, delta)
+    else:
+        reserve(book_id, -delta)
+
+
+def reserve_many(quantities):
+    """
+    Reserves {book_id: quantity} in book id order, all or nothing.
+
+    Call inside a transaction: when one book is short, OutOfStock is raised
+    and rolling back returns the copies already taken.
+    """
+    for book_id in sorted(quantities):
+        reserve(book_id, quantities[book_id])
+
+
+def release_many(quantities):
+    for book_id in sorted(quantities):
+        release(book_id, quantities[book_id])
+
+
+def sweep_expired_reservations(now=None):
+    """
+    Returns the copies held by lapsed cart lines to stock. Returns the number of lines released.
+
+    Two statements whatever the backlog: one UPDATE adds each book's expired
+    quantities back, one marks those lines as no longer reserved.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        expired = CartItem.objects.filter(reserved_until__lt=now)
+        held = (
+            expired.filter(book=OuterRef('pk'))
+            .values('book')
+            .annotate(total=Sum('quantity'))
+            .values('total')
+        )
+        Book.objects.filter(pk__in=expired.values('book')).update(stock=F('stock') + Subquery(held))
+        return expired.update(reserved_until=None)
@@ -0,0 +1,275 @@
+import asyncio
+import io
+import itertools
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from django.contrib.auth.models import User
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from bookstore import bench
+from bookstore.asgi_server import build_scope
+from bookstore.models import Book, Cart, CartItem
+
+
+MODES = ('wsgi', 'asgi-sync', 'asgi-async')
+
+# Benchmarked read paths: the sync route and its async counterpart.
+ROUTES = {
+    'book_list': ('book_list', 'async_book_list'),
+    'book_detail': ('book_detail', 'async_book_detail'),
+    'api_cart': ('api_cart', 'async_api_cart'),
+    'book_suggest': ('book_suggest', 'async_book_suggest'),
+}
+
+# Detail pages are requested for this many different books.
+DETAIL_BOOKS = 200
+HOST = 'testserver'
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares read throughput and latency at high concurrency for the sync views under WSGI, "
+        "the sync views under ASGI and the async views under ASGI, in process against a seeded "
+        "catalog; or load-tests a running server with --url."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=5000, help="Books in the seeded catalog.")
+        parser.add_argument('--concurrency', type=int, default=64, help="Requests in flight at once.")
+        parser.add_argument('--requests', type=int, default=2000, help="Timed requests per mode and route.")
+        parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES), help="Modes to compare.")
+        parser.add_argument('--routes', nargs='+', choices=sorted(ROUTES), default=list(ROUTES))
+        parser.add_argument(
+            '--url',
+            help="Load-test the server at this URL (e.g. one started with runasgi or runserver) "
+                 "instead of running the handlers in process.",
+        )
+        parser.add_argument(
+            '--paths', nargs='+', default=['/books/', '/async/books/'],
+            help="Paths requested with --url (default: /books/ /async/books/).",
+        )
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1 or options['requests'] < 1:
+            raise CommandError("--concurrency and --requests must be at least 1.")
+        if options['url']:
+            asyncio.run(self.load_test(options))
+            return
+        # A file database, since the handlers query it from many threads.
+        with tempfile.TemporaryDirectory() as directory:
+            with bench.bench_environment(test_database_name=Path(directory) / 'bench.sqlite3'):
+                bench.seed_catalog(options['size'])
+                cookie = self.prepare_shopper()
+                connections.close_all()
+                self.stdout.write(
+                    f"Catalog of {options['size']} books, {options['concurrency']} concurrent requests, "
+                    f"{options['requests']} requests per mode and route"
+                )
+                # Under load most requests would be logged as slow.
+                with override_settings(METRICS_SLOW_REQUEST_SECONDS=None):
+                    for route in options['routes']:
+                        for mode in options['modes']:
+                            self.run(mode, route, cookie, options)
+                        connections.close_all()
+
+    def prepare_shopper(self):
+        """Logs a shopper with a ten-line cart in and returns their Cookie header."""
+        user, _ = User.objects.get_or_create(username='bench-user')
+        cart, _ = Cart.objects.get_or_create(user=user)
+        CartItem.objects.bulk_create(
+            CartItem(cart=cart, book_id=pk, quantity=1)
+            for pk in Book.objects.order_by('id').values_list('id', flat=True)[:10]
+        )
+        client = Client()
+        client.force_login(user)
+        self.book_ids = list(Book.objects.order_by('?').values_list('id', flat=True)[:DETAIL_BOOKS])
+        return '; '.join(f'{name}={morsel.value}' for name, morsel in client.cookies.items())
+
+    def targets(self, route, mode):
+        """Request targets (path and query) for a route, sync or async."""
+        name = ROUTES[route][mode == 'asgi-async']
+        if route == 'book_detail':
+            return [reverse(f'bookstore:{name}', args=[pk]) for pk in self.book_ids]
+        if route == 'book_suggest':
+            return [f"{reverse(f'bookstore:{name}')}?q={prefix}" for prefix in ('gar', 'sto', 'cro', 'win')]
+        return [reverse(f'bookstore:{name}')]
+
+    def run(self, mode, route, cookie, options):
+        targets = self.targets(route, mode)
+        if mode == 'wsgi':
+            samples, errors, elapsed = self.run_wsgi(targets, cookie, options)
+        else:
+            samples, errors, elapsed = asyncio.run(self.run_asgi(targets, cookie, options))
+        self.report(f"{route} {mode}", samples, errors, elapsed)
+
+    def run_wsgi(self, targets, cookie, options):
+        """Sync views under WSGI: a thread per request in flight, as a threaded WSGI server runs them."""
+        handler = WSGIHandler()
+
+        def request(target):
+            path, _, query = target.partition('?')
+            environ = {
+                'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query, 'SCRIPT_NAME': '',
+                'SERVER_NAME': HOST, 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+                'HTTP_HOST': HOST, 'HTTP_COOKIE': cookie, 'REMOTE_ADDR': '127.0.0.1',
+                'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(),
+                'wsgi.errors': sys.stderr, 'wsgi.multithread': True, 'wsgi.multiprocess': False,
+                'wsgi.run_once': False,
+            }
+            status = []
+            response = handler(environ, lambda line, headers: status.append(int(line.split()[0])))
+            try:
+                for _ in response:
+                    pass
+            finally:
+                response.close()
+            return status[0]
+
+        counter = itertools.count()
+        samples, errors = [], []
+
+        def worker(seed):
+            rng = random.Random(seed)
+            try:
+                while next(counter) < options['requests']:
+                    target = rng.choice(targets)
+                    started = time.perf_counter()
+                    status = request(target)
+                    self.record(target, status, started, samples, errors)
+            finally:
+                connections.close_all()
+
+        for target in targets[:20]:
+            request(target)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(options['concurrency']) as executor:
+            for future in [executor.submit(worker, n) for n in range(options['concurrency'])]:
+                future.result()
+        return samples, errors, time.perf_counter() - started
+
+    async def run_asgi(self, targets, cookie, options):
+        """Sync or async views under ASGI, with `concurrency` requests in flight on one event loop."""
+        handler = ASGIHandler()
+        headers = [(b'host', HOST.encode()), (b'cookie', cookie.encode())]
+
+        async def request(target):
+            scope = build_scope('GET', target, '1.1', headers, ('127.0.0.1', 0), (HOST, 80))
+            messages = iter([{'type': 'http.request', 'body': b'', 'more_body': False}])
+            status = []
+
+            async def receive():
+                try:
+                    return next(messages)
+                except StopIteration:
+                    # Django stops listening for a disconnect once the response is sent.
+                    await asyncio.Event().wait()
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    status.append(message['status'])
+
+            await handler(scope, receive, send)
+            return status[0]
+
+        counter = itertools.count()
+        samples, errors = [], []
+
+        async def worker(seed):
+            rng = random.Random(seed)
+            while next(counter) < options['requests']:
+                target = rng.choice(targets)
+                started = time.perf_counter()
+                status = await request(target)
+                self.record(target, status, started, samples, errors)
+
+        for target in targets[:20]:
+            await request(target)
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(n) for n in range(options['concurrency'])))
+        return samples, errors, time.perf_counter() - started
+
+    def record(self, target, status, started, samples, errors):
+        if status >= 400:
+            errors.append(f"GET {target} answered {status}")
+        else:
+            samples.append((time.perf_counter() - started) * 1000)
+
+    def report(self, label, samples, errors, elapsed):
+        samples.sort()
+        self.stdout.write(
+            f"  {label:<28} {len(samples) / elapsed:>8.1f} req/s  p50 {bench.percentile(samples, 50):>8.2f} ms  "
+            f"p99 {bench.percentile(samples, 99):>8.2f} ms  errors {len(errors)}"
+        )
+        for error in sorted(set(errors))[:5]:
+            self.stdout.write(self.style.WARNING(f"    {error}"))
+
+    async def load_test(self, options):
+        """Keep-alive GETs over `concurrency` connections to a running server."""
+        url = urlsplit(options['url'])
+        if url.scheme != 'http' or not url.hostname:
+            raise CommandError("--url must be an http:// URL, e.g. http://127.0.0.1:8001.")
+        port = url.port or 80
+        self.stdout.write(
+            f"{options['url']}: {options['concurrency']} connections, {options['requests']} requests per path"
+        )
+        for path in options['paths']:
+            counter = itertools.count()
+            samples, errors = [], []
+
+            async def worker():
+                reader = writer = None
+                try:
+                    while next(counter) < options['requests']:
+                        if writer is None:
+                            reader, writer = await asyncio.open_connection(url.hostname, port)
+                        started = time.perf_counter()
+                        status, keep_alive = await http_get(reader, writer, url.netloc, path)
+                        self.record(path, status, started, samples, errors)
+                        if not keep_alive:
+                            writer.close()
+                            writer = None
+                except (ConnectionError, asyncio.IncompleteReadError) as exc:
+                    errors.append(f"GET {path}: {exc!r}")
+                finally:
+                    if writer is not None:
+                        writer.close()
+
+            started = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(options['concurrency'])))
+            self.report(path, samples, errors, time.perf_counter() - started)
+
+
+async def http_get(reader, writer, host, path):
+    """Sends one GET on an open connection and reads the response. Returns (status, keep-alive)."""
+    writer.write(f'GET {path} HTTP/1.1\r\nHost: {host}\r\n\r\n'.encode('latin-1'))
+    await writer.drain()
+    head = await reader.readuntil(b'\r\n\r\n')
+    status_line, *lines = head.decode('latin-1').split('\r\n')
+    headers = {}
+    for line in lines:
+        name, _, value = line.partition(':')
+        if name:
+            headers[name.strip().lower()] = value.strip().lower()
+    if 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+    elif headers.get('transfer-encoding') == 'chunked':
+        while True:
+            size = int((await reader.readuntil(b'\r\n')).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    else:
+        await reader.read()
+        return int(status_line.split()[1]), False
+    return int(status_line.split()[1]), headers.get('connection') != 'close'
@@ -0,0 +1,149 @@
+import queue
+import tempfile
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.models import Count, Sum
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from bookstore import bench
+from bookstore.inventory import reservation_expiry
+from bookstore.models import Book, Cart, CartItem, Order, OrderLine
+
+
+PRAGMAS = {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'busy_timeout': 5000}
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-tests checkout: many shoppers check out concurrently, each submitting the payment form "
+        "several times with the same idempotency key. Fails on duplicate or missing orders."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shoppers', type=int, default=200, help="Shoppers checking out.")
+        parser.add_argument('--lines', type=int, default=20, help="Lines in every shopper's cart.")
+        parser.add_argument('--submissions', type=int, default=2, help="Times each shopper submits the form.")
+        parser.add_argument('--threads', type=int, default=16, help="Concurrent clients.")
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as directory:
+            with bench.bench_environment(test_database_name=Path(directory) / 'bench.sqlite3'):
+                # Write transactions take the lock up front, as in the production profile.
+                connection.settings_dict.setdefault('OPTIONS', {})['transaction_mode'] = 'IMMEDIATE'
+                connections.close_all()
+                # Lock waits make many checkouts "slow"; keep them out of the output.
+                with override_settings(SQLITE_PRAGMAS=PRAGMAS, METRICS_SLOW_REQUEST_SECONDS=None):
+                    self.run(options)
+                connections.close_all()
+
+    def run(self, options):
+        bench.seed_catalog(max(options['lines'] * 5, 100))
+        book_ids = list(Book.objects.order_by('id').values_list('id', flat=True))
+        shoppers = self.create_shoppers(options['shoppers'], options['lines'], book_ids)
+        self.stdout.write(f"Checking out {len(shoppers)} carts of {options['lines']} lines...")
+
+        jobs = queue.Queue()
+        for user, cookies, _ in shoppers:
+            for _ in range(options['submissions']):
+                jobs.put((user, cookies, f'checkout-{user.pk}'))
+
+        results = Counter()
+        timings = []
+        lock = threading.Lock()
+
+        def worker():
+            try:
+                while True:
+                    try:
+                        user, cookies, key = jobs.get_nowait()
+                    except queue.Empty:
+                        return
+                    client = Client(raise_request_exception=False)
+                    client.cookies.update(cookies)
+                    started = time.perf_counter()
+                    response = client.post(reverse('bookstore:payment'), {'idempotency_key': key})
+                    elapsed = (time.perf_counter() - started) * 1000
+                    with lock:
+                        timings.append(elapsed)
+                        results[response.status_code] += 1
+            finally:
+                connections.close_all()
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=worker) for _ in range(options['threads'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        submissions = sum(results.values())
+        self.stdout.write(
+            f"{submissions} submissions in {elapsed:.2f}s ({submissions / elapsed:.0f}/s), "
+            f"p50 {bench.percentile(sorted(timings), 50):.1f} ms, p95 {bench.percentile(sorted(timings), 95):.1f} ms, "
+            f"status codes {dict(results)}"
+        )
+        self.check_orders(shoppers)
+        self.report_queries(book_ids)
+
+    def create_shoppers(self, count, lines, book_ids):
+        shoppers = []
+        for number in range(count):
+            user = User.objects.create_user(f'shopper-{number}')
+            cart = Cart.objects.create(user=user)
+            picks = book_ids[number % len(book_ids):][:lines] or book_ids[:lines]
+            CartItem.objects.bulk_create(CartItem(cart=cart, book_id=pk, quantity=1 + number % 3) for pk in picks)
+            client = Client()
+            client.force_login(user)
+            shoppers.append((user, client.cookies, len(picks)))
+        return shoppers
+
+    def check_orders(self, shoppers):
+        problems = []
+        per_user = dict(Order.objects.values_list('user').annotate(orders=Count('id')).values_list('user', 'orders'))
+        duplicates = [pk for pk, orders in per_user.items() if orders > 1]
+        missing = [user.pk for user, _, _ in shoppers if user.pk not in per_user]
+        if duplicates:
+            problems.append(f"{len(duplicates)} shoppers have more than one order")
+        if missing:
+            problems.append(f"{len(missing)} shoppers have no order")
+        line_count = OrderLine.objects.count()
+        expected_lines = sum(lines for _, _, lines in shoppers)
+        if line_count != expected_lines:
+            problems.append(f"{line_count} order lines instead of {expected_lines}")
+        if CartItem.objects.exists():
+            problems.append(f"{CartItem.objects.count()} cart lines were left behind")
+        # The shoppers' lines start unreserved, so every copy ordered was taken from stock at checkout.
+        ordered = OrderLine.objects.aggregate(copies=Sum('quantity'))['copies'] or 0
+        taken = Book.objects.count() * bench.SEED_STOCK - Book.objects.aggregate(copies=Sum('stock'))['copies']
+        if taken != ordered:
+            problems.append(f"{ordered} copies ordered but stock fell by {taken}")
+        if problems:
+            raise CommandError("Checkout load test failed: " + "; ".join(problems) + ".")
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(per_user)} orders with {line_count} lines, no duplicates, every cart emptied, stock matches."
+        ))
+
+    def report_queries(self, book_ids):
+        # Queries for one checkout, for a small and a large cart: they should be equal.
+        counts = []
+        for lines in (1, min(100, len(book_ids))):
+            user = User.objects.create_user(f'probe-{lines}')
+            cart = Cart.objects.create(user=user)
+            CartItem.objects.bulk_create(
+                CartItem(cart=cart, book_id=pk, reserved_until=reservation_expiry()) for pk in book_ids[:lines]
+            )
+            client = Client()
+            client.force_login(user)
+            with CaptureQueriesContext(connection) as captured:
+                client.post(reverse('bookstore:payment'), {'idempotency_key': 'probe'})
+            counts.append((lines, len(captured)))
+        self.stdout.write("Queries per checkout: " + ", ".join(f"{n} with {lines} lines" for lines, n in counts))
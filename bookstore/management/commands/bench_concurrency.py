@@ -0,0 +1,132 @@
+import random
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from bookstore import bench
+from bookstore.models import Book
+
+
+# Journal settings compared by the benchmark. Both wait up to five seconds for a lock.
+PROFILES = {
+    'rollback': {'journal_mode': 'DELETE', 'synchronous': 'FULL', 'busy_timeout': 5000},
+    'wal': {
+        'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'busy_timeout': 5000,
+        'cache_size': -64000, 'mmap_size': 268435456,
+    },
+}
+
+# Catalog reads go straight to the database; the page cache would hide the locking.
+# The other aliases (sessions, login throttle) keep their configured backends.
+NO_CACHE = {**settings.CACHES, 'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures catalog read throughput and latency while staff edits and cart writes run "
+        "concurrently, under the rollback journal and under WAL."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=5000, help="Books in the seeded catalog.")
+        parser.add_argument('--readers', type=int, default=4, help="Threads requesting catalog pages.")
+        parser.add_argument('--writers', type=int, default=2, help="Threads editing books and carts.")
+        parser.add_argument('--duration', type=float, default=5.0, help="Seconds to run each profile.")
+        parser.add_argument(
+            '--profiles', nargs='+', choices=sorted(PROFILES), default=['rollback', 'wal'],
+            help="SQLite journal profiles to compare.",
+        )
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as directory:
+            with bench.bench_environment(test_database_name=Path(directory) / 'bench.sqlite3'):
+                bench.seed_catalog(options['size'])
+                self.book_ids = list(Book.objects.values_list('id', flat=True))
+                self.staff, _ = User.objects.get_or_create(username='bench-staff', defaults={'is_staff': True})
+                self.shopper, _ = User.objects.get_or_create(username='bench-user')
+                for profile in options['profiles']:
+                    self.run_profile(profile, options)
+
+    def run_profile(self, profile, options):
+        # PRAGMAs are applied as connections open, so start again from closed connections.
+        connections.close_all()
+        with override_settings(SQLITE_PRAGMAS=PROFILES[profile], CACHES=NO_CACHE):
+            stop = threading.Event()
+            start = threading.Barrier(options['readers'] + options['writers'] + 1)
+            reads, writes, errors = [], [], []
+            threads = [
+                threading.Thread(target=self.reader, args=(start, stop, reads, errors))
+                for _ in range(options['readers'])
+            ] + [
+                threading.Thread(target=self.writer, args=(start, stop, writes, errors, n))
+                for n in range(options['writers'])
+            ]
+            for thread in threads:
+                thread.start()
+            start.wait()
+            time.sleep(options['duration'])
+            stop.set()
+            for thread in threads:
+                thread.join()
+            connections.close_all()
+
+        duration = options['duration']
+        self.stdout.write(
+            f"{profile:<9} reads {len(reads) / duration:>7.1f}/s  p50 {bench.percentile(sorted(reads), 50):>7.2f} ms  "
+            f"p95 {bench.percentile(sorted(reads), 95):>8.2f} ms | writes {len(writes) / duration:>6.1f}/s  "
+            f"p95 {bench.percentile(sorted(writes), 95):>8.2f} ms | errors {len(errors)}"
+        )
+        for error in sorted(set(errors))[:5]:
+            self.stdout.write(self.style.WARNING(f"  {error}"))
+
+    def run_requests(self, start, stop, samples, errors, next_request, user=None):
+        client = Client(raise_request_exception=False)
+        rng = random.Random(threading.get_ident())
+        try:
+            if user:
+                client.force_login(user)
+            start.wait()
+            while not stop.is_set():
+                method, url, data = next_request(rng)
+                started = time.perf_counter()
+                response = getattr(client, method)(url, data)
+                elapsed = (time.perf_counter() - started) * 1000
+                if response.status_code >= 500:
+                    errors.append(f"{method.upper()} {url} answered {response.status_code}")
+                else:
+                    samples.append(elapsed)
+        finally:
+            connections.close_all()
+
+    def reader(self, start, stop, samples, errors):
+        def next_request(rng):
+            book_id = rng.choice(self.book_ids)
+            choice = rng.random()
+            if choice < 0.5:
+                return 'get', reverse('bookstore:book_detail', args=[book_id]), None
+            if choice < 0.8:
+                return 'get', reverse('bookstore:book_list'), None
+            return 'get', reverse('bookstore:book_search'), {'q': rng.choice(['garden', 'storm', 'crown'])}
+
+        self.run_requests(start, stop, samples, errors, next_request)
+
+    def writer(self, start, stop, samples, errors, number):
+        # Even writers edit books as staff, odd ones fill a shopper's cart.
+        staff = number % 2 == 0
+
+        def next_request(rng):
+            book_id = rng.choice(self.book_ids)
+            if staff:
+                data = {'title': f"Edited {book_id}", 'author': 'Bench Author', 'price': f"{rng.randint(1, 99)}.00"}
+                return 'post', reverse('bookstore:admin_book_update', args=[book_id]), data
+            return 'post', reverse('bookstore:add_to_cart', args=[book_id]), {}
+
+        self.run_requests(start, stop, samples, errors, next_request, self.staff if staff else self.shopper)
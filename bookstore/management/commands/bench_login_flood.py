@@ -0,0 +1,178 @@
+import io
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import override_settings
+from django.urls import reverse
+
+from bookstore import bench
+from bookstore.models import Book
+
+
+HOST = 'testserver'
+# A fixed CSRF secret, sent as both the cookie and the form field.
+CSRF_SECRET = 'benchfloodcsrfsecret0123456789ab'
+# Catalog pages the readers request.
+DETAIL_BOOKS = 200
+
+# (label, login flood running, throttling and hashing slots on)
+PHASES = (
+    ('baseline', False, True),
+    ('flood, unprotected', True, False),
+    ('flood, protected', True, True),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures catalog latency while a flood of login attempts arrives, with and without "
+        "login throttling and the password hashing cap. Readers and attackers share one pool "
+        "of server threads, as in a gunicorn gthread worker."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=2000, help="Books in the seeded catalog.")
+        parser.add_argument('--threads', type=int, default=4, help="Server threads shared by all requests.")
+        parser.add_argument('--readers', type=int, default=4, help="Clients browsing the catalog.")
+        parser.add_argument('--attackers', type=int, default=8, help="Clients posting login attempts.")
+        parser.add_argument('--addresses', type=int, default=50, help="Client addresses the attackers rotate.")
+        parser.add_argument('--usernames', type=int, default=5, help="Usernames the attackers guess passwords for.")
+        parser.add_argument('--duration', type=float, default=10.0, help="Seconds per phase.")
+        parser.add_argument(
+            '--iterations', type=int,
+            help="PBKDF2 iterations for the attacked accounts (default: PASSWORD_HASH_ITERATIONS).",
+        )
+
+    def handle(self, *args, **options):
+        if min(options['threads'], options['readers'], options['attackers'], options['addresses'],
+               options['usernames']) < 1 or options['duration'] <= 0:
+            raise CommandError("Counts and --duration must be positive.")
+        iterations = options['iterations'] or getattr(settings, 'PASSWORD_HASH_ITERATIONS', None)
+        # A file database, since the handler queries it from many threads.
+        with tempfile.TemporaryDirectory() as directory:
+            with bench.bench_environment(test_database_name=Path(directory) / 'bench.sqlite3'), \
+                    override_settings(PASSWORD_HASH_ITERATIONS=iterations, METRICS_SLOW_REQUEST_SECONDS=None):
+                bench.seed_catalog(options['size'])
+                self.prepare(options)
+                connections.close_all()
+                self.stdout.write(
+                    f"Catalog of {options['size']} books; {options['threads']} server threads, "
+                    f"{options['readers']} readers, {options['attackers']} attackers from "
+                    f"{options['addresses']} addresses on {options['usernames']} accounts; "
+                    f"{options['duration']:g} s per phase"
+                )
+                for label, flood, protected in PHASES:
+                    unprotected = {} if protected else {'AUTH_THROTTLE_RATES': {}, 'PASSWORD_HASH_CONCURRENCY': None}
+                    with override_settings(**unprotected):
+                        caches[settings.AUTH_THROTTLE_CACHE_ALIAS].clear()
+                        self.run(label, flood, options)
+                    connections.close_all()
+
+    def prepare(self, options):
+        """Creates the attacked accounts (hashing one password, shared by all) and the reader targets."""
+        first = User.objects.create_user('bench-user-0', password='correct horse battery staple')
+        User.objects.bulk_create(
+            User(username=f'bench-user-{n}', password=first.password) for n in range(1, options['usernames'])
+        )
+        self.usernames = [f'bench-user-{n}' for n in range(options['usernames'])]
+        book_ids = list(Book.objects.order_by('?').values_list('id', flat=True)[:DETAIL_BOOKS])
+        self.targets = [reverse('bookstore:book_list')] + [
+            reverse('bookstore:book_detail', args=[pk]) for pk in book_ids
+        ]
+        self.login_path = reverse('bookstore:login')
+
+    def run(self, label, flood, options):
+        handler = WSGIHandler()
+        deadline = time.perf_counter() + options['duration']
+        samples, errors, logins = [], [], Counter()
+        addresses = [f'10.{n // 65536 % 256}.{n // 256 % 256}.{n % 256}' for n in range(options['addresses'])]
+
+        def request(method, target, remote_addr, body=b''):
+            path, _, query = target.partition('?')
+            environ = {
+                'REQUEST_METHOD': method, 'PATH_INFO': path, 'QUERY_STRING': query, 'SCRIPT_NAME': '',
+                'SERVER_NAME': HOST, 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+                'HTTP_HOST': HOST, 'HTTP_COOKIE': f'{settings.CSRF_COOKIE_NAME}={CSRF_SECRET}',
+                'REMOTE_ADDR': remote_addr, 'CONTENT_TYPE': 'application/x-www-form-urlencoded',
+                'CONTENT_LENGTH': str(len(body)), 'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http',
+                'wsgi.input': io.BytesIO(body), 'wsgi.errors': sys.stderr, 'wsgi.multithread': True,
+                'wsgi.multiprocess': False, 'wsgi.run_once': False,
+            }
+            status = []
+            response = handler(environ, lambda line, headers: status.append(int(line.split()[0])))
+            try:
+                for _ in response:
+                    pass
+            finally:
+                response.close()
+            return status[0]
+
+        def reader(pool, seed):
+            rng = random.Random(seed)
+            while time.perf_counter() < deadline:
+                target = rng.choice(self.targets)
+                started = time.perf_counter()
+                status = pool.submit(request, 'GET', target, '192.0.2.1').result()
+                if status >= 400:
+                    errors.append(f"GET {target} answered {status}")
+                else:
+                    samples.append((time.perf_counter() - started) * 1000)
+
+        def attacker(pool, seed):
+            rng = random.Random(seed)
+            while time.perf_counter() < deadline:
+                body = urlencode({
+                    'csrfmiddlewaretoken': CSRF_SECRET,
+                    'username': rng.choice(self.usernames),
+                    'password': f'guess-{rng.random()}',
+                }).encode()
+                address = rng.choice(addresses)
+                logins[pool.submit(request, 'POST', self.login_path, address, body).result()] += 1
+
+        def close_connections(barrier):
+            # The barrier holds each server thread until all have one of these calls.
+            barrier.wait()
+            connections.close_all()
+
+        with ThreadPoolExecutor(options['threads']) as pool:
+            for target in self.targets[:20]:
+                pool.submit(request, 'GET', target, '192.0.2.1').result()
+            clients = [threading.Thread(target=reader, args=(pool, n)) for n in range(options['readers'])]
+            if flood:
+                clients += [
+                    threading.Thread(target=attacker, args=(pool, 1000 + n)) for n in range(options['attackers'])
+                ]
+            started = time.perf_counter()
+            for client in clients:
+                client.start()
+            for client in clients:
+                client.join()
+            elapsed = time.perf_counter() - started
+            barrier = threading.Barrier(options['threads'])
+            for future in [pool.submit(close_connections, barrier) for _ in range(options['threads'])]:
+                future.result()
+
+        samples.sort()
+        self.stdout.write(
+            f"  {label:<20} {len(samples) / elapsed:>7.1f} req/s  p50 {bench.percentile(samples, 50):>8.2f} ms  "
+            f"p95 {bench.percentile(samples, 95):>8.2f} ms  errors {len(errors)}"
+        )
+        if flood:
+            self.stdout.write(
+                "    login attempts: " + ', '.join(f"{count} x {status}" for status, count in sorted(logins.items()))
+            )
+        for error in sorted(set(errors))[:5]:
+            self.stdout.write(self.style.WARNING(f"    {error}"))
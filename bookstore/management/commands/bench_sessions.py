@@ -0,0 +1,69 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from bookstore import bench
+from bookstore.models import Book
+
+
+# Django's stock database sessions, which save every modified session, as the "before".
+STOCK_PROFILE = {
+    'SESSION_ENGINE': 'django.contrib.sessions.backends.db',
+    'MESSAGE_STORAGE': 'django.contrib.messages.storage.fallback.FallbackStorage',
+}
+
+FLOWS = (
+    ('add_to_cart', 'post'),
+    ('cart_view', 'get'),
+    ('api_cart_add', 'post'),
+    ('book_list', 'get'),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares DB queries and latency of the cart requests under each session profile "
+        "(SESSION_PROFILES) and under Django's stock database sessions."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50, help="Timed requests per route.")
+        parser.add_argument(
+            '--profiles', nargs='+', choices=['stock', *settings.SESSION_PROFILES],
+            default=['stock', *settings.SESSION_PROFILES], help="Session profiles to compare.",
+        )
+
+    def handle(self, *args, **options):
+        with bench.bench_environment():
+            bench.seed_catalog(200)
+            book_id = Book.objects.order_by('id').values_list('id', flat=True).first()
+            user, _ = User.objects.get_or_create(username='bench-user')
+            for profile in options['profiles']:
+                overrides = STOCK_PROFILE if profile == 'stock' else settings.SESSION_PROFILES[profile]
+                with override_settings(**overrides):
+                    self.stdout.write(f"\n{profile}: {overrides['SESSION_ENGINE']}")
+                    for audience in ('anon', 'user'):
+                        self.run_flows(audience, user, book_id, options['iterations'])
+
+    def run_flows(self, audience, user, book_id, iterations):
+        # A fresh client builds a fresh middleware chain, picking up the overridden SESSION_ENGINE.
+        client = Client()
+        if audience == 'user':
+            client.force_login(user)
+        for name, method in FLOWS:
+            args = [book_id] if name in ('add_to_cart', 'api_cart_add') else None
+            url = reverse(f'bookstore:{name}', args=args)
+            self.report(audience, name, bench.measure(lambda: getattr(client, method)(url), iterations))
+
+        if audience == 'anon':
+            # A first-time visitor's add creates both the session and the cart.
+            url = reverse('bookstore:add_to_cart', args=[book_id])
+            self.report(audience, 'first add', bench.measure(lambda: Client().post(url), iterations))
+
+    def report(self, audience, name, metrics):
+        self.stdout.write(
+            f"  {audience:<5} {name:<14} {metrics['queries']:>3} queries  "
+            f"p50 {metrics['p50_ms']:>7.2f} ms  p95 {metrics['p95_ms']:>7.2f} ms"
+        )
@@ -0,0 +1,213 @@
+import compileall
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from importlib.util import find_spec
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from bookstore import bench
+from bookstore.models import Book
+
+
+# Runs in a fresh interpreter: imports the WSGI application, optionally warms it
+# up, then serves every path twice, timing each phase.
+CHILD = '''
+import io, json, os, sys, time
+started = time.perf_counter()
+from bookstore_project.wsgi import application
+timings = {'setup': time.perf_counter() - started}
+if os.environ['BENCH_WARM_UP'] == '1':
+    from bookstore.warmup import warm_up
+    mark = time.perf_counter()
+    warm_up()
+    timings['warm_up'] = time.perf_counter() - mark
+
+def get(target):
+    path, _, query = target.partition('?')
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query, 'SCRIPT_NAME': '',
+        'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+        'HTTP_HOST': 'localhost', 'REMOTE_ADDR': '127.0.0.1', 'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True, 'wsgi.multiprocess': True, 'wsgi.run_once': False,
+    }
+    status = []
+    response = application(environ, lambda line, headers: status.append(int(line.split()[0])))
+    try:
+        for _ in response:
+            pass
+    finally:
+        response.close()
+    return status[0]
+
+errors = []
+for label in ('first', 'second'):
+    mark = time.perf_counter()
+    for path in json.loads(os.environ['BENCH_PATHS']):
+        status = get(path)
+        if status >= 400:
+            errors.append(f"GET {path} answered {status}")
+    timings[label] = time.perf_counter() - mark
+print(json.dumps({'timings': timings, 'errors': errors}))
+'''
+
+# (label, bytecode compiled ahead of time, warm-up before the first request)
+VARIANTS = (
+    ('source only', False, False),
+    ('bytecode', True, False),
+    ('bytecode + warm-up', True, True),
+)
+
+COPY_IGNORE = shutil.ignore_patterns('.git', '__pycache__', '*.pyc', '*.sqlite3', 'cache')
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures how long a fresh server process takes to set Django up and serve its first "
+        "requests, with and without precompiled bytecode and the warm-up that gunicorn.conf.py "
+        "runs before forking; with --gunicorn, also times gunicorn until it is ready and load-tests it."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=1000, help="Books in the seeded catalog.")
+        parser.add_argument('--repeat', type=int, default=5, help="Fresh processes per variant; medians are reported.")
+        parser.add_argument('--paths', nargs='+', help="Paths each process serves (default: the main catalog pages).")
+        parser.add_argument('--gunicorn', action='store_true', help="Also start gunicorn with gunicorn.conf.py.")
+        parser.add_argument('--workers', type=int, help="gunicorn workers (default: the config's CPU-based count).")
+        parser.add_argument('--concurrency', type=int, default=32, help="Connections for the gunicorn load test.")
+        parser.add_argument('--requests', type=int, default=2000, help="Requests per path in the gunicorn load test.")
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError("--repeat must be at least 1.")
+        if options['gunicorn'] and find_spec('gunicorn') is None:
+            raise CommandError("gunicorn is not installed (pip install -r bookstore/requirements.txt).")
+        with tempfile.TemporaryDirectory() as directory:
+            directory = Path(directory)
+            database = directory / 'bench.sqlite3'
+            with bench.bench_environment(test_database_name=database):
+                bench.seed_catalog(options['size'])
+                paths = options['paths'] or self.default_paths()
+                connections.close_all()
+                trees = self.prepare_trees(directory)
+                env = {
+                    **os.environ,
+                    'DJANGO_SETTINGS_MODULE': 'bookstore_project.settings',
+                    'BOOKSTORE_DB_NAME': str(database),
+                    'DEBUG': 'False',
+                    'ALLOWED_HOSTS': 'localhost,127.0.0.1',
+                    'BOOKSTORE_STATIC_ROOT': str(directory / 'static'),
+                    'PYTHONDONTWRITEBYTECODE': '1',
+                }
+                # Without DEBUG, pages link the hashed static names from the manifest.
+                subprocess.run(
+                    [sys.executable, 'manage.py', 'collectstatic', '--noinput', '--verbosity', '0'],
+                    cwd=trees[True], env=env, check=True,
+                )
+                self.stdout.write(
+                    f"Catalog of {options['size']} books; each process serves {' '.join(paths)} twice "
+                    f"(medians of {options['repeat']} processes, ms)"
+                )
+                self.stdout.write(
+                    f"  {'variant':<20} {'setup':>8} {'warm-up':>8} {'1st pass':>9} {'2nd pass':>9} {'process':>8}"
+                )
+                for label, compiled, warm in VARIANTS:
+                    self.measure(label, trees[compiled], warm, paths, env, options['repeat'])
+                if options['gunicorn']:
+                    self.run_gunicorn(trees[True], directory, paths, env, options)
+
+    def default_paths(self):
+        book_id = Book.objects.order_by('id').values_list('id', flat=True).first()
+        return ['/', '/books/', f'/books/{book_id}/', '/books/search/?q=garden', '/books/suggest/?q=gar']
+
+    def prepare_trees(self, directory):
+        """Copies of the project without bytecode (False) and with all of it compiled (True)."""
+        trees = {}
+        for compiled in (False, True):
+            tree = directory / ('compiled' if compiled else 'source')
+            shutil.copytree(settings.BASE_DIR, tree, ignore=COPY_IGNORE)
+            if compiled:
+                compileall.compile_dir(tree, quiet=1)
+            trees[compiled] = tree
+        return trees
+
+    def measure(self, label, tree, warm, paths, env, repeat):
+        env = {**env, 'BENCH_WARM_UP': '1' if warm else '0', 'BENCH_PATHS': json.dumps(paths)}
+        runs, errors = [], set()
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = subprocess.run(
+                [sys.executable, '-c', CHILD], cwd=tree, env=env, capture_output=True, text=True,
+            )
+            elapsed = time.perf_counter() - started
+            if result.returncode:
+                raise CommandError(f"The {label} process failed:\n{result.stderr}")
+            report = json.loads(result.stdout.strip().splitlines()[-1])
+            runs.append({**report['timings'], 'process': elapsed})
+            errors.update(report['errors'])
+
+        def median(phase):
+            values = [run[phase] for run in runs if phase in run]
+            return f"{statistics.median(values) * 1000:.1f}" if values else '-'
+
+        self.stdout.write(
+            f"  {label:<20} {median('setup'):>8} {median('warm_up'):>8} {median('first'):>9} "
+            f"{median('second'):>9} {median('process'):>8}"
+        )
+        for error in sorted(errors):
+            self.stdout.write(self.style.WARNING(f"    {error}"))
+
+    def run_gunicorn(self, tree, directory, paths, env, options):
+        """Starts gunicorn as the image does, times it until ready, then load-tests it."""
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+        command = [
+            sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}', '--access-logfile', '/dev/null',
+        ]
+        if options['workers']:
+            command += ['--workers', str(options['workers'])]
+        log_path = directory / 'gunicorn.log'
+        url = f'http://127.0.0.1:{port}'
+        with open(log_path, 'w') as log:
+            started = time.perf_counter()
+            process = subprocess.Popen(command + ['bookstore_project.wsgi'], cwd=tree, env=env, stdout=log, stderr=log)
+            try:
+                ready = self.wait_until_ready(f'{url}{settings.HEALTH_READY_PATH}', process, started)
+                self.stdout.write(f"gunicorn answered {settings.HEALTH_READY_PATH} {ready * 1000:.0f} ms after launch")
+                for line in log_path.read_text().splitlines():
+                    if 'Warmed up' in line:
+                        self.stdout.write(f"  {line.split('[INFO] ', 1)[-1]}")
+                call_command(
+                    'bench_async', url=url, paths=paths,
+                    concurrency=options['concurrency'], requests=options['requests'], stdout=self.stdout,
+                )
+            finally:
+                process.terminate()
+                process.wait(timeout=60)
+
+    def wait_until_ready(self, url, process, started, timeout=60):
+        while time.perf_counter() - started < timeout:
+            if process.poll() is not None:
+                raise CommandError(f"gunicorn exited with status {process.returncode} before it was ready.")
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - started
+            except (urllib.error.URLError, ConnectionError):
+                pass
+            time.sleep(0.01)
+        raise CommandError(f"gunicorn was not ready after {timeout} seconds.")
@@ -0,0 +1,79 @@
+import gc
+import random
+import time
+import tracemalloc
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+
+from bookstore import bench, typeahead
+from bookstore.models import Book
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds throwaway catalogs and reports the typeahead index's build time, memory per "
+        "million titles, and p50/p99 latency of lookups and incremental updates."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', type=int, nargs='+', default=[100000, 1000000],
+            help="Catalog sizes to seed and measure.",
+        )
+        parser.add_argument('--lookups', type=int, default=20000, help="Timed lookups per size.")
+        parser.add_argument('--updates', type=int, default=1000, help="Timed incremental updates per size.")
+
+    def handle(self, *args, **options):
+        with bench.bench_environment():
+            for size in sorted(options['sizes']):
+                self.run_size(size, options)
+
+    def run_size(self, size, options):
+        missing = size - Book.objects.count()
+        if missing > 0:
+            bench.seed_catalog(missing, seed=size)
+        cache.clear()
+        self.stdout.write(f"\nCatalog of {size} books")
+
+        # First lookup: reads the catalog and builds the index, as a fresh worker would.
+        started = time.perf_counter()
+        typeahead.suggest('a')
+        self.stdout.write(f"  first lookup (builds the index)  {time.perf_counter() - started:8.2f} s")
+
+        gc.collect()
+        tracemalloc.start()
+        index = typeahead.build_index()
+        retained = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        self.stdout.write(
+            f"  index memory                     {retained / 2**20:8.1f} MiB "
+            f"({retained / 2**20 * 1_000_000 / size:.0f} MiB per 1M titles)"
+        )
+
+        rng = random.Random(size)
+        samples = rng.sample(range(len(index)), min(len(index), 1000))
+        keys = [index.title_keys[i] for i in samples] + index.author_keys[:1000]
+        prefixes = [key[:rng.randint(1, 8)] for key in keys]
+        timings = []
+        for _ in range(options['lookups']):
+            prefix = rng.choice(prefixes)
+            started = time.perf_counter()
+            typeahead.suggest(prefix)
+            timings.append((time.perf_counter() - started) * 1e6)
+        self.report('lookup', timings)
+
+        rows = list(Book.objects.order_by('?').values_list('id', 'title', 'author')[:options['updates']])
+        timings = []
+        for book_id, title, author in rows:
+            started = time.perf_counter()
+            index.apply((book_id, (title, author), (title + ' revised', author)))
+            timings.append((time.perf_counter() - started) * 1e6)
+        self.report('update', timings)
+        del index
+
+    def report(self, label, timings):
+        timings.sort()
+        self.stdout.write(
+            f"  {label:<32} p50 {bench.percentile(timings, 50):8.1f} us  p99 {bench.percentile(timings, 99):8.1f} us"
+        )
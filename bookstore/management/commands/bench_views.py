@@ -0,0 +1,184 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.urls import reverse
+
+from bookstore import bench
+from bookstore.models import Book, Cart, CartItem, Order, OrderLine
+from bookstore.urls import urlpatterns
+
+
+# Routes that cannot be repeated without changing what the next iteration measures.
+SKIPPED_ROUTES = {
+    'logout': "ends the session it would be measured with",
+    'payment': "checks the cart out on every call; measured by bench_checkout",
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks every named bookstore route against seeded catalogs and reports p50/p95 "
+        "latency, queries and peak memory; optionally fails on regressions against a baseline."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', type=int, nargs='+', default=[1000],
+            help="Catalog sizes to seed and measure, e.g. --sizes 1000 100000 1000000.",
+        )
+        parser.add_argument('--cart-lines', type=int, default=100, help="Lines in the benchmark user's cart.")
+        parser.add_argument('--iterations', type=int, default=50, help="Timed requests per route.")
+        parser.add_argument('--routes', nargs='+', help="Only measure these route names.")
+        parser.add_argument('--cold', action='store_true', help="Clear the cache before every request.")
+        parser.add_argument('--output', help="Write the results to this JSON file.")
+        parser.add_argument(
+            '--baseline',
+            help="JSON results to compare against. Created from this run if it does not exist yet.",
+        )
+        parser.add_argument(
+            '--threshold', type=float, default=0.25,
+            help="Allowed growth in p95 latency or peak memory before a route counts as regressed "
+                 "(default: 0.25 = 25%%).",
+        )
+
+    def handle(self, *args, **options):
+        results = {}
+        with bench.bench_environment():
+            for size in sorted(options['sizes']):
+                results[f'catalog_{size}'] = self.run_size(size, options)
+
+        if options['output']:
+            bench.save_results(options['output'], results)
+            self.stdout.write(f"Results written to {options['output']}.")
+
+        if options['baseline']:
+            self.check_baseline(options['baseline'], results, options['threshold'])
+
+    def run_size(self, size, options):
+        started = time.perf_counter()
+        missing = size - Book.objects.count()
+        if missing > 0:
+            bench.seed_catalog(missing, seed=size)
+        self.stdout.write(f"\nCatalog of {size} books (seeded in {time.perf_counter() - started:.1f}s)")
+        # Seeding bypasses the admin views, so drop cached pages and typeahead indexes of the smaller catalog.
+        cache.clear()
+
+        clients, fixtures = self.prepare_fixtures(options['cart_lines'])
+        before_each = cache.clear if options['cold'] else None
+
+        routes = {}
+        for scenario in self.scenarios(fixtures):
+            name = scenario.get('label', scenario['name'])
+            if options['routes'] and name not in options['routes']:
+                continue
+            client = clients[scenario['as']]
+            request = self.request_for(client, scenario)
+            routes[name] = bench.measure(request, options['iterations'], before_each=before_each)
+            self.report(name, routes[name])
+
+        covered = set(routes) | set(SKIPPED_ROUTES)
+        for pattern in urlpatterns:
+            if pattern.name not in covered and not options['routes']:
+                self.stdout.write(self.style.WARNING(f"  {pattern.name}: no benchmark scenario"))
+        for name, reason in SKIPPED_ROUTES.items():
+            if not options['routes']:
+                self.stdout.write(f"  {name}: skipped ({reason})")
+        return routes
+
+    def prepare_fixtures(self, cart_lines):
+        user, _ = User.objects.get_or_create(username='bench-user')
+        staff, _ = User.objects.get_or_create(username='bench-staff', defaults={'is_staff': True})
+
+        cart, _ = Cart.objects.get_or_create(user=user)
+        CartItem.objects.filter(cart=cart).delete()
+        book_ids = list(Book.objects.order_by('id').values_list('id', flat=True)[:cart_lines])
+        CartItem.objects.bulk_create(CartItem(cart=cart, book_id=pk, quantity=2) for pk in book_ids)
+        order, created = Order.objects.get_or_create(user=user, idempotency_key='bench', defaults={'total': 0})
+        if created:
+            OrderLine.objects.bulk_create(
+                OrderLine(order=order, book=book, title=book.title, unit_price=book.price, quantity=2)
+                for book in Book.objects.filter(pk__in=book_ids).only('title', 'price')
+            )
+
+        clients = {'anon': Client(), 'user': Client(), 'staff': Client()}
+        clients['user'].force_login(user)
+        clients['staff'].force_login(staff)
+
+        middle = Book.objects.order_by('id').values_list('id', 'author')[Book.objects.count() // 2]
+        return clients, {'book_id': middle[0], 'author': middle[1], 'order_id': order.pk}
+
+    def scenarios(self, fixtures):
+        book_id = fixtures['book_id']
+        return [
+            {'name': 'home', 'as': 'anon'},
+            {'name': 'book_list', 'as': 'anon'},
+            {'name': 'book_search', 'as': 'anon', 'query': {'q': 'garden'}},
+            {'name': 'book_suggest', 'as': 'anon', 'query': {'q': 'gar'}},
+            {'name': 'book_list', 'as': 'anon', 'label': 'book_list_by_author', 'query': {'author': fixtures['author']}},
+            {'name': 'author_index', 'as': 'anon', 'query': {'letter': 'A'}},
+            {'name': 'book_detail', 'as': 'anon', 'args': [book_id]},
+            {'name': 'async_book_list', 'as': 'anon'},
+            {'name': 'async_book_suggest', 'as': 'anon', 'query': {'q': 'gar'}},
+            {'name': 'async_book_detail', 'as': 'anon', 'args': [book_id]},
+            {'name': 'register', 'as': 'anon'},
+            {'name': 'login', 'as': 'anon'},
+            {'name': 'cart_view', 'as': 'user'},
+            {'name': 'add_to_cart', 'as': 'user', 'method': 'post', 'args': [book_id]},
+            {'name': 'order_detail', 'as': 'user', 'args': [fixtures['order_id']]},
+            {'name': 'api_cart', 'as': 'user'},
+            {'name': 'async_api_cart', 'as': 'user'},
+            {'name': 'session', 'as': 'user'},
+            {'name': 'api_cart_add', 'as': 'user', 'method': 'post', 'args': [book_id]},
+            {'name': 'api_cart_item', 'as': 'user', 'method': 'post', 'args': [book_id], 'data': {'quantity': 2}},
+            {'name': 'admin_book_list', 'as': 'staff'},
+            {'name': 'admin_book_export', 'as': 'staff', 'query': {'author': fixtures['author']}},
+            {'name': 'admin_book_create', 'as': 'staff'},
+            {'name': 'admin_book_update', 'as': 'staff', 'args': [book_id]},
+            {'name': 'admin_book_delete', 'as': 'staff', 'args': [book_id]},
+            {'name': 'metrics', 'as': 'staff'},
+            {
+                'name': 'admin_book_bulk', 'as': 'staff', 'method': 'post',
+                'data': {'action': 'price_amount', 'value': '0', 'book_ids': [book_id]},
+            },
+        ]
+
+    def request_for(self, client, scenario):
+        url = reverse(f"bookstore:{scenario['name']}", args=scenario.get('args'))
+        method = scenario.get('method', 'get')
+        if method == 'get':
+            data = scenario.get('query')
+            def request():
+                response = client.get(url, data)
+                self.consume(response)
+        else:
+            data = scenario.get('data', {})
+            def request():
+                self.consume(client.post(url, data))
+        return request
+
+    def consume(self, response):
+        if response.status_code >= 400:
+            raise CommandError(f"{response.request['PATH_INFO']} answered {response.status_code}.")
+        if response.streaming:
+            for _ in response.streaming_content:
+                pass
+
+    def report(self, name, metrics):
+        self.stdout.write(
+            f"  {name:<20} p50 {metrics['p50_ms']:>8.2f} ms  p95 {metrics['p95_ms']:>8.2f} ms  "
+            f"{metrics['queries']:>3} queries  peak {metrics['peak_kb']:>9.1f} KiB"
+        )
+
+    def check_baseline(self, path, results, threshold):
+        baseline = bench.load_baseline(path)
+        if baseline is None:
+            bench.save_results(path, results)
+            self.stdout.write(f"No baseline at {path}; saved this run as the baseline.")
+            return
+        regressions = bench.find_regressions(results, baseline, threshold)
+        if regressions:
+            raise CommandError("Performance regressions:\n  " + "\n  ".join(regressions))
+        self.stdout.write(self.style.SUCCESS(f"No regressions against {path}."))
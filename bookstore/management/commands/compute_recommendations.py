@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from bookstore import recommendations
+from bookstore.cache import bump_catalog_version
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes the 'customers also bought' recommendations from the books ordered together, "
+        "streaming the orders in chunks so memory use does not grow with the order history."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--top', type=int, default=recommendations.DEFAULT_TOP,
+            help=f"Recommendations kept per book (default: {recommendations.DEFAULT_TOP}).",
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=recommendations.DEFAULT_BATCH_SIZE,
+            help=f"Orders counted per chunk (default: {recommendations.DEFAULT_BATCH_SIZE}).",
+        )
+        parser.add_argument(
+            '--max-basket', type=int, default=recommendations.DEFAULT_MAX_BASKET,
+            help=f"Ignore orders with more books than this (default: {recommendations.DEFAULT_MAX_BASKET}).",
+        )
+        parser.add_argument('--min-orders', type=int, default=1, help="Orders two books must share to be paired.")
+
+    def handle(self, *args, **options):
+        for name in ('top', 'batch_size', 'max_basket', 'min_orders'):
+            if options[name] < 1:
+                raise CommandError(f"--{name.replace('_', '-')} must be at least 1.")
+        started = time.perf_counter()
+        orders, pairs, rows = recommendations.compute(
+            top=options['top'],
+            batch_size=options['batch_size'],
+            max_basket=options['max_basket'],
+            min_orders=options['min_orders'],
+        )
+        # Detail pages are cached with their recommendations.
+        bump_catalog_version(all_books=True)
+        self.stdout.write(self.style.SUCCESS(
+            f"{orders} orders, {pairs} book pairs, {rows} recommendations "
+            f"in {time.perf_counter() - started:.1f}s."
+        ))
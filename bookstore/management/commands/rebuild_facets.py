@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from bookstore.cache import bump_catalog_version
+from bookstore.facets import rebuild
+
+
+class Command(BaseCommand):
+    help = (
+        "Recounts the author and price-band facets from the catalog, repairing any drift "
+        "left by writes that bypassed the app (raw SQL, restored backups)."
+    )
+
+    def handle(self, *args, **options):
+        rows = rebuild()
+        bump_catalog_version()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rows} facet counts."))
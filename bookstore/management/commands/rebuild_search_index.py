@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from bookstore import search
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the full-text search index over Book title, author and description."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--no-optimize',
+            action='store_true',
+            help="Skip merging the index segments after the rebuild.",
+        )
+
+    def handle(self, *args, **options):
+        if not search.fts_available():
+            raise CommandError("Full-text search index is only available on SQLite.")
+
+        started = time.perf_counter()
+        search.rebuild_index(optimize=not options['no_optimize'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f"Search index rebuilt in {elapsed:.2f}s."))
@@ -0,0 +1,54 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from bookstore.cache import bump_catalog_version
+from bookstore.routers import replica_aliases
+
+
+class Command(BaseCommand):
+    help = (
+        "Copies the primary SQLite database into its file-copy replicas with the online backup API, "
+        "then invalidates the catalog cache so pages read from the old copy are dropped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'aliases', nargs='*',
+            help="Replica aliases to refresh (default: every alias in DATABASE_REPLICAS).",
+        )
+        parser.add_argument('--path', help="Copy the primary to this file instead of a configured replica.")
+
+    def handle(self, *args, **options):
+        primary = connections['default']
+        if primary.vendor != 'sqlite':
+            raise CommandError("File-copy replicas are only supported for SQLite.")
+
+        if options['path']:
+            targets = [options['path']]
+        else:
+            aliases = options['aliases'] or replica_aliases()
+            if not aliases:
+                raise CommandError("No replicas configured; set BOOKSTORE_DB_REPLICAS or pass --path.")
+            unknown = set(aliases) - set(replica_aliases())
+            if unknown:
+                raise CommandError(f"Not a configured replica: {', '.join(sorted(unknown))}.")
+            targets = [str(settings.DATABASES[alias]['NAME']) for alias in aliases]
+
+        primary.ensure_connection()
+        for target in targets:
+            started = time.perf_counter()
+            destination = sqlite3.connect(target)
+            try:
+                # One step: readers of the replica see either the old copy or the new one.
+                primary.connection.backup(destination)
+            finally:
+                destination.close()
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f"Copied the primary to {target} in {elapsed:.2f}s.")
+
+        bump_catalog_version(all_books=True)
+        self.stdout.write(self.style.SUCCESS("Replicas refreshed."))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from bookstore.inventory import sweep_expired_reservations
+
+
+class Command(BaseCommand):
+    help = (
+        "Returns the copies held by cart lines whose reservation has lapsed to stock. "
+        "Run it every few minutes, e.g. from cron."
+    )
+
+    def handle(self, *args, **options):
+        released = sweep_expired_reservations()
+        self.stdout.write(self.style.SUCCESS(f"Released {released} expired cart reservations."))
@@ -0,0 +1,33 @@
+import asyncio
+
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+
+from bookstore.asgi_server import serve
+
+
+class Command(BaseCommand):
+    help = (
+        "Serves the project's ASGI application on a minimal single-process asyncio server, "
+        "to run and load-test the async views locally without uvicorn or daphne."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('addrport', nargs='?', default='127.0.0.1:8001', help="host:port to listen on.")
+
+    def handle(self, *args, **options):
+        host, _, port = options['addrport'].rpartition(':')
+        try:
+            port = int(port)
+        except ValueError:
+            raise CommandError(f"{options['addrport']!r} is not a valid host:port.")
+        host = host or '127.0.0.1'
+        application = get_asgi_application()
+
+        def ready(server):
+            self.stdout.write(f"Serving ASGI on http://{host}:{port}/ (CONTROL-C to quit).")
+
+        try:
+            asyncio.run(serve(application, host, port, ready=ready))
+        except KeyboardInterrupt:
+            pass
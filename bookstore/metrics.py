@@ -0,0 +1,280 @@
+"""
+In-process request metrics, exposed in the Prometheus text format.
+
+RequestMetricsMiddleware times every request and, through
+db.observe_queries(), the queries it runs. InstrumentedDjangoTemplates
+times template rendering. Everything is aggregated per resolved URL name into
+fixed-bucket histograms that cost one bisect and one short lock per update.
+Each server process keeps its own numbers.
+"""
+import heapq
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.template.backends.django import DjangoTemplates, Template
+
+from .db import observe_queries
+
+
+logger = logging.getLogger('bookstore.slow_requests')
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# Statements kept per request for the slow-request log.
+MAX_CAPTURED_SQL = 50
+
+
+class Histogram:
+    """A Prometheus-style histogram with fixed upper bounds."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.total += value
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.counts), self.total
+
+
+class MetricsRegistry:
+    """Histograms and counters keyed by metric name and label values."""
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.slowest = []
+
+    def histogram(self, name, labels, buckets):
+        key = (name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(key, Histogram(buckets))
+        return histogram
+
+    def increment(self, name, labels):
+        key = (name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+
+    def record_slow(self, duration, entry, keep):
+        """Keeps the `keep` slowest requests seen so far."""
+        with self.lock:
+            item = (duration, id(entry), entry)
+            if len(self.slowest) < keep:
+                heapq.heappush(self.slowest, item)
+            elif duration > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, item)
+
+    def slowest_requests(self):
+        with self.lock:
+            return [entry for _, _, entry in sorted(self.slowest, key=lambda item: -item[0])]
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+            self.counters.clear()
+            self.slowest.clear()
+
+
+REGISTRY = MetricsRegistry()
+
+HELP = {
+    'bookstore_requests_total': ('counter', "Requests handled, by route, method and status code."),
+    'bookstore_request_duration_seconds': ('histogram', "Wall time spent handling a request."),
+    'bookstore_db_queries': ('histogram', "Database queries run per request."),
+    'bookstore_db_duration_seconds': ('histogram', "Time per request spent waiting on the database."),
+    'bookstore_template_render_seconds': ('histogram', "Time per request spent rendering templates."),
+    'bookstore_response_size_bytes': ('histogram', "Size of non-streaming response bodies."),
+}
+
+
+class RequestStats:
+    """Per-request accumulator filled in by the query wrapper and template backend."""
+    __slots__ = ('queries', 'db_time', 'template_time', 'sql', 'capture_sql')
+
+    def __init__(self, capture_sql=False):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.sql = []
+        self.capture_sql = capture_sql
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.queries += 1
+            self.db_time += elapsed
+            if self.capture_sql and len(self.sql) < MAX_CAPTURED_SQL:
+                self.sql.append((round(elapsed * 1000, 3), sql))
+
+
+_current_stats = ContextVar('bookstore_request_stats', default=None)
+
+
+class TimedTemplate(Template):
+    """A Django backend template that adds its render time to the current request's stats."""
+
+    def render(self, context=None, request=None):
+        stats = _current_stats.get()
+        if stats is None:
+            return super().render(context, request)
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            stats.template_time += time.perf_counter() - started
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, timing every top-level render for the metrics middleware."""
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code).template, self)
+
+
+class RequestMetricsMiddleware:
+    """Records wall time, DB queries/time, template time and response size per URL name."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.slow_threshold = getattr(settings, 'METRICS_SLOW_REQUEST_SECONDS', None)
+        self.slow_keep = getattr(settings, 'METRICS_SLOW_REQUEST_KEEP', 20)
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        stats = RequestStats(capture_sql=self.slow_threshold is not None)
+        token = _current_stats.set(stats)
+        started = time.perf_counter()
+        try:
+            with observe_queries(stats):
+                response = self.get_response(request)
+        finally:
+            _current_stats.reset(token)
+        duration = time.perf_counter() - started
+        self.record(request, response, stats, duration)
+        return response
+
+    async def __acall__(self, request):
+        stats = RequestStats(capture_sql=self.slow_threshold is not None)
+        token = _current_stats.set(stats)
+        started = time.perf_counter()
+        try:
+            with observe_queries(stats):
+                response = await self.get_response(request)
+        finally:
+            _current_stats.reset(token)
+        duration = time.perf_counter() - started
+        self.record(request, response, stats, duration)
+        return response
+
+    def record(self, request, response, stats, duration):
+        match = getattr(request, 'resolver_match', None)
+        route = match.view_name if match else 'unresolved'
+        labels = (('route', route),)
+
+        REGISTRY.increment(
+            'bookstore_requests_total',
+            labels + (('method', request.method), ('status', str(response.status_code))),
+        )
+        REGISTRY.histogram('bookstore_request_duration_seconds', labels, LATENCY_BUCKETS).observe(duration)
+        REGISTRY.histogram('bookstore_db_queries', labels, QUERY_COUNT_BUCKETS).observe(stats.queries)
+        REGISTRY.histogram('bookstore_db_duration_seconds', labels, LATENCY_BUCKETS).observe(stats.db_time)
+        if stats.template_time:
+            REGISTRY.histogram(
+                'bookstore_template_render_seconds', labels, LATENCY_BUCKETS
+            ).observe(stats.template_time)
+        if not response.streaming:
+            REGISTRY.histogram(
+                'bookstore_response_size_bytes', labels, SIZE_BUCKETS
+            ).observe(len(response.content))
+
+        if self.slow_threshold is not None and duration >= self.slow_threshold:
+            entry = {
+                'route': route,
+                'path': request.path,
+                'duration_ms': round(duration * 1000, 3),
+                'queries': stats.queries,
+                'db_ms': round(stats.db_time * 1000, 3),
+                'sql': stats.sql,
+            }
+            REGISTRY.record_slow(duration, entry, self.slow_keep)
+            logger.warning(
+                "Slow request %s %s: %.1f ms, %d queries (%.1f ms in DB)",
+                request.method, request.path, duration * 1000, stats.queries, stats.db_time * 1000,
+                extra={'sql': stats.sql},
+            )
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_bound(bound):
+    return repr(float(bound)) if isinstance(bound, float) else str(bound)
+
+
+def render_prometheus(registry=REGISTRY):
+    """Renders every metric in the Prometheus text exposition format (version 0.0.4)."""
+    with registry.lock:
+        counters = list(registry.counters.items())
+        histograms = list(registry.histograms.items())
+
+    families = {}
+    for (name, labels), value in counters:
+        families.setdefault(name, []).append(f'{name}{_labels(labels)} {value}')
+    for (name, labels), histogram in histograms:
+        counts, total = histogram.snapshot()
+        lines = families.setdefault(name, [])
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{_labels(labels, [("le", _format_bound(bound))])} {cumulative}')
+        cumulative += counts[-1]
+        lines.append(f'{name}_bucket{_labels(labels, [("le", "+Inf")])} {cumulative}')
+        lines.append(f'{name}_sum{_labels(labels)} {total}')
+        lines.append(f'{name}_count{_labels(labels)} {cumulative}')
+
+    output = []
+    for name in sorted(families):
+        kind, description = HELP.get(name, ('untyped', name))
+        output.append(f'# HELP {name} {description}')
+        output.append(f'# TYPE {name} {kind}')
+        output.extend(families[name])
+    return '\n'.join(output) + '\n'
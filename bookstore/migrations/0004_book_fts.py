@@ -0,0 +1,34 @@
+
+from django.db import migrations
+
+
+def create_fts_index(apps, schema_editor):
+    from bookstore import search
+
+    if not search.fts_available(schema_editor.connection):
+        return
+    for statement in search.CREATE_SQL:
+        schema_editor.execute(statement)
+    schema_editor.execute(
+        f"INSERT INTO {search.FTS_TABLE}({search.FTS_TABLE}) VALUES ('rebuild')"
+    )
+
+
+def drop_fts_index(apps, schema_editor):
+    from bookstore import search
+
+    if not search.fts_available(schema_editor.connection):
+        return
+    for statement in search.DROP_SQL:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookstore', '0003_book_title_id_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_index, drop_fts_index),
+    ]
@@ -0,0 +1,59 @@
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def fill_content_hashes(apps, schema_editor):
+    from bookstore.models import book_content_hash
+
+    Book = apps.get_model('bookstore', 'Book')
+    batch = []
+    for book in Book.objects.only('id', 'title', 'author', 'description', 'price').iterator(chunk_size=2000):
+        book.content_hash = book_content_hash(book.title, book.author, book.description, book.price)
+        batch.append(book)
+        if len(batch) >= 2000:
+            Book.objects.bulk_update(batch, ['content_hash'])
+            batch = []
+    if batch:
+        Book.objects.bulk_update(batch, ['content_hash'])
+
+
+def restore_fts_triggers(apps, schema_editor):
+    # Adding columns makes SQLite rebuild bookstore_book, which drops the
+    # search triggers attached to it.
+    from bookstore import search
+
+    if not search.fts_available(schema_editor.connection):
+        return
+    for statement in search.CREATE_SQL:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookstore', '0004_book_fts'),
+    ]
+
+    operations = [
+        # Reversed last when migrating back, after the columns are dropped again.
+        migrations.RunPython(migrations.RunPython.noop, restore_fts_triggers),
+        migrations.AddField(
+            model_name='book',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='content_hash',
+            field=models.CharField(blank=True, editable=False, max_length=40, default=''),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['updated_at'], name='book_updated_at_idx'),
+        ),
+        migrations.RunPython(restore_fts_triggers, migrations.RunPython.noop),
+        migrations.RunPython(fill_content_hashes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+
+
+from django.db import migrations, models
+
+
+def restore_fts_triggers(apps, schema_editor):
+    # Adding a column with a default makes SQLite rebuild bookstore_book, which
+    # drops the search triggers attached to it.
+    from bookstore import search
+
+    if not search.fts_available(schema_editor.connection):
+        return
+    for statement in search.CREATE_SQL:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookstore', '0007_order_orderline'),
+    ]
+
+    operations = [
+        # Reversed last when migrating back, after the column is dropped again.
+        migrations.RunPython(migrations.RunPython.noop, restore_fts_triggers),
+        migrations.AddField(
+            model_name='book',
+            name='stock',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(restore_fts_triggers, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='cartitem',
+            name='reserved_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='cartitem',
+            index=models.Index(fields=['reserved_until'], name='cartitem_reserved_until_idx'),
+        ),
+    ]
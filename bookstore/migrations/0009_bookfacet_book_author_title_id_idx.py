@@ -0,0 +1,48 @@
+
+
+from django.db import migrations, models
+
+
+def count_existing_books(apps, schema_editor):
+    from bookstore.facets import ANY, author_initial, count_books
+
+    Book = apps.get_model('bookstore', 'Book')
+    BookFacet = apps.get_model('bookstore', 'BookFacet')
+    db_alias = schema_editor.connection.alias
+    counts = count_books(Book.objects.using(db_alias).values_list('author', 'price').iterator())
+    BookFacet.objects.using(db_alias).bulk_create(
+        BookFacet(author=author, price_band=band, initial=author_initial(author) if author else ANY, book_count=number)
+        for (author, band), number in counts.items()
+    )
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookstore', '0008_book_stock_cartitem_reserved_until'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookFacet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('author', models.CharField(blank=True, max_length=100)),
+                ('price_band', models.CharField(blank=True, max_length=16)),
+                ('initial', models.CharField(blank=True, max_length=1)),
+                ('book_count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['author', 'title', 'id'], name='book_author_title_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bookfacet',
+            index=models.Index(fields=['price_band', 'initial', 'author'], name='bookfacet_band_initial_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='bookfacet',
+            constraint=models.UniqueConstraint(fields=('author', 'price_band'), name='bookfacet_unique_author_band'),
+        ),
+        migrations.RunPython(count_existing_books, migrations.RunPython.noop),
+    ]
@@ -1,11 +1,169 @@
+import hashlib
+from decimal import Decimal
+
+from django.conf import settings
 from django.db import models
 
+
+def book_content_hash(title, author, description, price):
+    """Fingerprint of everything a book page shows; used as the page's ETag."""
+    price = Decimal(str(price)).quantize(Decimal('0.01')) if price is not None else ''
+    payload = '\x1f'.join([title or '', author or '', description or '', str(price)])
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
 class Book(models.Model):
     title = models.CharField(max_length=200)
     author = models.CharField(max_length=100)
     description = models.TextField(blank=True, null=True) 
     price = models.DecimalField(max_digits=6, decimal_places=2)
+    updated_at = models.DateTimeField(auto_now=True)
+    content_hash = models.CharField(max_length=40, blank=True, editable=False)
+    # Copies available to add to a cart. Only ever changed with conditional
+    # UPDATEs (see bookstore.inventory), never read-modify-write.
+    stock = models.PositiveIntegerField(default=0)
     
 
+    class Meta:
+        indexes = [
+            # Backs the keyset pagination in BookListView (ORDER BY title, id).
+            models.Index(fields=['title', 'id'], name='book_title_id_idx'),
+            # Keeps MAX(updated_at) for the catalog's Last-Modified an index lookup.
+            models.Index(fields=['updated_at'], name='book_updated_at_idx'),
+            # Keyset pagination of one author's books (BookListView ?author=).
+            models.Index(fields=['author', 'title', 'id'], name='book_author_title_id_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.title} by {self.author}" 
+
+    def compute_content_hash(self):
+        return book_content_hash(self.title, self.author, self.description, self.price)
+
+    def save(self, *args, **kwargs):
+        self.content_hash = self.compute_content_hash()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {'content_hash', 'updated_at'}
+        super().save(*args, **kwargs)
+
+
+class BookFacet(models.Model):
+    """
+    The number of books per (author, price band), maintained on every catalog
+    write by bookstore.facets so browse pages never aggregate. '' in either
+    column stands for "any": the ('', '') row counts the whole catalog.
+    """
+    author = models.CharField(max_length=100, blank=True)
+    price_band = models.CharField(max_length=16, blank=True)
+    # Upper-cased first letter of the author, or '#', for the A-Z index.
+    initial = models.CharField(max_length=1, blank=True)
+    book_count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['author', 'price_band'], name='bookfacet_unique_author_band'),
+        ]
+        indexes = [
+            models.Index(fields=['price_band', 'initial', 'author'], name='bookfacet_band_initial_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.author or 'any author'} / {self.price_band or 'any price'}: {self.book_count}"
+
+
+class BookRecommendation(models.Model):
+    """A book often bought together with `book`; precomputed by `manage.py compute_recommendations`."""
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='recommendations')
+    recommended = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='+')
+    # Number of orders that contained both books.
+    score = models.PositiveIntegerField()
+    rank = models.PositiveSmallIntegerField()
+
+    class Meta:
+        constraints = [
+            # Also the index behind the detail page's single lookup (WHERE book_id = ? ORDER BY rank).
+            models.UniqueConstraint(fields=['book', 'rank'], name='bookrecommendation_unique_book_rank'),
+        ]
+
+    def __str__(self):
+        return f"{self.recommended_id} for {self.book_id} (#{self.rank}, {self.score} orders)"
+
+
+class VersionCounter(models.Model):
+    """
+    A named version number shared by every process, bumped only with
+    UPDATE ... SET value = value + n, so concurrent bumps never collide.
+    """
+    name = models.CharField(max_length=50, primary_key=True)
+    value = models.BigIntegerField()
+
+    def __str__(self):
+        return f"{self.name} = {self.value}"
+
+
+class Cart(models.Model):
+    """A shopping cart owned by a user, or by an anonymous session until login."""
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True, related_name='cart'
+    )
+    session_key = models.CharField(max_length=40, null=True, blank=True, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        owner = self.user if self.user_id else f"session {self.session_key}"
+        return f"Cart for {owner}"
+
+
+class CartItem(models.Model):
+    cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items')
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='+')
+    quantity = models.PositiveIntegerField(default=1)
+    # While set, `quantity` copies are held out of Book.stock for this line.
+    reserved_until = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['cart', 'book'], name='cartitem_unique_cart_book'),
+        ]
+        indexes = [
+            # Lets the reservation sweep find expired lines without a table scan.
+            models.Index(fields=['reserved_until'], name='cartitem_reserved_until_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} x {self.book_id} in cart {self.cart_id}"
+
+
+class Order(models.Model):
+    """A completed checkout. Its lines keep the titles and prices paid at the time."""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.PROTECT, related_name='orders')
+    # Sent with the checkout form, so a retried or double-clicked submission finds this order.
+    idempotency_key = models.CharField(max_length=64)
+    total = models.DecimalField(max_digits=12, decimal_places=2)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'idempotency_key'], name='order_unique_user_idempotency_key'),
+        ]
+        ordering = ['-created_at', '-id']
+
+    def __str__(self):
+        return f"Order {self.pk} for {self.user}"
+
+
+class OrderLine(models.Model):
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='lines')
+    # Kept when the book is later deleted from the catalog.
+    book = models.ForeignKey(Book, on_delete=models.SET_NULL, null=True, related_name='+')
+    title = models.CharField(max_length=200)
+    unit_price = models.DecimalField(max_digits=6, decimal_places=2)
+    quantity = models.PositiveIntegerField()
+
+    @property
+    def line_total(self):
+        return self.unit_price * self.quantity
+
     def __str__(self):
-        return f"{self.title} by {self.author}" 
\ No newline at end of file
+        return f"{self.quantity} x {self.title} in order {self.order_id}"
@@ -0,0 +1,82 @@
+"""
+Checkout: turns a cart into an Order in one transaction.
+
+A checkout runs a fixed number of queries whatever the cart size: one SELECT
+for the cart lines with their books, one INSERT for the order, one bulk INSERT
+for its lines and one DELETE to empty the cart. Only lines whose stock
+reservation has lapsed cost one conditional UPDATE each to reserve again.
+Prices are copied onto the order lines as Decimals, so later catalog edits
+never change a past order.
+"""
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+
+from .inventory import OutOfStock, reserve_many
+from .models import CartItem, Order, OrderLine
+
+
+IDEMPOTENCY_KEY_MAX_LENGTH = 64
+
+
+class CheckoutError(Exception):
+    """Raised when a cart cannot be checked out; the message is shown to the user."""
+
+
+def clean_idempotency_key(value):
+    value = (value or '').strip()
+    if not value or len(value) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        raise CheckoutError("This checkout form has expired. Please review your cart and try again.")
+    return value
+
+
+def place_order(user, cart, idempotency_key):
+    """
+    Creates an order from `cart` and empties it. Returns (order, created).
+
+    Submitting the same idempotency key again returns the order it created
+    instead of checking out a second time, including when both submissions
+    race each other.
+    """
+    existing = Order.objects.filter(user=user, idempotency_key=idempotency_key).first()
+    if existing is not None:
+        return existing, False
+
+    try:
+        with transaction.atomic():
+            # Locking the cart lines keeps a concurrent checkout of the same cart from
+            # ordering them twice (SQLite serializes write transactions anyway).
+            items = list(
+                CartItem.objects.filter(cart=cart)
+                .select_for_update(of=('self',))
+                .select_related('book')
+                .only('quantity', 'reserved_until', 'book__id', 'book__title', 'book__price')
+                .order_by('book_id')
+            ) if cart is not None else []
+            if not items:
+                raise CheckoutError("Your cart is empty.")
+
+            # Reserved lines already hold their copies; the checkout consumes them.
+            try:
+                reserve_many({item.book_id: item.quantity for item in items if item.reserved_until is None})
+            except OutOfStock as exc:
+                title = next(item.book.title for item in items if item.book_id == exc.book_id)
+                raise CheckoutError(f"Sorry, there are not enough copies of '{title}' left. Please update your cart.")
+
+            lines = [
+                OrderLine(book=item.book, title=item.book.title, unit_price=item.book.price, quantity=item.quantity)
+                for item in items
+            ]
+            total = sum((line.unit_price * line.quantity for line in lines), start=Decimal('0.00'))
+            order = Order.objects.create(user=user, idempotency_key=idempotency_key, total=total)
+            for line in lines:
+                line.order = order
+            OrderLine.objects.bulk_create(lines)
+            CartItem.objects.filter(cart=cart).delete()
+    except IntegrityError:
+        # A concurrent submission with the same key committed first.
+        existing = Order.objects.filter(user=user, idempotency_key=idempotency_key).first()
+        if existing is None:
+            raise
+        return existing, False
+    return order, True
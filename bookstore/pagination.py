@@ -0,0 +1,105 @@
+import base64
+import json
+
+from django.conf import settings
+from django.db.models import Q
+
+
+DEFAULT_PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(title, pk):
+    """Encodes a (title, id) position as an opaque, URL-safe cursor."""
+    raw = json.dumps([title, pk], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Decodes a cursor back into (title, id). Returns None if it is malformed."""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        title, pk = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, TypeError, UnicodeError):
+        return None
+    if not isinstance(title, str) or not isinstance(pk, int):
+        return None
+    return title, pk
+
+
+def get_page_size(request):
+    """Reads ?size= from the request, clamped to BOOK_LIST_MAX_PAGE_SIZE."""
+    default = getattr(settings, 'BOOK_LIST_PAGE_SIZE', DEFAULT_PAGE_SIZE)
+    maximum = getattr(settings, 'BOOK_LIST_MAX_PAGE_SIZE', MAX_PAGE_SIZE)
+    try:
+        size = int(request.GET.get('size', default))
+    except (TypeError, ValueError):
+        size = default
+    return max(1, min(size, maximum))
+
+
+class KeysetPage:
+    """One page of a queryset ordered by (title, id), with cursors to its neighbours."""
+
+    def __init__(self, items, has_next, has_previous):
+        self.items = items
+        self.has_next = has_next
+        self.has_previous = has_previous
+
+    @property
+    def next_cursor(self):
+        if not (self.has_next and self.items):
+            return None
+        last = self.items[-1]
+        return encode_cursor(last.title, last.pk)
+
+    @property
+    def previous_cursor(self):
+        if not (self.has_previous and self.items):
+            return None
+        first = self.items[0]
+        return encode_cursor(first.title, first.pk)
+
+
+def _keyset_query(queryset, size, after, before):
+    """
+    The unevaluated rows of a page, one extra to tell whether there is another,
+    plus whether they run backwards and the decoded `after` cursor.
+    """
+    after = decode_cursor(after)
+    before = decode_cursor(before) if after is None else None
+
+    if before is not None:
+        title, pk = before
+        rows = queryset.filter(Q(title__lt=title) | Q(title=title, pk__lt=pk)).order_by('-title', '-id')
+        return rows[:size + 1], True, after
+
+    if after is not None:
+        title, pk = after
+        queryset = queryset.filter(Q(title__gt=title) | Q(title=title, pk__gt=pk))
+    return queryset.order_by('title', 'id')[:size + 1], False, after
+
+
+def _keyset_page(rows, size, backwards, after):
+    if backwards:
+        return KeysetPage(rows[:size][::-1], has_next=True, has_previous=len(rows) > size)
+    return KeysetPage(rows[:size], has_next=len(rows) > size, has_previous=after is not None)
+
+
+def paginate_by_title(queryset, size, after=None, before=None):
+    """
+    Returns a KeysetPage of `size` rows from `queryset` ordered by (title, id).
+
+    Seeks directly to the cursor position through the (title, id) index instead of
+    using OFFSET, so every page costs the same regardless of how deep it is.
+    """
+    rows, backwards, after = _keyset_query(queryset, size, after, before)
+    return _keyset_page(list(rows), size, backwards, after)
+
+
+async def apaginate_by_title(queryset, size, after=None, before=None):
+    """paginate_by_title() for async views."""
+    rows, backwards, after = _keyset_query(queryset, size, after, before)
+    return _keyset_page([row async for row in rows], size, backwards, after)
@@ -0,0 +1,116 @@
+"""
+Query budgets: the most database queries a block of code, usually a view, may run.
+
+    with query_budget(3, label='book list'):
+        ...
+
+    @query_budget(3)
+    def handler(...): ...
+
+    class BookListView(QueryBudgetMixin, View):
+        query_budget = 4
+
+Exceeding a budget raises QueryBudgetExceeded with the captured SQL. Views using
+QueryBudgetMixin are only checked when settings.QUERY_BUDGET_MODE is 'raise' or
+'warn' (log instead of failing, e.g. in staging); tests check them explicitly
+through QueryBudgetTestMixin.
+"""
+import logging
+from contextlib import ContextDecorator, ExitStack
+
+from django.conf import settings
+
+from .db import observe_queries
+
+
+logger = logging.getLogger('bookstore.query_budget')
+
+MODES = ('off', 'warn', 'raise')
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised when a block runs more queries than its budget allows."""
+
+
+class query_budget(ContextDecorator):
+    """Counts the queries run on every database connection and enforces a maximum."""
+
+    def __init__(self, max_queries, label=None, mode='raise'):
+        if mode not in MODES:
+            raise ValueError(f"Unknown query budget mode {mode!r}; expected one of {MODES}.")
+        self.max_queries = max_queries
+        self.label = label
+        self.mode = mode
+        self.queries = []
+
+    def _recreate_cm(self):
+        # A fresh instance per call, so a decorated function can run concurrently.
+        return type(self)(self.max_queries, self.label, self.mode)
+
+    def _record(self, execute, sql, params, many, context):
+        self.queries.append(sql)
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self.queries = []
+        self._stack = ExitStack()
+        if self.mode != 'off':
+            self._stack.enter_context(observe_queries(self._record))
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stack.close()
+        if exc_type is None and len(self.queries) > self.max_queries:
+            message = self.failure_message()
+            if self.mode == 'raise':
+                raise QueryBudgetExceeded(message)
+            if self.mode == 'warn':
+                logger.warning(message)
+        return False
+
+    def failure_message(self):
+        label = f" in {self.label}" if self.label else ""
+        statements = '\n'.join(f"{i}. {sql}" for i, sql in enumerate(self.queries, start=1))
+        return (
+            f"{len(self.queries)} queries executed{label}, budget is {self.max_queries}.\n"
+            f"Captured queries were:\n{statements}"
+        )
+
+
+class QueryBudgetMixin:
+    """Enforces a view's `query_budget` according to settings.QUERY_BUDGET_MODE."""
+    query_budget = None
+
+    def dispatch(self, request, *args, **kwargs):
+        mode = getattr(settings, 'QUERY_BUDGET_MODE', 'off')
+        if self.query_budget is None or mode == 'off':
+            return super().dispatch(request, *args, **kwargs)
+        if self.view_is_async:
+            return self._adispatch_within_budget(mode, request, *args, **kwargs)
+        with query_budget(self.query_budget, label=type(self).__name__, mode=mode):
+            return super().dispatch(request, *args, **kwargs)
+
+    async def _adispatch_within_budget(self, mode, request, *args, **kwargs):
+        with query_budget(self.query_budget, label=type(self).__name__, mode=mode):
+            return await super().dispatch(request, *args, **kwargs)
+
+
+class QueryBudgetTestMixin:
+    """TestCase helpers to hold views to their declared query budgets."""
+
+    def assertMaxQueries(self, max_queries, label=None):
+        """Context manager failing the test, with the captured SQL, above `max_queries`."""
+        return query_budget(max_queries, label=label, mode='raise')
+
+    def assertWithinViewBudget(self, view_class, url, method='get', data=None, client=None):
+        """Requests `url` and checks it stays within `view_class.query_budget`."""
+        self.assertIsNotNone(view_class.query_budget, f"{view_class.__name__} declares no query_budget.")
+        client = client or self.client
+        with self.assertMaxQueries(view_class.query_budget, label=view_class.__name__) as budget:
+            # Outside tests the view's on-commit callbacks run inside its budget too.
+            with self.captureOnCommitCallbacks(execute=True):
+                response = getattr(client, method)(url, data)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertLess(response.status_code, 400)
+        return budget
@@ -0,0 +1,153 @@
+"""
+"Customers also bought" recommendations.
+
+The baskets are the lines of the orders checkout writes. compute() streams
+the orders in id-ordered chunks, counts the book pairs of each chunk in
+memory and adds them to a staging table on disk, so memory stays bounded by
+the chunk size whatever the number of orders. A single INSERT ... SELECT with
+ROW_NUMBER() then keeps the top pairs of every book in BookRecommendation,
+replacing the previous results in one transaction. Detail pages read them
+with one indexed lookup.
+"""
+from collections import Counter
+from itertools import combinations
+
+from django.db import connection, transaction
+
+from .cache import bump_catalog_version
+from .models import Book, BookRecommendation, Order, OrderLine
+
+
+STAGING_TABLE = 'bookstore_cooccurrence_staging'
+
+DEFAULT_TOP = 6
+DEFAULT_BATCH_SIZE = 5000
+# A basket of n books adds n * (n - 1) pairs; bulk orders say little about taste.
+DEFAULT_MAX_BASKET = 50
+# Past this many recommending books, an edit invalidates every detail page instead.
+MAX_BUMPED_RECOMMENDERS = 100
+
+
+def recommendations_for(book_id, limit=DEFAULT_TOP):
+    """The books most often bought with `book_id`, best first, from one indexed lookup."""
+    return [row.recommended for row in _recommendation_rows(book_id, limit)]
+
+
+async def arecommendations_for(book_id, limit=DEFAULT_TOP):
+    """recommendations_for() for async views."""
+    return [row.recommended async for row in _recommendation_rows(book_id, limit)]
+
+
+def _recommendation_rows(book_id, limit):
+    return (
+        BookRecommendation.objects.filter(book_id=book_id)
+        .select_related('recommended')
+        .only('rank', 'recommended__id', 'recommended__title', 'recommended__author', 'recommended__price')
+        .order_by('rank')[:limit]
+    )
+
+
+def bump_book_pages(book_id):
+    """
+    Invalidates the cached detail page of `book_id` and of every book that
+    recommends it, since those pages show its title, author and price.
+
+    Call it before deleting the book: the delete cascades to the rows that
+    name its recommenders.
+    """
+    recommenders = list(
+        BookRecommendation.objects.filter(recommended_id=book_id)
+        .values_list('book_id', flat=True)[:MAX_BUMPED_RECOMMENDERS + 1]
+    )
+    if len(recommenders) > MAX_BUMPED_RECOMMENDERS:
+        bump_catalog_version(book_id, all_books=True)
+    else:
+        bump_catalog_version(book_id, related_ids=recommenders)
+
+
+def baskets(batch_size=DEFAULT_BATCH_SIZE):
+    """Yields chunks of baskets (sorted tuples of book ids), `batch_size` orders at a time."""
+    last_order_id = 0
+    while True:
+        order_ids = list(
+            Order.objects.filter(pk__gt=last_order_id).order_by('pk').values_list('pk', flat=True)[:batch_size]
+        )
+        if not order_ids:
+            return
+        lines = (
+            OrderLine.objects.filter(order_id__gte=order_ids[0], order_id__lte=order_ids[-1], book__isnull=False)
+            .order_by('order_id').values_list('order_id', 'book_id')
+        )
+        chunk = {}
+        for order_id, book_id in lines:
+            chunk.setdefault(order_id, set()).add(book_id)
+        yield [tuple(sorted(books)) for books in chunk.values()]
+        last_order_id = order_ids[-1]
+
+
+def count_pairs(chunk, max_basket=DEFAULT_MAX_BASKET):
+    """Co-occurrence counts {(book, other): orders} of one chunk of baskets, in both directions."""
+    pairs = Counter()
+    for basket in chunk:
+        if len(basket) < 2 or len(basket) > max_basket:
+            continue
+        for book, other in combinations(basket, 2):
+            pairs[book, other] += 1
+            pairs[other, book] += 1
+    return pairs
+
+
+def compute(top=DEFAULT_TOP, batch_size=DEFAULT_BATCH_SIZE, max_basket=DEFAULT_MAX_BASKET, min_orders=1):
+    """Recomputes every book's recommendations. Returns (orders, pairs, recommendations)."""
+    quote = connection.ops.quote_name
+    staging = quote(STAGING_TABLE)
+    with connection.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {staging}")
+        cursor.execute(
+            f"CREATE TABLE {staging} (book_id bigint NOT NULL, other_id bigint NOT NULL, "
+            f"together integer NOT NULL, PRIMARY KEY (book_id, other_id))"
+        )
+    try:
+        orders = 0
+        upsert = (
+            f"INSERT INTO {staging} (book_id, other_id, together) VALUES (%s, %s, %s) "
+            f"ON CONFLICT (book_id, other_id) DO UPDATE SET together = {staging}.together + excluded.together"
+        )
+        for chunk in baskets(batch_size):
+            orders += len(chunk)
+            pairs = count_pairs(chunk, max_basket)
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.executemany(upsert, [(book, other, n) for (book, other), n in sorted(pairs.items())])
+
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT COUNT(*) FROM {staging}")
+            pair_count = cursor.fetchone()[0]
+        recommendations = _replace_recommendations(staging, top, min_orders)
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {staging}")
+    return orders, pair_count, recommendations
+
+
+def _replace_recommendations(staging, top, min_orders):
+    quote = connection.ops.quote_name
+    table = quote(BookRecommendation._meta.db_table)
+    books = quote(Book._meta.db_table)
+    with transaction.atomic():
+        BookRecommendation.objects.all().delete()
+        with connection.cursor() as cursor:
+            # Books deleted since their orders were placed are skipped by the joins.
+            cursor.execute(
+                f"INSERT INTO {table} ({quote('book_id')}, {quote('recommended_id')}, {quote('score')}, {quote('rank')}) "
+                f"SELECT ranked.book_id, ranked.other_id, ranked.together, ranked.row_rank FROM ("
+                f"  SELECT pairs.book_id, pairs.other_id, pairs.together, ROW_NUMBER() OVER ("
+                f"    PARTITION BY pairs.book_id ORDER BY pairs.together DESC, pairs.other_id"
+                f"  ) AS row_rank"
+                f"  FROM {staging} pairs"
+                f"  JOIN {books} book ON book.id = pairs.book_id"
+                f"  JOIN {books} other ON other.id = pairs.other_id"
+                f"  WHERE pairs.together >= %s"
+                f") ranked WHERE ranked.row_rank <= %s",
+                [min_orders, top],
+            )
+            return cursor.rowcount
@@ -0,0 +1,126 @@
+"""
+Primary/replica database routing for catalog reads.
+
+Reads of the models in settings.REPLICA_READ_MODELS go to one of
+settings.DATABASE_REPLICAS, but only inside views using ReplicaReadMixin and only
+while the request is not pinned to the primary. A request is pinned once it
+writes one of those models, for the rest of the request, and ReplicaRoutingMiddleware
+keeps the visitor pinned for REPLICA_STICKY_SECONDS afterwards so they read their
+own writes while the replicas catch up. Everything else uses 'default'.
+"""
+import random
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+
+STICKY_COOKIE = 'bookstore_primary'
+
+UNSAFE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+
+class RoutingState:
+    __slots__ = ('replica_reads', 'pinned', 'wrote')
+
+    def __init__(self, pinned=False):
+        self.replica_reads = False
+        self.pinned = pinned
+        self.wrote = False
+
+
+_state = ContextVar('bookstore_routing_state', default=None)
+
+
+def replica_aliases():
+    return list(getattr(settings, 'DATABASE_REPLICAS', ()))
+
+
+def _replicated(model):
+    return model._meta.label in getattr(settings, 'REPLICA_READ_MODELS', ())
+
+
+class PrimaryReplicaRouter:
+    """Sends opted-in catalog reads to a replica and everything else to the primary."""
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or not state.replica_reads or state.pinned or not _replicated(model):
+            return 'default'
+        replicas = replica_aliases()
+        return random.choice(replicas) if replicas else 'default'
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None and _replicated(model):
+            state.pinned = state.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {'default', *replica_aliases()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas are copies of the primary and never migrated on their own.
+        if db in replica_aliases():
+            return False
+        return None
+
+
+class ReplicaReadMixin:
+    """Lets a view's reads of REPLICA_READ_MODELS go to a replica."""
+
+    def dispatch(self, request, *args, **kwargs):
+        state = _state.get()
+        if state is not None and request.method not in UNSAFE_METHODS:
+            state.replica_reads = True
+        return super().dispatch(request, *args, **kwargs)
+
+
+class ReplicaRoutingMiddleware:
+    """Tracks per-request routing state and the sticky-primary window after writes."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not replica_aliases():
+            return self.get_response(request)
+
+        state = RoutingState(pinned=STICKY_COOKIE in request.COOKIES)
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self.pin(response, state)
+
+    async def __acall__(self, request):
+        if not replica_aliases():
+            return await self.get_response(request)
+
+        state = RoutingState(pinned=STICKY_COOKIE in request.COOKIES)
+        token = _state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self.pin(response, state)
+
+    def pin(self, response, state):
+        if state.wrote:
+            response.set_cookie(
+                STICKY_COOKIE, '1', max_age=getattr(settings, 'REPLICA_STICKY_SECONDS', 5),
+                httponly=True, samesite='Lax',
+            )
+        return response
@@ -0,0 +1,117 @@
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+from .models import Book
+
+
+FTS_TABLE = 'bookstore_book_fts'
+
+# bm25() column weights, in the order the FTS columns are declared below.
+TITLE_WEIGHT = 10.0
+AUTHOR_WEIGHT = 5.0
+DESCRIPTION_WEIGHT = 1.0
+
+CREATE_SQL = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        title, author, description,
+        content='bookstore_book', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )
+    """,
+    # The triggers keep the index in step with every write to bookstore_book,
+    # including queryset.update()/delete() and raw SQL that bypass model signals.
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON bookstore_book BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, title, author, description)
+        VALUES (new.id, new.title, new.author, new.description);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON bookstore_book BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, author, description)
+        VALUES ('delete', old.id, old.title, old.author, old.description);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF title, author, description ON bookstore_book BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, author, description)
+        VALUES ('delete', old.id, old.title, old.author, old.description);
+        INSERT INTO {FTS_TABLE}(rowid, title, author, description)
+        VALUES (new.id, new.title, new.author, new.description);
+    END
+    """,
+]
+
+DROP_SQL = [
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_au",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ad",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ai",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def fts_available(conn=None):
+    """The FTS5 index only exists on SQLite; other backends fall back to icontains."""
+    return (conn or connection).vendor == 'sqlite'
+
+
+def build_match_expression(query):
+    """
+    Turns free text into a safe FTS5 MATCH expression.
+
+    Each word is quoted (so FTS operators typed by users are treated as text) and
+    made a prefix match, and all words must be present.
+    """
+    tokens = _TOKEN_RE.findall(query or '')
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def rebuild_index(optimize=True):
+    """Repopulates the FTS index from bookstore_book, e.g. after a bulk load."""
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+        if optimize:
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+
+
+def search_books(query, limit, offset=0, queryset=None):
+    """
+    Returns up to `limit` Book objects matching `query`, best bm25 match first.
+
+    Only the ids are ranked inside the FTS index; the matching rows are then
+    fetched from `queryset` (all books by default) by primary key.
+    """
+    if queryset is None:
+        queryset = Book.objects.all()
+    expression = build_match_expression(query)
+    if not expression:
+        return []
+
+    if not fts_available():
+        condition = Q()
+        for word in _TOKEN_RE.findall(query):
+            condition &= (
+                Q(title__icontains=word) | Q(author__icontains=word) | Q(description__icontains=word)
+            )
+        return list(queryset.filter(condition).order_by('title', 'id')[offset:offset + limit])
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT rowid FROM {FTS_TABLE}
+            WHERE {FTS_TABLE} MATCH %s
+            ORDER BY bm25({FTS_TABLE}, %s, %s, %s)
+            LIMIT %s OFFSET %s
+            """,
+            [expression, TITLE_WEIGHT, AUTHOR_WEIGHT, DESCRIPTION_WEIGHT, limit, offset],
+        )
+        ids = [row[0] for row in cursor.fetchall()]
+
+    books = queryset.in_bulk(ids)
+    return [books[book_id] for book_id in ids if book_id in books]
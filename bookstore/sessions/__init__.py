@@ -0,0 +1,46 @@
+"""
+Session engines that skip writing a session whose data has not changed.
+
+Django saves the session whenever it is marked modified, including when a view
+stores a value it already held or right after creating it. Point SESSION_ENGINE
+at bookstore.sessions.db, bookstore.sessions.cached_db or bookstore.sessions.cache
+to drop those redundant writes. The expiry date is then only pushed back when
+the data really changes.
+"""
+
+
+class SkipUnchangedSaveMixin:
+    """Remembers the serialized data as loaded or last saved and skips saving it again."""
+    _saved_state = None
+
+    def _state(self, data):
+        return self.serializer().dumps(data)
+
+    def load(self):
+        data = super().load()
+        self._saved_state = self._state(data)
+        return data
+
+    async def aload(self):
+        data = await super().aload()
+        self._saved_state = self._state(data)
+        return data
+
+    def _unchanged(self, must_create):
+        data = getattr(self, '_session_cache', None)
+        return (
+            not must_create and data is not None and self.session_key
+            and self._saved_state is not None and self._state(data) == self._saved_state
+        )
+
+    def save(self, must_create=False):
+        if self._unchanged(must_create):
+            return
+        super().save(must_create)
+        self._saved_state = self._state(self._get_session())
+
+    async def asave(self, must_create=False):
+        if self._unchanged(must_create):
+            return
+        await super().asave(must_create)
+        self._saved_state = self._state(await self._aget_session())
@@ -0,0 +1,72 @@
+// Public catalog pages are the same for every visitor so proxies can cache
+// them; the visitor's menu, messages, cart count and CSRF token come from
+// the session endpoint.
+var session = (function () {
+    var menu = document.getElementById('user-menu');
+    if (!menu.dataset.session || !window.fetch) { return null; }
+    return fetch(menu.dataset.session, {credentials: 'same-origin'}).then(function (response) {
+        if (!response.ok) { throw new Error(response.status); }
+        return response.json();
+    }).then(function (data) {
+        menu.innerHTML = data.user_menu;
+        document.getElementById('session-messages').innerHTML = data.messages;
+        document.getElementById('nav-staff').hidden = !data.staff;
+        document.getElementById('cart-count').textContent = data.cart_items || '';
+        return data;
+    });
+})();
+
+// Progressive enhancement: "Add to Cart" forms post to the JSON cart API
+// instead of redirecting to the cart page. Without JS they submit normally;
+// on public pages that opens the confirmation page, which has a CSRF token.
+document.addEventListener('submit', function (event) {
+    var form = event.target;
+    if (!form.dataset.cartApi || !window.fetch) { return; }
+    event.preventDefault();
+    var button = form.querySelector('button[type="submit"]');
+    // On public pages the CSRF token arrives with the session data.
+    Promise.resolve(session).then(function (data) {
+        var token = data ? data.csrf_token : form.querySelector('[name=csrfmiddlewaretoken]').value;
+        return fetch(form.dataset.cartApi, {
+            method: 'POST',
+            headers: {'X-CSRFToken': token},
+            credentials: 'same-origin'
+        });
+    }).then(function (response) {
+        if (!response.ok) { throw new Error(response.status); }
+        return response.json();
+    }).then(function (data) {
+        document.getElementById('cart-count').textContent = data.cart.items;
+        if (button) { button.textContent = 'Added (' + data.line.quantity + ' in cart)'; }
+    }).catch(function () {
+        form.submit();
+    });
+});
+
+// Search suggestions as the visitor types, from the typeahead endpoint.
+(function () {
+    var input = document.querySelector('input[data-suggest]');
+    var list = document.getElementById('search-suggestions');
+    var timer = null;
+    if (!input || !window.fetch) { return; }
+    input.addEventListener('input', function () {
+        clearTimeout(timer);
+        var query = input.value.trim();
+        if (!query) { list.innerHTML = ''; return; }
+        timer = setTimeout(function () {
+            fetch(input.dataset.suggest + '?q=' + encodeURIComponent(query), {credentials: 'same-origin'})
+                .then(function (response) { return response.ok ? response.json() : null; })
+                .then(function (data) {
+                    if (!data || data.query !== input.value.trim()) { return; }
+                    list.innerHTML = '';
+                    data.titles.map(function (book) { return book.title; })
+                        .concat(data.authors.map(function (author) { return author.name; }))
+                        .forEach(function (text) {
+                            var option = document.createElement('option');
+                            option.value = text;
+                            list.appendChild(option);
+                        });
+                });
+        }, 150);
+    });
+})();
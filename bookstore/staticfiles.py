@@ -0,0 +1,178 @@
+"""
+Static files served by the application itself, for deployments without a CDN.
+
+CompressedManifestStaticFilesStorage gives every collected file a content-hashed
+name, as ManifestStaticFilesStorage does, and also writes a gzip variant of
+each compressible one, so compression happens once at `collectstatic` time.
+StaticFilesMiddleware serves STATIC_ROOT: hashed names are cached for a year
+as immutable, since a changed file gets a new name, and clients that accept
+gzip get the precompressed variant. Nothing is compressed per request.
+"""
+import gzip
+import mimetypes
+import re
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import FileResponse, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.map', '.svg', '.json', '.txt', '.xml', '.html')
+# Variants that save less than this are not worth a second file.
+MIN_COMPRESSION_SAVING = 0.05
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Unhashed names can change in place, so shared caches only keep them briefly.
+MUTABLE_CACHE_CONTROL = 'public, max-age=60'
+
+accepts_gzip = re.compile(r'\bgzip\b')
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """ManifestStaticFilesStorage that also writes `<hashed name>.gz` for compressible files."""
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for name in sorted(set(self.hashed_files.values())):
+            compressed = self.compress(name)
+            if compressed:
+                yield name, compressed, True
+
+    def compress(self, name):
+        """Writes the gzip variant of `name`; returns its name, or None if it is not worth having."""
+        if not name.endswith(COMPRESSIBLE_EXTENSIONS):
+            return None
+        path = Path(self.path(name))
+        data = path.read_bytes()
+        # mtime=0 keeps the variant identical across builds of the same file.
+        compressed = gzip.compress(data, compresslevel=9, mtime=0)
+        target = path.with_name(path.name + '.gz')
+        if len(compressed) > len(data) * (1 - MIN_COMPRESSION_SAVING):
+            target.unlink(missing_ok=True)
+            return None
+        target.write_bytes(compressed)
+        return name + '.gz'
+
+
+class StaticFile:
+    """One file under STATIC_ROOT, with the headers to serve it and its gzip variant."""
+
+    def __init__(self, path, immutable):
+        self.path = path
+        stat = path.stat()
+        self.size = stat.st_size
+        self.mtime = int(stat.st_mtime)
+        self.last_modified = http_date(self.mtime)
+        self.etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+        content_type, _ = mimetypes.guess_type(path.name)
+        if path.suffix == '.map':
+            content_type = 'application/json'
+        content_type = content_type or 'application/octet-stream'
+        if content_type.startswith('text/') or content_type in ('application/json', 'application/javascript'):
+            content_type += '; charset=utf-8'
+        self.content_type = content_type
+        self.cache_control = IMMUTABLE_CACHE_CONTROL if immutable else MUTABLE_CACHE_CONTROL
+        gzipped = path.with_name(path.name + '.gz')
+        self.gzip_path = gzipped if gzipped.is_file() else None
+        self.gzip_size = gzipped.stat().st_size if self.gzip_path else None
+
+    def variant(self, request):
+        """(path, size, etag, encoding) of the representation to send."""
+        if self.gzip_path and accepts_gzip.search(request.headers.get('Accept-Encoding', '')):
+            return self.gzip_path, self.gzip_size, self.etag[:-1] + '-gzip"', 'gzip'
+        return self.path, self.size, self.etag, None
+
+    def finish(self, response, size, etag, encoding):
+        response['Cache-Control'] = self.cache_control
+        response['ETag'] = etag
+        response['Last-Modified'] = self.last_modified
+        response['X-Content-Type-Options'] = 'nosniff'
+        if self.gzip_path:
+            response['Vary'] = 'Accept-Encoding'
+        if response.status_code == 200:
+            response['Content-Length'] = str(size)
+            if encoding:
+                response['Content-Encoding'] = encoding
+        return response
+
+
+def index_static_root(root, hashed_names, skip=()):
+    """{url path: StaticFile} for every file under `root`; gzip variants are not served on their own."""
+    files = {}
+    for path in root.rglob('*'):
+        name = path.relative_to(root).as_posix()
+        if not path.is_file() or name in skip:
+            continue
+        if path.suffix == '.gz' and path.with_suffix('').is_file():
+            continue
+        files[name] = StaticFile(path, immutable=name in hashed_names)
+    return files
+
+
+class StaticFilesMiddleware:
+    """
+    Serves GET and HEAD under STATIC_URL from the files collected into STATIC_ROOT.
+
+    The files are indexed once at startup (before gunicorn forks its workers);
+    run collectstatic before starting the server. Not used with DEBUG, where
+    runserver serves static files from the apps.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        root = Path(settings.STATIC_ROOT) if settings.STATIC_ROOT else None
+        if settings.DEBUG or root is None or not root.is_dir() or not settings.STATIC_URL.startswith('/'):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.prefix = settings.STATIC_URL
+        manifest_name = getattr(staticfiles_storage, 'manifest_name', None)
+        hashed_names = set(getattr(staticfiles_storage, 'hashed_files', {}).values())
+        self.files = index_static_root(root, hashed_names, skip={manifest_name})
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def find(self, request):
+        if request.method not in ('GET', 'HEAD') or not request.path_info.startswith(self.prefix):
+            return None
+        return self.files.get(request.path_info[len(self.prefix):])
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        static_file = self.find(request)
+        if static_file is None:
+            return self.get_response(request)
+        path, size, etag, encoding = static_file.variant(request)
+        response = get_conditional_response(request, etag=etag, last_modified=static_file.mtime)
+        if response is None:
+            if request.method == 'HEAD':
+                response = HttpResponse(content_type=static_file.content_type)
+            else:
+                # Sent with the server's sendfile where it has one (wsgi.file_wrapper).
+                response = FileResponse(path.open('rb'), content_type=static_file.content_type)
+                # Not a download, and the name would be the .gz variant's.
+                response.headers.pop('Content-Disposition', None)
+        return static_file.finish(response, size, etag, encoding)
+
+    async def __acall__(self, request):
+        static_file = self.find(request)
+        if static_file is None:
+            return await self.get_response(request)
+        path, size, etag, encoding = static_file.variant(request)
+        response = get_conditional_response(request, etag=etag, last_modified=static_file.mtime)
+        if response is None:
+            # ASGI servers have no sendfile, and Django reads a FileResponse whole
+            # under ASGI anyway; reading it off the event loop is the same work.
+            body = b'' if request.method == 'HEAD' else await sync_to_async(path.read_bytes)()
+            response = HttpResponse(body, content_type=static_file.content_type)
+        return static_file.finish(response, size, etag, encoding)
@@ -1,3 +1,2051 @@
-from django.test import TestCase
+import base64
+import csv
+import gzip
+import io
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+from decimal import Decimal
+from pathlib import Path
+from unittest import mock
 
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.contrib.auth.models import User
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections
+from django.db.backends.sqlite3.base import DatabaseWrapper as SQLiteDatabaseWrapper
+from django.db.models import Count, Sum
+from django.template import engines
+from django.templatetags.static import static
+from django.http import JsonResponse
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
+from django.views import View
 
+from . import bulk, facets, metrics, recommendations, throttle, typeahead, views
+from . import cart as cart_module
+from .bulk import BulkActionError, apply_bulk_action
+from .cache import get_all_books_version
+from .cart import add_item, merge_anonymous_cart
+from .db import is_busy_error
+from .inventory import OutOfStock, reservation_expiry, sweep_expired_reservations
+from .metrics import REGISTRY, Histogram, MetricsRegistry, RequestStats, TimedTemplate, render_prometheus
+from .models import Book, BookFacet, BookRecommendation, Cart, CartItem, Order, OrderLine
+from .orders import CheckoutError, place_order
+from .pagination import decode_cursor, encode_cursor
+from .query_budget import QueryBudgetExceeded, QueryBudgetTestMixin, query_budget
+from .routers import STICKY_COOKIE, PrimaryReplicaRouter, ReplicaReadMixin, ReplicaRoutingMiddleware
+from .search import build_match_expression, search_books
+from .sessions import (
+    cache as session_cache_engine, cached_db as session_cached_db_engine, db as session_db_engine,
+)
+from .throttle import hashing_slot, hashing_wait, take_token
+from .warmup import warm_up
+
+
+class ConditionalGetTests(TestCase):
+    """BookListView and BookDetailView answer revalidation with a cheap 304."""
+
+    def setUp(self):
+        cache.clear()
+        self.book = Book.objects.create(
+            title="Dune", author="Frank Herbert", description="Spice.", price="9.99"
+        )
+        self.detail_url = reverse('bookstore:book_detail', args=[self.book.pk])
+        self.list_url = reverse('bookstore:book_list')
+
+    def test_detail_sends_validators(self):
+        response = self.client.get(self.detail_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(self.book.content_hash, response['ETag'])
+        self.assertIn('Last-Modified', response)
+
+    def test_detail_if_none_match_returns_304_without_rendering(self):
+        etag = self.client.get(self.detail_url)['ETag']
+        with self.assertNumQueries(1), self.assertTemplateNotUsed('bookstore/book_detail.html'):
+            response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_detail_if_modified_since_returns_304(self):
+        last_modified = self.client.get(self.detail_url)['Last-Modified']
+        with self.assertNumQueries(1), self.assertTemplateNotUsed('bookstore/book_detail.html'):
+            response = self.client.get(self.detail_url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_detail_etag_changes_when_book_is_updated(self):
+        etag = self.client.get(self.detail_url)['ETag']
+        self.book.price = '12.50'
+        self.book.save()
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_list_if_none_match_returns_304_without_rendering(self):
+        etag = self.client.get(self.list_url)['ETag']
+        with self.assertNumQueries(1), self.assertTemplateNotUsed('bookstore/book_list.html'):
+            response = self.client.get(self.list_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_list_etag_changes_when_a_book_is_deleted(self):
+        Book.objects.create(title="Emma", author="Jane Austen", price="5.00")
+        staff = User.objects.create_user('staff', password='secret', is_staff=True)
+        self.client.force_login(staff)
+        etag = self.client.get(self.list_url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('bookstore:admin_book_delete', args=[self.book.pk]))
+        response = self.client.get(self.list_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_list_has_no_last_modified_for_deletes_to_hide_behind(self):
+        response = self.client.get(self.list_url)
+        self.assertIn('ETag', response)
+        self.assertNotIn('Last-Modified', response)
+        emma = Book.objects.create(title="Emma", author="Jane Austen", price="5.00")
+        # The newest updated_at, which a deletion does not move.
+        last_modified = http_date(emma.updated_at.timestamp() + 1)
+        self.client.force_login(User.objects.create_user('staff', password='secret', is_staff=True))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('bookstore:admin_book_delete', args=[self.book.pk]))
+        response = self.client.get(self.list_url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, "Dune")
+
+
+class PublicPageTests(TestCase):
+    """Catalog pages are the same for every visitor, so a reverse proxy can cache them."""
+
+    def setUp(self):
+        cache.clear()
+        self.book = Book.objects.create(title="Dune", author="Frank Herbert", price="9.99", stock=10)
+        self.user = User.objects.create_user('reader', password='secret', is_staff=True)
+        self.urls = [
+            reverse('bookstore:home'),
+            reverse('bookstore:book_list'),
+            reverse('bookstore:book_search') + '?q=dune',
+            reverse('bookstore:author_index'),
+            reverse('bookstore:book_detail', args=[self.book.pk]),
+        ]
+
+    def test_pages_are_publicly_cacheable(self):
+        for url in self.urls:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertIn('public', response['Cache-Control'])
+                self.assertIn('max-age=60', response['Cache-Control'])
+                self.assertNotIn('Cookie', response.get('Vary', ''))
+                self.assertFalse(response.cookies)
+
+    def test_not_modified_responses_keep_cache_headers(self):
+        url = reverse('bookstore:book_detail', args=[self.book.pk])
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertIn('public', response['Cache-Control'])
+
+    def test_visitors_get_identical_bodies(self):
+        first, second = Client(), Client()
+        # A visitor with a session, a cart and a pending message sees the same page.
+        second.post(reverse('bookstore:add_to_cart', args=[self.book.pk]))
+        member = Client()
+        member.force_login(self.user)
+        for url in self.urls:
+            with self.subTest(url=url):
+                body = first.get(url).content
+                self.assertEqual(second.get(url).content, body)
+                self.assertEqual(member.get(url).content, body)
+                self.assertNotRegex(body, rb'csrfmiddlewaretoken" value="[^"]')
+                self.assertNotIn(b'reader', body)
+
+    def test_session_view_sends_visitor_fragments(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('bookstore:session'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('private', response['Cache-Control'])
+        self.assertIn('no-store', response['Cache-Control'])
+        data = response.json()
+        self.assertTrue(data['authenticated'])
+        self.assertTrue(data['staff'])
+        self.assertIn('reader', data['user_menu'])
+        self.assertEqual(data['cart_items'], 0)
+
+    def test_session_view_delivers_messages_left_out_of_public_pages(self):
+        self.client.post(reverse('bookstore:add_to_cart', args=[self.book.pk]))
+        self.assertNotContains(self.client.get(reverse('bookstore:book_list')), "added to cart")
+        data = self.client.get(reverse('bookstore:session')).json()
+        self.assertFalse(data['authenticated'])
+        self.assertIn("&#x27;Dune&#x27; added to cart.", data['messages'])
+        self.assertEqual(data['cart_items'], 1)
+
+    def test_session_csrf_token_lets_a_public_page_add_to_cart(self):
+        client = Client(enforce_csrf_checks=True)
+        client.get(reverse('bookstore:book_detail', args=[self.book.pk]))
+        add_url = reverse('bookstore:api_cart_add', args=[self.book.pk])
+        self.assertEqual(client.post(add_url).status_code, 403)
+        token = client.get(reverse('bookstore:session')).json()['csrf_token']
+        response = client.post(add_url, HTTP_X_CSRFTOKEN=token)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(client.get(reverse('bookstore:session')).json()['cart_items'], 1)
+
+    def test_cart_forms_work_without_javascript(self):
+        detail_url = reverse('bookstore:book_detail', args=[self.book.pk])
+        for number, url in enumerate([reverse('bookstore:book_list'), detail_url], start=1):
+            with self.subTest(url=url):
+                client = Client(enforce_csrf_checks=True)
+                # The form exactly as the public page renders it, submitted as a browser would.
+                action, method = re.search(
+                    r'<form action="([^"]+)" method="(\w+)"[^>]*data-cart-api', client.get(url).content.decode()
+                ).groups()
+                self.assertEqual(method, 'get')
+                page = client.get(action)
+                self.assertEqual(page.status_code, 200)
+                self.assertIn('no-store', page['Cache-Control'])
+                self.assertIn(settings.CSRF_COOKIE_NAME, page.cookies)
+                action, token = re.search(
+                    r'<form action="([^"]+)" method="post">\s*'
+                    r'<input type="hidden" name="csrfmiddlewaretoken" value="([^"]+)"',
+                    page.content.decode(),
+                ).groups()
+                response = client.post(action, {'csrfmiddlewaretoken': token})
+                self.assertRedirects(response, reverse('bookstore:cart_view'))
+                self.assertEqual(client.get(reverse('bookstore:session')).json()['cart_items'], 1)
+        self.assertEqual(Book.objects.get(pk=self.book.pk).stock, 10 - number)
+
+    def test_login_link_shows_a_logged_in_visitor_who_they_are(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('bookstore:login'))
+        self.assertContains(response, "You are logged in as <strong>reader</strong>")
+        self.assertNotContains(response, 'name="password"')
+        next_url = reverse('bookstore:cart_view')
+        self.assertRedirects(self.client.get(reverse('bookstore:login') + f'?next={next_url}'), next_url)
+
+
+class AsyncViewTests(QueryBudgetTestMixin, TestCase):
+    """The async read views answer like their sync counterparts under ASGI."""
+
+    def setUp(self):
+        cache.clear()
+        self.book = Book.objects.create(title="Dune", author="Frank Herbert", price="9.99", stock=10)
+        self.user = User.objects.create_user('reader', password='secret')
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, book=self.book, quantity=2)
+
+    async def test_catalog_pages_match_sync_views(self):
+        detail = await self.async_client.get(reverse('bookstore:async_book_detail', args=[self.book.pk]))
+        self.assertEqual(detail.status_code, 200)
+        self.assertContains(detail, "Dune")
+        self.assertIn('public', detail['Cache-Control'])
+        sync_detail = await self.async_client.get(reverse('bookstore:book_detail', args=[self.book.pk]))
+        self.assertEqual(detail['ETag'], sync_detail['ETag'])
+        not_modified = await self.async_client.get(
+            reverse('bookstore:async_book_detail', args=[self.book.pk]), headers={'if-none-match': detail['ETag']},
+        )
+        self.assertEqual(not_modified.status_code, 304)
+
+        listing = await self.async_client.get(reverse('bookstore:async_book_list'), {'author': 'Frank Herbert'})
+        self.assertContains(listing, "Books by Frank Herbert")
+        missing = await self.async_client.get(reverse('bookstore:async_book_detail', args=[self.book.pk + 1]))
+        self.assertEqual(missing.status_code, 404)
+
+    async def test_cart_and_suggestions_match_sync_views(self):
+        await self.async_client.aforce_login(self.user)
+        answers = {}
+        for name, data in (('api_cart', None), ('book_suggest', {'q': 'du'})):
+            sync_response = await self.async_client.get(reverse(f'bookstore:{name}'), data)
+            answers[name] = (await self.async_client.get(reverse(f'bookstore:async_{name}'), data)).json()
+            self.assertEqual(answers[name], sync_response.json())
+        self.assertEqual(answers['api_cart']['cart']['items'], 2)
+        self.assertEqual(answers['book_suggest']['titles'][0]['title'], "Dune")
+
+    async def test_query_budget_sees_async_queries(self):
+        await self.async_client.aforce_login(self.user)
+        with self.assertMaxQueries(100) as budget:
+            await self.async_client.get(reverse('bookstore:async_api_cart'))
+        self.assertGreaterEqual(len(budget.queries), 3)
+        self.assertLessEqual(len(budget.queries), views.AsyncCartApiView.query_budget)
+
+
+class HealthCheckTests(TestCase):
+    """The probes answer before the rest of the middleware, whatever the Host header."""
+
+    def test_liveness_runs_no_queries(self):
+        with self.assertNumQueries(0):
+            response = self.client.get('/health/live/', HTTP_HOST='10.0.0.7:8000')
+        self.assertEqual(response.json(), {'status': 'ok'})
+        self.assertIn('no-store', response['Cache-Control'])
+        self.assertNotIn('Set-Cookie', response)
+
+    def test_readiness_reads_one_row_per_database(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/health/ready/', HTTP_HOST='10.0.0.7:8000')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'status': 'ok', 'databases': {'default': 'ok'}})
+
+    def test_readiness_fails_when_a_database_does_not_answer(self):
+        with mock.patch('bookstore.health.Book.objects.using', side_effect=OperationalError("disk I/O error")), \
+                self.assertLogs('bookstore.health', 'ERROR'):
+            response = self.client.get('/health/ready/')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json(), {'status': 'unavailable', 'databases': {'default': 'error'}})
+
+    async def test_probes_under_asgi(self):
+        live = await self.async_client.get('/health/live/')
+        ready = await self.async_client.get('/health/ready/')
+        self.assertEqual((live.status_code, ready.status_code), (200, 200))
+        not_a_probe = await self.async_client.post('/health/ready/')
+        self.assertEqual(not_a_probe.status_code, 404)
+
+    def test_warm_up_compiles_every_template_before_the_first_request(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        Book.objects.create(title="Dune", author="Frank Herbert", price="9.99")
+        for engine in engines.all():
+            for loader in engine.engine.template_loaders:
+                loader.reset()
+        timings = warm_up()
+        self.assertEqual(timings['typeahead'][0], 1)
+        with mock.patch(
+            'django.template.loaders.app_directories.Loader.get_contents',
+            side_effect=AssertionError("template read from disk"),
+        ):
+            response = self.client.get(reverse('bookstore:book_list'))
+        self.assertContains(response, "Dune")
+
+
+@override_settings(
+    STORAGES={
+        **settings.STORAGES,
+        'staticfiles': {'BACKEND': 'bookstore.staticfiles.CompressedManifestStaticFilesStorage'},
+    },
+)
+class StaticFilesTests(TestCase):
+    """collectstatic hashes and precompresses the assets; the middleware serves them."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        static_root = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, static_root)
+        cls.enterClassContext(override_settings(STATIC_ROOT=static_root))
+        call_command('collectstatic', interactive=False, verbosity=0)
+
+    def setUp(self):
+        cache.clear()
+        self.css_url = static('bookstore/vendor/bootstrap-5.3.3/css/bootstrap.min.css')
+
+    def test_collectstatic_writes_hashed_names_and_gzip_variants(self):
+        hashed = staticfiles_storage.stored_name('bookstore/css/bookstore.css')
+        self.assertRegex(hashed, r'^bookstore/css/bookstore\.[0-9a-f]{12}\.css$')
+        original = Path(staticfiles_storage.path(hashed)).read_bytes()
+        self.assertEqual(gzip.decompress(Path(staticfiles_storage.path(hashed + '.gz')).read_bytes()), original)
+
+    def test_pages_link_hashed_local_assets(self):
+        response = self.client.get(reverse('bookstore:home'))
+        self.assertContains(response, self.css_url)
+        self.assertContains(response, static('bookstore/js/bookstore.js'))
+        self.assertNotContains(response, 'cdn.jsdelivr.net')
+
+    def test_middleware_serves_gzip_with_far_future_caching(self):
+        with self.assertNumQueries(0):
+            response = self.client.get(self.css_url, HTTP_ACCEPT_ENCODING='br, gzip')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertTrue(response['Content-Type'].startswith('text/css'))
+        self.assertNotIn('Content-Disposition', response)
+        body = gzip.decompress(b''.join(response.streaming_content))
+        self.assertIn(b'Bootstrap  v5.3.3', body)
+
+        identity = self.client.get(self.css_url)
+        self.assertNotIn('Content-Encoding', identity)
+        self.assertEqual(int(identity['Content-Length']), len(body))
+        self.assertEqual(self.client.get(self.css_url, HTTP_IF_NONE_MATCH=identity['ETag']).status_code, 304)
+
+    async def test_middleware_under_asgi(self):
+        response = await self.async_client.get(self.css_url, headers={'accept-encoding': 'gzip'})
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn(b'Bootstrap  v5.3.3', gzip.decompress(response.content))
+        missing = await self.async_client.get('/static/bookstore/missing.css')
+        self.assertEqual(missing.status_code, 404)
+
+
+@override_settings(
+    PASSWORD_HASH_ITERATIONS=1000,
+    AUTH_THROTTLE_RATES={'login:ip': (10, 6), 'login:username': (3, 2), 'register:ip': (2, 1)},
+)
+class AuthThrottleTests(TestCase):
+    """Login and registration floods are refused before any password is hashed."""
+
+    def setUp(self):
+        caches[settings.AUTH_THROTTLE_CACHE_ALIAS].clear()
+        self.user = User.objects.create_user('reader', password='secret')
+        self.login_url = reverse('bookstore:login')
+
+    def test_username_bucket_refuses_before_hashing(self):
+        with mock.patch('bookstore.views.authenticate', wraps=authenticate) as authenticate_spy:
+            for _ in range(3):
+                self.assertContains(self.client.post(self.login_url, {'username': 'Reader', 'password': 'x'}),
+                                    "Invalid username or password.")
+            response = self.client.post(self.login_url, {'username': 'reader', 'password': 'secret'})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '30')
+        self.assertContains(response, "Too many attempts", status_code=429)
+        self.assertEqual(authenticate_spy.call_count, 3)
+        # Another username from the same address still gets through.
+        other = self.client.post(self.login_url, {'username': 'someone', 'password': 'x'})
+        self.assertEqual(other.status_code, 200)
+
+    def test_ip_bucket_follows_the_forwarded_client(self):
+        register_url = reverse('bookstore:register')
+        data = {'username': 'new', 'password': 'pw', 'password_confirm': 'other'}
+        with self.settings(NUM_PROXIES=1):
+            # The proxy appends the address it saw; entries before it are the client's to forge.
+            for spoofed in ('10.0.0.1', '10.0.0.2', '10.0.0.3'):
+                response = self.client.post(register_url, data, HTTP_X_FORWARDED_FOR=f'{spoofed}, 203.0.113.9')
+            self.assertEqual(response.status_code, 429)
+            response = self.client.post(register_url, data, HTTP_X_FORWARDED_FOR='203.0.113.9, 198.51.100.4')
+            self.assertEqual(response.status_code, 200)
+
+    def test_buckets_refill_over_time(self):
+        now = time.time()
+        waits = [take_token('login:username', 'reader', now=now) for _ in range(4)]
+        self.assertEqual(waits[:3], [0, 0, 0])
+        self.assertAlmostEqual(waits[3], 30)
+        self.assertEqual(take_token('login:username', 'reader', now=now + 30), 0)
+        self.assertGreater(take_token('login:username', 'reader', now=now + 30), 0)
+        self.assertEqual(take_token('login:unthrottled', 'reader', now=now), 0)
+
+    @override_settings(PASSWORD_HASH_CONCURRENCY=1, PASSWORD_HASH_WAIT=0)
+    def test_busy_hashing_slots_answer_503(self):
+        with hashing_slot():
+            response = self.client.post(self.login_url, {'username': 'reader', 'password': 'secret'})
+        self.assertEqual(response.status_code, 503)
+        self.assertNotIn('_auth_user_id', self.client.session)
+        response = self.client.post(self.login_url, {'username': 'reader', 'password': 'secret'})
+        self.assertEqual(response.status_code, 302)
+
+    @override_settings(PASSWORD_HASH_WAIT=None, PASSWORD_HASH_WAIT_HASHES=2)
+    def test_hashing_wait_follows_measured_hash_time(self):
+        with mock.patch.object(throttle, '_hash_seconds', None):
+            self.assertEqual(hashing_wait(), 2 * throttle.INITIAL_HASH_SECONDS)
+            with hashing_slot():
+                time.sleep(0.1)
+            self.assertGreaterEqual(hashing_wait(), 0.2)
+            self.assertLess(hashing_wait(), 1)
+        with self.settings(PASSWORD_HASH_WAIT=0.5):
+            self.assertEqual(hashing_wait(), 0.5)
+
+    def test_login_rehashes_when_the_cost_changes(self):
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$1000$'))
+        with self.settings(PASSWORD_HASH_ITERATIONS=1500):
+            response = self.client.post(self.login_url, {'username': 'reader', 'password': 'secret'})
+        self.assertEqual(response.status_code, 302)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$1500$'))
+        self.assertTrue(self.user.check_password('secret'))
+
+
+class QueryBudgetTests(QueryBudgetTestMixin, TestCase):
+    """Every view stays within its declared query budget, whatever the data size."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('reader', password='secret')
+        self.staff = User.objects.create_user('staff', password='secret', is_staff=True)
+        self.books = self.add_books(3)
+
+    def add_books(self, count):
+        start = Book.objects.count()
+        return Book.objects.bulk_create(
+            Book(title=f"Book {start + i:04d}", author=f"Author {i % 3}", price="5.00", stock=100)
+            for i in range(count)
+        )
+
+    def fill_cart(self, lines):
+        cart, _ = Cart.objects.get_or_create(user=self.user)
+        CartItem.objects.bulk_create(
+            CartItem(cart=cart, book=book, quantity=2, reserved_until=reservation_expiry())
+            for book in self.add_books(lines)
+        )
+
+    def count_queries(self, url):
+        with self.assertMaxQueries(100) as budget:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return len(budget.queries)
+
+    def test_catalog_views_within_budget(self):
+        book_id = self.books[0].pk
+        for client_user in (None, self.user):
+            if client_user:
+                self.client.force_login(client_user)
+            cache.clear()
+            self.assertWithinViewBudget(views.HomeView, reverse('bookstore:home'))
+            self.assertWithinViewBudget(views.BookListView, reverse('bookstore:book_list'))
+            self.assertWithinViewBudget(views.BookSearchView, reverse('bookstore:book_search'), data={'q': 'book'})
+            self.assertWithinViewBudget(views.BookSuggestView, reverse('bookstore:book_suggest'), data={'q': 'bo'})
+            self.assertWithinViewBudget(
+                views.BookListView, reverse('bookstore:book_list'), data={'author': 'Author 1', 'price': 'under-10'},
+            )
+            self.assertWithinViewBudget(views.AuthorIndexView, reverse('bookstore:author_index'), data={'letter': 'A'})
+            self.assertWithinViewBudget(views.BookDetailView, reverse('bookstore:book_detail', args=[book_id]))
+            self.assertWithinViewBudget(views.AsyncBookListView, reverse('bookstore:async_book_list'))
+            self.assertWithinViewBudget(
+                views.AsyncBookSuggestView, reverse('bookstore:async_book_suggest'), data={'q': 'bo'},
+            )
+            self.assertWithinViewBudget(
+                views.AsyncBookDetailView, reverse('bookstore:async_book_detail', args=[book_id]),
+            )
+
+    def test_account_views_within_budget(self):
+        self.assertWithinViewBudget(views.UserRegistrationView, reverse('bookstore:register'))
+        self.assertWithinViewBudget(views.CustomLoginView, reverse('bookstore:login'))
+        self.client.post(reverse('bookstore:add_to_cart', args=[self.books[0].pk]))
+        self.assertWithinViewBudget(
+            views.UserRegistrationView, reverse('bookstore:register'), method='post',
+            data={'username': 'new', 'password': 'pw', 'password_confirm': 'pw'},
+        )
+        self.assertWithinViewBudget(views.CustomLogoutView, reverse('bookstore:logout'), method='post')
+        self.client.post(reverse('bookstore:add_to_cart', args=[self.books[1].pk]))
+        self.assertWithinViewBudget(
+            views.CustomLoginView, reverse('bookstore:login'), method='post',
+            data={'username': 'new', 'password': 'pw'},
+        )
+
+    def test_cart_views_within_budget(self):
+        self.client.force_login(self.user)
+        self.fill_cart(5)
+        book_id = self.books[0].pk
+        self.assertWithinViewBudget(views.AddToCartView, reverse('bookstore:add_to_cart', args=[book_id]), method='post')
+        self.assertWithinViewBudget(views.CartView, reverse('bookstore:cart_view'))
+        self.assertWithinViewBudget(views.CartApiView, reverse('bookstore:api_cart'))
+        self.assertWithinViewBudget(views.SessionView, reverse('bookstore:session'))
+        self.assertWithinViewBudget(views.AsyncCartApiView, reverse('bookstore:async_api_cart'))
+        self.assertWithinViewBudget(
+            views.CartApiAddView, reverse('bookstore:api_cart_add', args=[book_id]), method='post'
+        )
+        self.assertWithinViewBudget(
+            views.CartApiItemView, reverse('bookstore:api_cart_item', args=[book_id]), method='post',
+            data={'quantity': 3},
+        )
+        self.assertWithinViewBudget(views.PaymentView, reverse('bookstore:payment'))
+        self.assertWithinViewBudget(
+            views.PaymentView, reverse('bookstore:payment'), method='post', data={'idempotency_key': 'budget'},
+        )
+        order = Order.objects.get(user=self.user)
+        self.assertWithinViewBudget(views.OrderDetailView, reverse('bookstore:order_detail', args=[order.pk]))
+
+    def test_staff_views_within_budget(self):
+        self.client.force_login(self.staff)
+        book_id = self.books[0].pk
+        self.assertWithinViewBudget(views.AdminBookListView, reverse('bookstore:admin_book_list'))
+        self.assertWithinViewBudget(views.AdminBookExportView, reverse('bookstore:admin_book_export'))
+        self.assertWithinViewBudget(views.MetricsView, reverse('bookstore:metrics'))
+        self.assertWithinViewBudget(views.AdminBookCreateView, reverse('bookstore:admin_book_create'))
+        self.assertWithinViewBudget(
+            views.AdminBookCreateView, reverse('bookstore:admin_book_create'), method='post',
+            data={'title': 'New', 'author': 'Someone', 'price': '4.00'},
+        )
+        update_url = reverse('bookstore:admin_book_update', args=[book_id])
+        self.assertWithinViewBudget(views.AdminBookUpdateView, update_url)
+        self.assertWithinViewBudget(
+            views.AdminBookUpdateView, update_url, method='post',
+            data={'title': 'Renamed', 'author': 'Someone', 'price': '4.00', 'stock': '120', 'stock_original': '100'},
+        )
+        self.assertWithinViewBudget(
+            views.AdminBookBulkActionView, reverse('bookstore:admin_book_bulk'), method='post',
+            data={'action': 'price_percent', 'value': '10', 'book_ids': [b.pk for b in self.books]},
+        )
+        delete_url = reverse('bookstore:admin_book_delete', args=[book_id])
+        self.assertWithinViewBudget(views.AdminBookDeleteView, delete_url)
+        self.assertWithinViewBudget(views.AdminBookDeleteView, delete_url, method='post')
+
+    def test_book_list_queries_do_not_grow_with_catalog(self):
+        self.client.force_login(self.user)
+        url = reverse('bookstore:book_list')
+        small = self.count_queries(url)
+        self.add_books(100)
+        cache.clear()
+        self.assertEqual(self.count_queries(url), small)
+
+    def test_cart_queries_do_not_grow_with_cart_lines(self):
+        self.client.force_login(self.user)
+        url = reverse('bookstore:cart_view')
+        self.fill_cart(1)
+        small = self.count_queries(url)
+        self.fill_cart(40)
+        self.assertEqual(self.count_queries(url), small)
+
+    def test_exceeding_a_budget_reports_the_sql(self):
+        with self.assertRaises(QueryBudgetExceeded) as raised:
+            with query_budget(1, label='two lookups'):
+                list(Book.objects.all())
+                User.objects.count()
+        message = str(raised.exception)
+        self.assertIn('2 queries executed in two lookups, budget is 1', message)
+        self.assertIn('bookstore_book', message)
+        self.assertIn('auth_user', message)
+
+    def test_decorator_form(self):
+        @query_budget(0)
+        def lookup():
+            return Book.objects.count()
+
+        with self.assertRaises(QueryBudgetExceeded):
+            lookup()
+
+    def test_warn_mode_logs_instead_of_failing(self):
+        with self.assertLogs('bookstore.query_budget', 'WARNING') as logs:
+            with query_budget(0, mode='warn'):
+                Book.objects.count()
+        self.assertIn('budget is 0', logs.output[0])
+
+    def test_runtime_mode_enforces_view_budgets(self):
+        self.client.force_login(self.user)
+        url = reverse('bookstore:book_list')
+        with self.settings(QUERY_BUDGET_MODE='raise'):
+            self.assertEqual(self.client.get(url).status_code, 200)
+            views.BookListView.query_budget = 0
+            try:
+                with self.assertRaises(QueryBudgetExceeded):
+                    self.client.get(url)
+            finally:
+                views.BookListView.query_budget = 4
+        with self.settings(QUERY_BUDGET_MODE='warn'), self.assertLogs('bookstore.query_budget', 'WARNING'):
+            views.BookListView.query_budget = 0
+            try:
+                self.assertEqual(self.client.get(url).status_code, 200)
+            finally:
+                views.BookListView.query_budget = 4
+
+
+class CheckoutTests(TestCase):
+    """PaymentView turns the cart into an Order exactly once per idempotency key."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('buyer', password='secret')
+        self.client.force_login(self.user)
+        self.cart = Cart.objects.create(user=self.user)
+        self.url = reverse('bookstore:payment')
+
+    def fill_cart(self, count, price='3.30'):
+        start = Book.objects.count()
+        books = Book.objects.bulk_create(
+            Book(title=f"Book {start + i:04d}", author="Someone", price=price, stock=10) for i in range(count)
+        )
+        CartItem.objects.bulk_create(
+            CartItem(cart=self.cart, book=book, quantity=3, reserved_until=reservation_expiry()) for book in books
+        )
+        return books
+
+    def test_checkout_snapshots_prices_and_empties_cart(self):
+        book = self.fill_cart(1)[0]
+        response = self.client.post(self.url, {'idempotency_key': 'k1'})
+        order = Order.objects.get(user=self.user)
+        self.assertRedirects(response, reverse('bookstore:order_detail', args=[order.pk]))
+        self.assertEqual(order.total, Decimal('9.90'))
+        self.assertFalse(CartItem.objects.filter(cart=self.cart).exists())
+
+        Book.objects.filter(pk=book.pk).update(price='50.00')
+        line = order.lines.get()
+        self.assertEqual((line.title, line.unit_price, line.quantity), (book.title, Decimal('3.30'), 3))
+
+    def test_repeated_submission_returns_the_same_order(self):
+        self.fill_cart(2)
+        first = self.client.post(self.url, {'idempotency_key': 'same'})
+        second = self.client.post(self.url, {'idempotency_key': 'same'})
+        self.assertEqual(Order.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(first['Location'], second['Location'])
+
+    def test_racing_submission_returns_the_committed_order(self):
+        self.fill_cart(1)
+        order, created = place_order(self.user, self.cart, 'race')
+        self.assertTrue(created)
+        # Refill the cart, then pretend the key lookup ran before the first order committed.
+        self.fill_cart(1)
+        with mock.patch('bookstore.orders.Order.objects.filter', side_effect=[
+            Order.objects.none(), Order.objects.filter(pk=order.pk),
+        ]):
+            again, created = place_order(self.user, self.cart, 'race')
+        self.assertEqual((again, created), (order, False))
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertTrue(CartItem.objects.filter(cart=self.cart).exists())
+
+    def test_checkout_queries_do_not_grow_with_cart_lines(self):
+        self.fill_cart(1)
+        with CaptureQueriesContext(connection) as small:
+            place_order(self.user, self.cart, 'small')
+        self.fill_cart(50)
+        with CaptureQueriesContext(connection) as large:
+            place_order(self.user, self.cart, 'large')
+        self.assertEqual(len(small), len(large))
+
+    def test_empty_cart_and_missing_key_are_rejected(self):
+        with self.assertRaises(CheckoutError):
+            place_order(self.user, self.cart, 'empty')
+        self.fill_cart(1)
+        response = self.client.post(self.url, {})
+        self.assertRedirects(response, reverse('bookstore:cart_view'))
+        self.assertFalse(Order.objects.exists())
+
+    def test_get_no_longer_clears_the_cart(self):
+        self.fill_cart(1)
+        self.client.get(self.url)
+        self.assertTrue(CartItem.objects.filter(cart=self.cart).exists())
+
+    def test_orders_are_private(self):
+        self.fill_cart(1)
+        order, _ = place_order(self.user, self.cart, 'mine')
+        self.client.force_login(User.objects.create_user('other'))
+        response = self.client.get(reverse('bookstore:order_detail', args=[order.pk]))
+        self.assertEqual(response.status_code, 404)
+
+
+class InventoryTests(TestCase):
+    """Carts reserve stock with conditional UPDATEs; lapsed reservations go back to stock."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('shopper', password='secret')
+        self.client.force_login(self.user)
+        self.book = Book.objects.create(title="Hot Title", author="Someone", price="9.99", stock=5)
+
+    def stock(self):
+        return Book.objects.values_list('stock', flat=True).get(pk=self.book.pk)
+
+    def add(self, quantity):
+        url = reverse('bookstore:api_cart_add', args=[self.book.pk])
+        return self.client.post(url, {'quantity': quantity})
+
+    def test_adding_to_cart_reserves_copies(self):
+        self.assertEqual(self.add(2).status_code, 200)
+        self.assertEqual(self.stock(), 3)
+        self.assertIsNotNone(CartItem.objects.get().reserved_until)
+
+    def test_adding_more_than_is_left_is_refused(self):
+        self.add(4)
+        response = self.add(2)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.stock(), 1)
+        self.assertEqual(CartItem.objects.get().quantity, 4)
+
+    def test_changing_and_removing_lines_returns_copies(self):
+        self.add(3)
+        url = reverse('bookstore:api_cart_item', args=[self.book.pk])
+        self.client.post(url, {'quantity': 1})
+        self.assertEqual(self.stock(), 4)
+        self.client.delete(url)
+        self.assertEqual(self.stock(), 5)
+
+    def test_sweep_releases_lapsed_reservations(self):
+        self.add(2)
+        other = Book.objects.create(title="Other", author="Someone", price="1.00", stock=1)
+        self.client.post(reverse('bookstore:api_cart_add', args=[other.pk]))
+        CartItem.objects.filter(book=self.book).update(reserved_until=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual(sweep_expired_reservations(), 1)
+        self.assertEqual(self.stock(), 5)
+        self.assertEqual(Book.objects.get(pk=other.pk).stock, 0)
+        self.assertIsNone(CartItem.objects.get(book=self.book).reserved_until)
+        self.assertEqual(sweep_expired_reservations(), 0)
+        self.assertEqual(self.stock(), 5)
+
+    def test_checkout_reserves_lapsed_lines_again(self):
+        self.add(2)
+        CartItem.objects.update(reserved_until=timezone.now() - timedelta(seconds=1))
+        sweep_expired_reservations()
+        Book.objects.filter(pk=self.book.pk).update(stock=1)
+
+        response = self.client.post(reverse('bookstore:payment'), {'idempotency_key': 'short'})
+        self.assertRedirects(response, reverse('bookstore:cart_view'))
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(self.stock(), 1)
+
+        Book.objects.filter(pk=self.book.pk).update(stock=2)
+        self.client.post(reverse('bookstore:payment'), {'idempotency_key': 'enough'})
+        self.assertEqual(Order.objects.get().lines.get().quantity, 2)
+        self.assertEqual(self.stock(), 0)
+
+    def test_staff_edit_applies_only_the_stock_difference(self):
+        self.add(2)
+        staff = User.objects.create_user('staff', password='secret', is_staff=True)
+        self.client.force_login(staff)
+        url = reverse('bookstore:admin_book_update', args=[self.book.pk])
+        form = {'title': "Hot Title", 'author': "Someone", 'price': "9.99"}
+
+        # The form was opened before the shopper reserved two copies.
+        self.client.post(url, {**form, 'stock': 8, 'stock_original': 5})
+        self.assertEqual(self.stock(), 6)
+
+        response = self.client.post(url, {**form, 'stock': 0, 'stock_original': 8})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.stock(), 6)
+
+
+class HotTitleTests(TransactionTestCase):
+    """Concurrent shoppers racing for the last copies of one book never oversell it."""
+
+    shoppers = 8
+    attempts = 25
+    stock = 60
+
+    def test_concurrent_adds_never_oversell(self):
+        book = Book.objects.create(title="Hot Title", author="Someone", price="9.99", stock=self.stock)
+        carts = [Cart.objects.create(session_key=f'hot-{n}') for n in range(self.shoppers)]
+        reserved, refused = Counter(), Counter()
+
+        def add(cart):
+            # The in-memory test database is shared-cache, which reports a locked table
+            # at once instead of waiting out busy_timeout; wait for it here instead.
+            while True:
+                try:
+                    return add_item(cart, book.pk)
+                except OperationalError as exc:
+                    if not is_busy_error(exc):
+                        raise
+                    time.sleep(0.001)
+
+        def shop(cart):
+            try:
+                for _ in range(self.attempts):
+                    try:
+                        add(cart)
+                        reserved[cart.pk] += 1
+                    except OutOfStock:
+                        refused[cart.pk] += 1
+            finally:
+                connections.close_all()
+
+        # Take the write lock when each add starts, as the production profile does, so
+        # competing adds wait before doing any work rather than failing halfway.
+        options = connection.settings_dict.setdefault('OPTIONS', {})
+        with mock.patch.dict(options, {'transaction_mode': 'IMMEDIATE'}):
+            started = time.perf_counter()
+            threads = [threading.Thread(target=shop, args=(cart,)) for cart in carts]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+
+        attempts = self.shoppers * self.attempts
+        self.assertEqual(sum(reserved.values()) + sum(refused.values()), attempts)
+        self.assertEqual(sum(reserved.values()), self.stock)
+        self.assertEqual(Book.objects.get(pk=book.pk).stock, 0)
+        in_carts = CartItem.objects.filter(book=book).aggregate(total=Sum('quantity'))['total']
+        self.assertEqual(in_carts, self.stock)
+        # Each add is a handful of statements; even on a slow machine hundreds complete per second.
+        self.assertGreater(attempts / elapsed, 50)
+
+
+class KeysetPaginationTests(TestCase):
+    """BookListView pages through (title, id) with opaque cursors instead of OFFSET."""
+
+    def setUp(self):
+        cache.clear()
+        # Five books share a title, so the id has to break the tie.
+        titles = ['Same'] * 5 + ['Alpha', 'Omega']
+        self.books = [Book.objects.create(title=title, author="Someone", price="5.00") for title in titles]
+        self.expected = list(Book.objects.order_by('title', 'id').values_list('id', flat=True))
+        self.list_url = reverse('bookstore:book_list')
+
+    def walk(self, direction, cursor):
+        """Follows `direction` cursors two books at a time; returns the ids in order and the final page."""
+        ids = []
+        while True:
+            params = {'size': 2, direction: cursor} if cursor else {'size': 2}
+            page = self.client.get(self.list_url, params).context['page']
+            items = [book.pk for book in page.items]
+            if direction == 'after':
+                ids, cursor = ids + items, page.next_cursor
+            else:
+                ids, cursor = items + ids, page.previous_cursor
+            if cursor is None:
+                return ids, page
+
+    def test_walks_forward_through_ties_without_gaps_or_repeats(self):
+        ids, last_page = self.walk('after', None)
+        self.assertEqual(ids, self.expected)
+        self.assertFalse(last_page.has_next)
+        self.assertTrue(last_page.has_previous)
+
+    def test_walks_backward_from_the_last_page(self):
+        last = Book.objects.get(pk=self.expected[-1])
+        ids, first_page = self.walk('before', encode_cursor(last.title, last.pk))
+        self.assertEqual(ids, self.expected[:-1])
+        self.assertFalse(first_page.has_previous)
+        self.assertTrue(first_page.has_next)
+
+    def test_last_page_links_no_further(self):
+        second_last = Book.objects.get(pk=self.expected[-2])
+        response = self.client.get(self.list_url, {'size': 5, 'after': encode_cursor(second_last.title, second_last.pk)})
+        self.assertEqual([book.pk for book in response.context['books']], self.expected[-1:])
+        self.assertIsNone(response.context['page'].next_cursor)
+        self.assertNotContains(response, '?after=')
+
+    def test_invalid_or_tampered_cursors_fall_back_to_the_first_page(self):
+        tampered = [
+            'not a cursor!',
+            base64.urlsafe_b64encode(b'{"title": "Same"}').decode(),
+            base64.urlsafe_b64encode(b'["Same", "3"]').decode(),
+            base64.urlsafe_b64encode(b'\xff\xfe').decode(),
+        ]
+        for cursor in tampered:
+            with self.subTest(cursor=cursor):
+                self.assertIsNone(decode_cursor(cursor))
+                response = self.client.get(self.list_url, {'size': 2, 'after': cursor})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual([book.pk for book in response.context['books']], self.expected[:2])
+
+    def test_cursor_round_trips(self):
+        self.assertEqual(decode_cursor(encode_cursor('Ünïcode / title', 42)), ('Ünïcode / title', 42))
+
+
+class BookSearchTests(TestCase):
+    """search_books() ranks FTS5 matches with bm25, and triggers keep the index in step."""
+
+    def setUp(self):
+        cache.clear()
+        self.in_title = Book.objects.create(title="Lighthouse Keeper", author="A. Writer", description="Waves.", price="5.00")
+        self.in_author = Book.objects.create(title="Storms", author="Lighthouse Press", description="Wind.", price="5.00")
+        self.in_description = Book.objects.create(title="Harbour", author="B. Writer", description="A lighthouse.", price="5.00")
+
+    def ids(self, query):
+        return [book.pk for book in search_books(query, limit=10)]
+
+    def test_bm25_ranks_title_over_author_over_description(self):
+        self.assertEqual(self.ids('lighthouse'), [self.in_title.pk, self.in_author.pk, self.in_description.pk])
+
+    def test_words_are_prefixes_and_all_must_match(self):
+        self.assertEqual(self.ids('light keep'), [self.in_title.pk])
+        self.assertEqual(self.ids('lighthouse nowhere'), [])
+
+    def test_triggers_follow_inserts_updates_and_deletes(self):
+        book = Book.objects.create(title="Quiet Meadow", author="C. Writer", price="5.00")
+        self.assertEqual(self.ids('meadow'), [book.pk])
+        book.title = "Loud Meadow"
+        book.save()
+        self.assertEqual(self.ids('quiet'), [])
+        self.assertEqual(self.ids('loud'), [book.pk])
+        # Queryset updates and deletes bypass model signals, but not the triggers.
+        Book.objects.filter(pk=book.pk).update(description="Now with orchards.")
+        self.assertEqual(self.ids('orchards'), [book.pk])
+        Book.objects.filter(pk=book.pk).delete()
+        self.assertEqual(self.ids('meadow'), [])
+
+    def test_fts_syntax_in_queries_is_treated_as_text(self):
+        self.assertEqual(build_match_expression('title:light* OR "keeper" NEAR('), '"title"* "light"* "OR"* "keeper"* "NEAR"*')
+        self.assertEqual(build_match_expression('  ()"*  '), '')
+        for query in ('title:lighthouse', 'lighthouse AND', '"lighthouse', 'NEAR(lighthouse', '-lighthouse'):
+            with self.subTest(query=query):
+                search_books(query, limit=10)
+        self.assertEqual(self.ids('  ()"*  '), [])
+
+    def test_search_view_pages_without_counting(self):
+        response = self.client.get(reverse('bookstore:book_search'), {'q': 'lighthouse', 'size': 2})
+        self.assertEqual([book.pk for book in response.context['books']], [self.in_title.pk, self.in_author.pk])
+        self.assertTrue(response.context['has_next'])
+        response = self.client.get(reverse('bookstore:book_search'), {'q': 'lighthouse', 'size': 2, 'page': 2})
+        self.assertEqual([book.pk for book in response.context['books']], [self.in_description.pk])
+        self.assertFalse(response.context['has_next'])
+
+
+class ImportBooksTests(TestCase):
+    """import_books validates, merges and upserts rows from CSV and JSON Lines files."""
+
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+
+    def run_import(self, name, content, *args):
+        path = self.directory / name
+        path.write_text(content, encoding='utf-8')
+        out = io.StringIO()
+        call_command('import_books', str(path), *args, stdout=out)
+        return out.getvalue()
+
+    def test_csv_counts_every_row_read_and_invalidates_once(self):
+        Book.objects.create(title="Dune", author="Frank Herbert", price="9.99", stock=3)
+        content = (
+            "title,author,description,price,stock\n"
+            "Dune,Frank Herbert,Spice.,12.50,40\n"
+            "Persuasion,Jane Austen,,7.00,\n"
+            "Emma,Jane Austen,,5.00,2\n"
+            "Emma,Jane Austen,Matchmaking.,6.00,2\n"
+            "Untitled,,,abc,\n"
+        )
+        with mock.patch('bookstore.typeahead.invalidate') as invalidate:
+            output = self.run_import('feed.csv', content, '--batch-size', '2')
+        self.assertIn("5 rows", output)
+        self.assertIn("2 created, 1 updated, 1 rejected. 1 repeated row was merged", output)
+        invalidate.assert_called_once_with()
+        dune = Book.objects.get(title="Dune")
+        self.assertEqual(dune.price, Decimal('12.50'))
+        # Imports never overwrite the stock of existing books.
+        self.assertEqual(dune.stock, 3)
+        emma = Book.objects.get(title="Emma")
+        self.assertEqual((emma.price, emma.description, emma.stock), (Decimal('6.00'), "Matchmaking.", 2))
+
+    def test_jsonl_rejects_are_written_with_their_line_numbers(self):
+        rejects = self.directory / 'rejects.jsonl'
+        content = (
+            '{"title": "Emma", "author": "Jane Austen", "price": "5.00"}\n'
+            '\n'
+            'not json\n'
+            '["a", "list"]\n'
+            '{"title": "", "author": "Nobody", "price": "-1"}\n'
+        )
+        output = self.run_import('feed.jsonl', content, '--rejects', str(rejects))
+        self.assertIn("1 created, 0 updated, 3 rejected.", output)
+        lines = [json.loads(line) for line in rejects.read_text().splitlines()]
+        self.assertEqual([line['line'] for line in lines], [3, 4, 5])
+        self.assertIn('title', lines[2]['errors'])
+        self.assertIn('price', lines[2]['errors'])
+        self.assertTrue(Book.objects.filter(title="Emma").exists())
+
+    def test_match_id_updates_by_id_and_creates_the_rest(self):
+        book = Book.objects.create(title="Old Title", author="Someone", price="1.00")
+        content = (
+            "id,title,author,price\n"
+            f"{book.pk},New Title,Someone,2.00\n"
+            ",Fresh,Someone,3.00\n"
+            "x,Bad Id,Someone,3.00\n"
+        )
+        output = self.run_import('feed.csv', content, '--match', 'id')
+        self.assertIn("1 created, 1 updated, 1 rejected.", output)
+        book.refresh_from_db()
+        self.assertEqual((book.title, book.price), ("New Title", Decimal('2.00')))
+        self.assertEqual(book.content_hash, book.compute_content_hash())
+        self.assertEqual(Book.objects.count(), 2)
+
+    def test_dry_run_writes_nothing(self):
+        content = "title,author,price\nEmma,Jane Austen,5.00\nBad,,x\n"
+        with mock.patch('bookstore.typeahead.invalidate') as invalidate:
+            output = self.run_import('feed.csv', content, '--dry-run')
+        self.assertIn("1 valid, 1 rejected (dry run, nothing written).", output)
+        self.assertFalse(Book.objects.exists())
+        invalidate.assert_not_called()
+
+
+class BulkRepriceTests(TestCase):
+    """Bulk price changes round like the database, stay in range and are staff only."""
+
+    def setUp(self):
+        cache.clear()
+        self.cheap = Book.objects.create(title="Cheap", author="Someone", price="0.25")
+        self.middle = Book.objects.create(title="Middle", author="Someone", price="10.05")
+        self.books = Book.objects.filter(pk__in=[self.cheap.pk, self.middle.pk])
+        self.bulk_url = reverse('bookstore:admin_book_bulk')
+
+    def prices(self):
+        return list(Book.objects.order_by('title').values_list('price', flat=True))
+
+    def test_half_cents_round_the_same_in_python_and_sql(self):
+        # Halving gives 0.125 and 5.025, which half-even rounding would take down to 0.12 and 5.02.
+        expected = [bulk._round_price(price / 2) for price in self.prices()]
+        self.assertEqual(expected, [Decimal('0.13'), Decimal('5.03')])
+        apply_bulk_action(self.books, 'price_percent', '-50')
+        self.assertEqual(self.prices(), expected)
+
+    def test_rejects_overflow_and_negative_prices_without_writing(self):
+        Book.objects.filter(pk=self.middle.pk).update(price='9000.00')
+        for action, value, message in (
+            ('price_percent', '20', "above the 10000 limit"),
+            ('price_amount', '-1', "negative"),
+            ('price_percent', '-150', "negative"),
+            ('price_percent', 'NaN', "Invalid percentage"),
+        ):
+            with self.subTest(action=action, value=value):
+                with self.assertRaisesMessage(BulkActionError, message):
+                    apply_bulk_action(self.books, action, value)
+                self.assertEqual(self.prices(), [Decimal('0.25'), Decimal('9000.00')])
+
+    def test_only_staff_can_reprice(self):
+        data = {'action': 'price_amount', 'value': '1', 'book_ids': [self.cheap.pk, self.middle.pk]}
+        response = self.client.post(self.bulk_url, data)
+        self.assertRedirects(response, f"{reverse('bookstore:login')}?next={self.bulk_url}", fetch_redirect_response=False)
+        self.client.force_login(User.objects.create_user('reader', password='secret'))
+        self.client.post(self.bulk_url, data)
+        self.assertEqual(self.prices(), [Decimal('0.25'), Decimal('10.05')])
+
+        self.client.force_login(User.objects.create_user('staff', password='secret', is_staff=True))
+        response = self.client.post(self.bulk_url, {**data, 'value': '-5'}, follow=True)
+        self.assertContains(response, "Nothing was changed")
+        self.assertEqual(self.prices(), [Decimal('0.25'), Decimal('10.05')])
+        self.client.post(self.bulk_url, data)
+        self.assertEqual(self.prices(), [Decimal('1.25'), Decimal('11.05')])
+
+    def test_filtered_scope_without_a_filter_needs_the_catalog_count(self):
+        self.client.force_login(User.objects.create_user('staff', password='secret', is_staff=True))
+        data = {'action': 'price_amount', 'value': '1', 'scope': 'filtered'}
+        for confirm in ({}, {'confirm_count': '1'}):
+            with self.subTest(confirm=confirm):
+                response = self.client.post(self.bulk_url, {**data, **confirm}, follow=True)
+                self.assertContains(response, "Nothing was changed")
+                self.assertEqual(self.prices(), [Decimal('0.25'), Decimal('10.05')])
+
+        response = self.client.get(reverse('bookstore:admin_book_list'))
+        self.assertContains(response, '<input type="hidden" name="confirm_count" value="2">', html=True)
+        self.client.post(self.bulk_url, {**data, 'confirm_count': '2'})
+        self.assertEqual(self.prices(), [Decimal('1.25'), Decimal('11.05')])
+        # A filter narrows the scope, so no count is needed.
+        self.client.post(self.bulk_url, {**data, 'max_price': '5'})
+        self.assertEqual(self.prices(), [Decimal('2.25'), Decimal('11.05')])
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'], REPLICA_STICKY_SECONDS=5)
+class ReplicaRoutingTests(TestCase):
+    """Catalog reads in opted-in views go to a replica until the visitor writes."""
+
+    class CatalogView(ReplicaReadMixin, View):
+        def get(self, request):
+            return JsonResponse(routes())
+
+        def post(self, request):
+            return JsonResponse(routes(write=True))
+
+    class OtherView(View):
+        def get(self, request):
+            return JsonResponse(routes())
+
+    def serve(self, view, method='get', cookies=None):
+        request = getattr(RequestFactory(), method)('/')
+        request.COOKIES.update(cookies or {})
+        return ReplicaRoutingMiddleware(view.as_view())(request)
+
+    def test_catalog_reads_go_to_a_replica_and_carts_stay_on_the_primary(self):
+        response = self.serve(self.CatalogView)
+        self.assertEqual(
+            json.loads(response.content),
+            {'Book': 'replica1', 'BookFacet': 'replica1', 'Cart': 'default', 'CartItem': 'default'},
+        )
+        self.assertEqual(json.loads(self.serve(self.OtherView).content)['Book'], 'default')
+        self.assertNotIn(STICKY_COOKIE, response.cookies)
+
+    def test_writing_pins_the_visitor_for_the_sticky_window(self):
+        response = self.serve(self.CatalogView, 'post')
+        # Unsafe requests never read from a replica, before or after they write.
+        self.assertEqual(json.loads(response.content)['Book'], 'default')
+        self.assertEqual(json.loads(response.content)['after_write'], 'default')
+        self.assertEqual(response.cookies[STICKY_COOKIE]['max-age'], 5)
+        pinned = self.serve(self.CatalogView, cookies={STICKY_COOKIE: '1'})
+        self.assertEqual(json.loads(pinned.content)['Book'], 'default')
+
+    def test_everything_uses_the_primary_without_replicas(self):
+        with self.settings(DATABASE_REPLICAS=[]):
+            response = self.serve(self.CatalogView, 'post')
+            self.assertEqual(set(json.loads(response.content).values()), {'default'})
+            self.assertNotIn(STICKY_COOKIE, response.cookies)
+        self.assertFalse(PrimaryReplicaRouter().allow_migrate('replica1', 'bookstore'))
+        self.assertIsNone(PrimaryReplicaRouter().allow_migrate('default', 'bookstore'))
+
+    def test_cart_page_does_not_opt_in(self):
+        self.assertFalse(issubclass(views.CartView, ReplicaReadMixin))
+        self.assertTrue(issubclass(views.BookListView, ReplicaReadMixin))
+
+
+def routes(write=False):
+    """Where the router sends reads of each model, and with `write`, reads of Book after writing one."""
+    router = PrimaryReplicaRouter()
+    decisions = {model.__name__: router.db_for_read(model) for model in (Book, BookFacet, Cart, CartItem)}
+    if write:
+        router.db_for_write(Book)
+        decisions['after_write'] = router.db_for_read(Book)
+    return decisions
+
+
+class BenchCommandSmokeTests(SimpleTestCase):
+    """Every bench command still runs end to end, at sizes that take seconds."""
+
+    # Each runs in its own process: the commands set up their own test databases.
+    commands = {
+        'bench_async': ['--size', '20', '--concurrency', '2', '--requests', '4'],
+        'bench_checkout': ['--shoppers', '2', '--lines', '2', '--threads', '2'],
+        'bench_concurrency': ['--size', '20', '--readers', '1', '--writers', '1', '--duration', '0.2'],
+        'bench_login_flood': [
+            '--size', '20', '--threads', '2', '--readers', '1', '--attackers', '1', '--addresses', '2',
+            '--usernames', '1', '--duration', '0.3', '--iterations', '1000',
+        ],
+        'bench_sessions': ['--iterations', '1'],
+        'bench_startup': ['--size', '20', '--repeat', '1'],
+        'bench_typeahead': ['--sizes', '50', '--lookups', '10', '--updates', '5'],
+        'bench_views': ['--sizes', '20', '--cart-lines', '2', '--iterations', '1'],
+    }
+
+    def test_every_bench_command_is_covered(self):
+        found = {path.stem for path in (Path(__file__).parent / 'management' / 'commands').glob('bench_*.py')}
+        self.assertEqual(found, set(self.commands))
+
+    def test_bench_commands_run(self):
+        for name, args in self.commands.items():
+            with self.subTest(command=name):
+                try:
+                    result = subprocess.run(
+                        [sys.executable, 'manage.py', name, *args], cwd=settings.BASE_DIR,
+                        capture_output=True, text=True, timeout=300,
+                    )
+                except subprocess.TimeoutExpired:
+                    self.fail(f"{name} did not finish within 300 seconds.")
+                self.assertEqual(result.returncode, 0, result.stderr[-2000:])
+
+
+class TypeaheadIndexTests(TestCase):
+    """The prefix index stays sorted through edits and catches up with other processes' changes."""
+
+    def setUp(self):
+        cache.clear()
+        typeahead._index = None
+        self.addCleanup(setattr, typeahead, '_index', None)
+
+    def assertSorted(self, index):
+        entries = list(zip(index.title_keys, index.title_ids))
+        self.assertEqual(entries, sorted(entries))
+        self.assertEqual(index.author_keys, sorted(index.authors))
+
+    def test_duplicate_title_keys_are_ordered_by_id(self):
+        index = typeahead.PrefixIndex([
+            (3, "Dune", "Frank Herbert"), (1, "dune", "A. Parody"), (2, "DÜNE", "Frank Herbert"),
+        ])
+        self.assertEqual(list(index.title_ids), [1, 2, 3])
+        index.add(0, "Dune", "Someone")
+        index.add(5, "Dune", "Someone")
+        index.add(2, "Dune", "Frank Herbert")  # already indexed
+        self.assertEqual(list(index.title_ids), [0, 1, 2, 3, 5])
+        index.remove(2, "Dune", "Frank Herbert")
+        index.remove(4, "Dune", "Frank Herbert")  # never indexed
+        self.assertEqual(list(index.title_ids), [0, 1, 3, 5])
+        self.assertEqual(index.suggest('dune', title_limit=3)[0], [(0, "Dune"), (1, "dune"), (3, "Dune")])
+        self.assertEqual(index.authors['frank herbert'][1], 1)
+        self.assertSorted(index)
+
+    def test_authors_leave_when_their_last_book_does(self):
+        index = typeahead.PrefixIndex([
+            (1, "Nana", "Émile Zola"), (2, "Germinal", "Émile Zola"), (3, "Emma", "Jane Austen"),
+        ])
+        self.assertEqual(index.suggest('emi')[1], ["Émile Zola"])
+        index.remove(1, "Nana", "Émile Zola")
+        self.assertEqual(index.suggest('emi')[1], ["Émile Zola"])
+        index.remove(2, "Germinal", "Émile Zola")
+        self.assertEqual(index.suggest('emi')[1], [])
+        self.assertNotIn('emile zola', index.authors)
+        self.assertEqual(index.author_keys, ['jane austen'])
+        index.add(4, "Thérèse Raquin", "Émile Zola")
+        self.assertEqual(index.suggest('e'), ([(3, "Emma")], ["Émile Zola"]))
+        self.assertSorted(index)
+
+    def test_rename_moves_the_title_to_its_new_position(self):
+        index = typeahead.PrefixIndex([(1, "Alpha", "A"), (2, "Mango", "B"), (3, "Zebra", "A")])
+        index.apply((1, ("Alpha", "A"), ("Zulu", "C")))
+        self.assertEqual(index.title_keys, ['mango', 'zebra', 'zulu'])
+        self.assertEqual(list(index.title_ids), [2, 3, 1])
+        self.assertEqual(index.suggest('al'), ([], []))
+        self.assertEqual(index.suggest('z'), ([(3, "Zebra"), (1, "Zulu")], []))
+        self.assertEqual(sorted(index.authors), ['a', 'b', 'c'])
+        self.assertSorted(index)
+
+    def publish(self, book_id, old, new):
+        with self.captureOnCommitCallbacks(execute=True):
+            typeahead.book_changed(book_id, old, new)
+
+    def test_stale_index_replays_published_changes_without_queries(self):
+        dune = Book.objects.create(title="Dune", author="Frank Herbert", price="9.99")
+        emma = Book.objects.create(title="Emma", author="Jane Austen", price="5.00")
+        self.assertEqual(typeahead.suggest('d')[0], [(dune.pk, "Dune")])
+        # Changes published by other processes: a rename, a new book and a deletion.
+        self.publish(dune.pk, ("Dune", "Frank Herbert"), ("Dune Messiah", "Frank Herbert"))
+        self.publish(99, None, ("Dracula", "Bram Stoker"))
+        self.publish(emma.pk, ("Emma", "Jane Austen"), None)
+        with self.assertNumQueries(0):
+            titles, authors = typeahead.suggest('d')
+            self.assertEqual(typeahead.suggest('emma'), ([], []))
+        self.assertEqual(titles, [(99, "Dracula"), (dune.pk, "Dune Messiah")])
+        self.assertEqual(typeahead._index.version, typeahead.current_version())
+
+    def test_rebuilds_when_a_change_is_missing(self):
+        Book.objects.create(title="Dune", author="Frank Herbert", price="9.99")
+        typeahead.preload()
+        self.publish(98, None, ("Dracula", "Bram Stoker"))
+        self.publish(99, None, ("Dubliners", "James Joyce"))
+        cache.delete(typeahead.CHANGE_KEY.format(version=typeahead.current_version() - 1))
+        with self.assertNumQueries(1):
+            titles, _ = typeahead.suggest('d')
+        # Rebuilt from the database, where neither published book exists.
+        self.assertEqual([title for _, title in titles], ["Dune"])
+
+    def test_rebuilds_after_invalidate(self):
+        typeahead.preload()
+        stale = typeahead._index
+        Book.objects.create(title="Dune", author="Frank Herbert", price="9.99")
+        with self.captureOnCommitCallbacks(execute=True):
+            typeahead.invalidate()
+        self.assertGreater(typeahead.current_version(), stale.version + typeahead.MAX_REPLAY)
+        with self.assertNumQueries(1):
+            self.assertEqual([title for _, title in typeahead.suggest('du')[0]], ["Dune"])
+        self.assertIsNot(typeahead._index, stale)
+
+
+
+class TypeaheadPublishRaceTests(TransactionTestCase):
+    """Publishers in different processes never take the same version on the file cache."""
+
+    publishers = 2
+    changes = 20
+
+    def test_racing_publishers_get_distinct_versions(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(
+            CACHES={**settings.CACHES, 'default': {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory,
+            }},
+            # The shared-cache test database reports a lock at once instead of waiting.
+            SQLITE_BUSY_RETRIES=100, SQLITE_BUSY_RETRY_DELAY=0.001,
+        ):
+            typeahead.preload()
+            self.addCleanup(setattr, typeahead, '_index', None)
+            barrier = threading.Barrier(self.publishers)
+            published = {}
+
+            def publisher(number):
+                try:
+                    barrier.wait()
+                    for n in range(self.changes):
+                        book_id = number * 1000 + n
+                        published[typeahead.publish(1, (book_id, None, (f"Racer {book_id}", "Someone")))] = book_id
+                finally:
+                    connections.close_all()
+
+            threads = [threading.Thread(target=publisher, args=(number,)) for number in range(self.publishers)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            total = self.publishers * self.changes
+            self.assertEqual(len(published), total)
+            self.assertEqual(max(published) - min(published), total - 1)
+            self.assertEqual(typeahead.current_version(), max(published))
+            for version, book_id in published.items():
+                self.assertEqual(typeahead.catalog_cache().get(typeahead.CHANGE_KEY.format(version=version))[0], book_id)
+            # Another process's index replays every change rather than missing one.
+            titles, _ = typeahead.suggest('racer', title_limit=total)
+            self.assertEqual(sorted(book_id for book_id, _ in titles), sorted(published.values()))
+
+
+class FacetCountTests(TestCase):
+    """BookFacet counts match a fresh GROUP BY over Book after every kind of catalog write."""
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(User.objects.create_user('staff', password='secret', is_staff=True))
+        self.create_url = reverse('bookstore:admin_book_create')
+        self.bulk_url = reverse('bookstore:admin_book_bulk')
+
+    def assertFacetsMatchBooks(self):
+        expected = Counter()
+        for key, _, _, _ in facets.PRICE_BANDS:
+            rows = Book.objects.filter(facets.band_filter(key)).values('author').annotate(n=Count('id'))
+            for row in rows.values_list('author', 'n'):
+                author, number = row
+                for facet in ((author, key), (author, facets.ANY), (facets.ANY, key), (facets.ANY, facets.ANY)):
+                    expected[facet] += number
+        stored = {(f.author, f.price_band): f.book_count for f in BookFacet.objects.all()}
+        self.assertEqual(stored, dict(expected))
+        self.assertEqual(set(BookFacet.objects.values_list('author', 'initial')) - {('', '')},
+                         {(author, facets.author_initial(author)) for author, _ in expected if author})
+
+    def create(self, title, author, price):
+        self.client.post(self.create_url, {'title': title, 'author': author, 'price': price, 'stock': '1'})
+        return Book.objects.get(title=title)
+
+    def test_every_write_path_keeps_counts_exact(self):
+        dune = self.create("Dune", "Frank Herbert", "9.99")
+        emma = self.create("Emma", "Jane Austen", "24.00")
+        self.create("Persuasion", "Jane Austen", "30.00")
+        self.assertFacetsMatchBooks()
+
+        # An edit that moves a book to another author and price band.
+        self.client.post(reverse('bookstore:admin_book_update', args=[dune.pk]), {
+            'title': "Dune", 'author': "Brian Herbert", 'price': "55.00", 'stock': '1', 'stock_original': '1',
+        })
+        self.assertEqual(Book.objects.get(pk=dune.pk).author, "Brian Herbert")
+        self.assertFacetsMatchBooks()
+        self.client.post(reverse('bookstore:admin_book_delete', args=[emma.pk]))
+        self.assertFacetsMatchBooks()
+
+        sense = self.create("Sense and Sensibility", "Jane Austen", "8.00")
+        ids = list(Book.objects.values_list('pk', flat=True))
+        for action, value in (('price_percent', '50'), ('price_amount', '-4'), ('set_author', 'Anonymous')):
+            with self.subTest(action=action):
+                self.client.post(self.bulk_url, {'action': action, 'value': value, 'book_ids': ids})
+                self.assertFacetsMatchBooks()
+        self.assertEqual(set(Book.objects.values_list('author', flat=True)), {"Anonymous"})
+        self.client.post(self.bulk_url, {'action': 'delete', 'book_ids': [sense.pk]})
+        self.assertFacetsMatchBooks()
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / 'feed.csv'
+            path.write_text(
+                "title,author,price\n"
+                "Dune,Anonymous,120.00\n"     # moves an existing book to another band
+                "Dune,Frank Herbert,9.99\n"   # a new (title, author) pair
+                "Zazie,Raymond Queneau,12\n",
+                encoding='utf-8',
+            )
+            call_command('import_books', str(path), stdout=io.StringIO())
+        self.assertFacetsMatchBooks()
+        self.assertEqual(Book.objects.get(pk=dune.pk).price, Decimal('120.00'))
+        self.assertEqual(Book.objects.count(), 4)
+
+
+class RecommendationPageTests(TestCase):
+    """Book pages that recommend a book follow its staff edits and deletion."""
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(User.objects.create_user('staff', password='secret', is_staff=True))
+        self.dune = Book.objects.create(title="Dune", author="Frank Herbert", price="9.99", stock=5)
+        self.emma = Book.objects.create(title="Emma", author="Jane Austen", price="5.00", stock=5)
+        BookRecommendation.objects.create(book=self.dune, recommended=self.emma, score=3, rank=1)
+        self.url = reverse('bookstore:book_detail', args=[self.dune.pk])
+        self.emma_url = reverse('bookstore:book_detail', args=[self.emma.pk])
+
+    def test_edit_refreshes_recommending_page_and_etag(self):
+        response = self.client.get(self.url)
+        self.assertContains(response, "Emma")
+        etag = response['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('bookstore:admin_book_update', args=[self.emma.pk]), {
+                'title': "Emma (Annotated)", 'author': "Jane Austen", 'price': "7.25",
+                'stock': '5', 'stock_original': '5',
+            })
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertContains(response, "Emma (Annotated)")
+        self.assertContains(response, "7.25")
+
+    def test_delete_drops_link_from_recommending_page(self):
+        response = self.client.get(self.url)
+        self.assertContains(response, self.emma_url)
+        etag = response['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('bookstore:admin_book_delete', args=[self.emma.pk]))
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, self.emma_url)
+
+    def test_unrelated_pages_keep_their_etag(self):
+        other = Book.objects.create(title="Zazie", author="Raymond Queneau", price="12.00", stock=5)
+        other_url = reverse('bookstore:book_detail', args=[other.pk])
+        etag = self.client.get(other_url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('bookstore:admin_book_delete', args=[self.emma.pk]))
+        self.assertEqual(self.client.get(other_url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_many_recommenders_bump_every_page(self):
+        books = Book.objects.bulk_create(
+            Book(title=f"Book {n}", author="Anon", price="1.00") for n in range(recommendations.MAX_BUMPED_RECOMMENDERS)
+        )
+        BookRecommendation.objects.bulk_create(
+            BookRecommendation(book=book, recommended=self.emma, score=1, rank=1) for book in books
+        )
+        all_books = get_all_books_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            recommendations.bump_book_pages(self.emma.pk)
+        self.assertNotEqual(get_all_books_version(), all_books)
+
+
+@override_settings(PASSWORD_HASH_CONCURRENCY=1, PASSWORD_HASH_WAIT=None, PASSWORD_HASH_ITERATIONS=1_000_000)
+class OverlappingLoginTests(TransactionTestCase):
+    """Legitimate logins that overlap wait their turn for the hashing slot instead of getting a 503."""
+
+    def test_overlapping_valid_logins_both_succeed(self):
+        caches[settings.AUTH_THROTTLE_CACHE_ALIAS].clear()
+        usernames = ['first', 'second']
+        for username in usernames:
+            User.objects.create_user(username, password='correct horse')
+        login_url = reverse('bookstore:login')
+        barrier = threading.Barrier(len(usernames))
+        statuses = {}
+
+        def log_in(username):
+            try:
+                barrier.wait()
+                response = Client().post(login_url, {'username': username, 'password': 'correct horse'})
+                statuses[username] = response.status_code
+            finally:
+                connections.close_all()
+
+        with mock.patch.object(throttle, '_hash_seconds', None):
+            # The first login measures how long a hash holds the slot.
+            response = Client().post(login_url, {'username': 'first', 'password': 'correct horse'})
+            self.assertEqual(response.status_code, 302)
+            threads = [threading.Thread(target=log_in, args=(username,)) for username in usernames]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(statuses, {'first': 302, 'second': 302})
+
+
+class ServerProcessSettingsTests(SimpleTestCase):
+    """Several server processes are refused per-process caches for the state they must share."""
+
+    def load_settings(self, **env):
+        # A fresh interpreter, since the settings module is read once per process.
+        environ = {
+            key: value for key, value in os.environ.items()
+            if not key.startswith('BOOKSTORE_') and key != 'DJANGO_SETTINGS_MODULE'
+        }
+        environ.update(env, DJANGO_SETTINGS_MODULE='bookstore_project.settings')
+        return subprocess.run(
+            [sys.executable, '-c', 'from django.conf import settings; print(settings.SESSION_ENGINE)'],
+            cwd=settings.BASE_DIR, env=environ, capture_output=True, text=True, timeout=60,
+        )
+
+    def test_cached_sessions_on_locmem_are_refused(self):
+        for profile in ('cached_db', 'cache'):
+            with self.subTest(profile=profile):
+                result = self.load_settings(
+                    BOOKSTORE_SERVER_PROCESSES='3', BOOKSTORE_CACHE_BACKEND='locmem', BOOKSTORE_SESSION_PROFILE=profile,
+                )
+                self.assertNotEqual(result.returncode, 0)
+                self.assertIn('ImproperlyConfigured', result.stderr)
+
+    def test_database_sessions_on_locmem_warn(self):
+        result = self.load_settings(
+            BOOKSTORE_SERVER_PROCESSES='3', BOOKSTORE_CACHE_BACKEND='locmem', BOOKSTORE_SESSION_PROFILE='db',
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn('RuntimeWarning', result.stderr)
+
+    def test_shared_cache_is_accepted(self):
+        with tempfile.TemporaryDirectory() as directory:
+            result = self.load_settings(
+                BOOKSTORE_SERVER_PROCESSES='3', BOOKSTORE_CACHE_BACKEND='file', BOOKSTORE_CACHE_LOCATION=directory,
+                BOOKSTORE_SESSION_PROFILE='cached_db',
+            )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.strip(), 'bookstore.sessions.cached_db')
+        self.assertNotIn('Warning', result.stderr)
+
+
+class SkipUnchangedSaveTests(TestCase):
+    """The bookstore session engines write a session only when its data changed."""
+
+    engines = (session_cache_engine, session_cached_db_engine, session_db_engine)
+
+    def setUp(self):
+        caches[settings.SESSION_CACHE_ALIAS].clear()
+
+    def saved_session(self, engine):
+        session = engine.SessionStore()
+        session['cart'] = 3
+        session.save()
+        return engine.SessionStore(session.session_key)
+
+    def count_writes(self, engine):
+        base = engine.BaseSessionStore
+        return mock.patch.object(base, 'save', autospec=True, side_effect=base.save)
+
+    def test_unchanged_session_is_not_written(self):
+        for engine in self.engines:
+            with self.subTest(engine=engine.__name__):
+                session = self.saved_session(engine)
+                self.assertEqual(session['cart'], 3)
+                session['cart'] = 3  # Marks it modified, with the same data.
+                with self.count_writes(engine) as save:
+                    session.save()
+                save.assert_not_called()
+
+    def test_modified_session_is_written(self):
+        for engine in self.engines:
+            with self.subTest(engine=engine.__name__):
+                session = self.saved_session(engine)
+                session['cart'] = 4
+                with self.count_writes(engine) as save:
+                    session.save()
+                save.assert_called_once()
+                self.assertEqual(engine.SessionStore(session.session_key)['cart'], 4)
+                # Saved state now matches, so saving again writes nothing.
+                with self.count_writes(engine) as save:
+                    session.save()
+                save.assert_not_called()
+
+    def test_new_session_is_written(self):
+        for engine in self.engines:
+            with self.subTest(engine=engine.__name__):
+                session = engine.SessionStore()
+                with self.count_writes(engine) as save:
+                    session.create()
+                self.assertTrue(save.called)
+                self.assertTrue(session.exists(session.session_key))
+
+
+class CartMergeTests(QueryBudgetTestMixin, TestCase):
+    """Logging in or registering merges the anonymous cart in a fixed number of queries."""
+
+    def setUp(self):
+        cache.clear()
+        caches[settings.AUTH_THROTTLE_CACHE_ALIAS].clear()
+        self.user = User.objects.create_user('reader', password='secret')
+        self.login_url = reverse('bookstore:login')
+
+    def books(self, count, stock=10):
+        return [Book.objects.create(title=f"Book {n}", author="Someone", price="5.00", stock=stock) for n in range(count)]
+
+    def shop(self, client, quantities):
+        """Adds {book: quantity} to the client's anonymous cart; returns its session key."""
+        for book, quantity in quantities.items():
+            for _ in range(quantity):
+                client.post(reverse('bookstore:add_to_cart', args=[book.pk]))
+        return client.session.session_key
+
+    def stock(self, book):
+        return Book.objects.get(pk=book.pk).stock
+
+    def lines(self, user):
+        return dict(CartItem.objects.filter(cart__user=user).values_list('book_id', 'quantity'))
+
+    def test_login_merges_quantities_and_reservations(self):
+        kept, lapsed, sold_out = self.books(3)
+        user_cart = Cart.objects.create(user=self.user)
+        add_item(user_cart, kept.pk, 2)
+        add_item(user_cart, lapsed.pk, 1)
+        sweep_expired_reservations(now=reservation_expiry() + timedelta(seconds=1))
+        add_item(user_cart, kept.pk, 0)  # renews only the first line
+        self.assertEqual([self.stock(kept), self.stock(lapsed)], [8, 10])
+
+        self.shop(self.client, {kept: 1, lapsed: 2, sold_out: 1})
+        # The anonymous line for sold_out lapses and the last copies go to somebody else.
+        CartItem.objects.filter(cart__session_key__isnull=False, book=sold_out).update(reserved_until=None)
+        Book.objects.filter(pk=sold_out.pk).update(stock=0)
+
+        response = self.client.post(self.login_url, {'username': 'reader', 'password': 'secret'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.lines(self.user), {kept.pk: 3, lapsed.pk: 3})
+        self.assertFalse(CartItem.objects.filter(cart=user_cart, reserved_until__isnull=True).exists())
+        # Every copy in the user's cart is held once; the anonymous cart is gone.
+        self.assertEqual([self.stock(kept), self.stock(lapsed), self.stock(sold_out)], [7, 7, 0])
+        self.assertEqual(Cart.objects.count(), 1)
+
+    def test_register_keeps_the_anonymous_cart(self):
+        first, second = self.books(2)
+        self.shop(self.client, {first: 2, second: 1})
+        response = self.client.post(reverse('bookstore:register'), {
+            'username': 'newcomer', 'email': 'new@example.com',
+            'password': 'a long enough password', 'password_confirm': 'a long enough password',
+        })
+        self.assertEqual(response.status_code, 302)
+        newcomer = User.objects.get(username='newcomer')
+        self.assertEqual(self.lines(newcomer), {first.pk: 2, second.pk: 1})
+        self.assertEqual([self.stock(first), self.stock(second)], [8, 9])
+        self.assertFalse(Cart.objects.filter(user__isnull=True).exists())
+
+    def test_merge_queries_do_not_grow_with_the_cart(self):
+        counts = []
+        for size in (2, 12):
+            with self.subTest(size=size):
+                User.objects.filter(username='reader').delete()
+                self.user = User.objects.create_user('reader', password='secret')
+                books = self.books(size)
+                user_cart = Cart.objects.create(user=self.user)
+                add_item(user_cart, books[0].pk)
+                client = Client()
+                session_key = self.shop(client, {book: 1 for book in books})
+                with CaptureQueriesContext(connection) as queries:
+                    merge_anonymous_cart(session_key, self.user)
+                counts.append(len(queries))
+                self.assertEqual(self.lines(self.user), {book.pk: 2 if book == books[0] else 1 for book in books})
+                self.assertEqual({self.stock(book) for book in books[1:]}, {9})
+                self.assertEqual(self.stock(books[0]), 8)
+        self.assertEqual(counts[0], counts[1])
+
+    def test_login_with_a_long_cart_stays_within_budget(self):
+        books = self.books(15)
+        add_item(Cart.objects.create(user=self.user), books[0].pk)
+        self.shop(self.client, {book: 1 for book in books})
+        self.assertWithinViewBudget(
+            views.CustomLoginView, self.login_url, method='post', data={'username': 'reader', 'password': 'secret'},
+        )
+        self.assertEqual(sum(self.lines(self.user).values()), 16)
+
+    def test_changed_stock_falls_back_to_one_line_at_a_time(self):
+        first, second = self.books(2)
+        add_item(Cart.objects.create(user=self.user), first.pk)
+        session_key = self.shop(self.client, {first: 1, second: 2})
+        with mock.patch('bookstore.cart._merge_lines', side_effect=cart_module._StockChanged):
+            merge_anonymous_cart(session_key, self.user)
+        self.assertEqual(self.lines(self.user), {first.pk: 2, second.pk: 2})
+        self.assertEqual([self.stock(first), self.stock(second)], [8, 8])
+
+
+class CartApiErrorTests(TestCase):
+    """The JSON cart endpoints answer bad quantities with 400, missing books with 404 and stock or cap limits with 409."""
+
+    def setUp(self):
+        self.book = Book.objects.create(title="Hot Title", author="Someone", price="9.99", stock=150)
+        self.add_url = reverse('bookstore:api_cart_add', args=[self.book.pk])
+        self.item_url = reverse('bookstore:api_cart_item', args=[self.book.pk])
+
+    def post_json(self, url, body):
+        return self.client.post(url, json.dumps(body), content_type='application/json')
+
+    def stock(self):
+        return Book.objects.get(pk=self.book.pk).stock
+
+    def test_invalid_quantities_are_rejected(self):
+        for body in ({'quantity': True}, {'quantity': 2.7}, {'quantity': '2'}, {'quantity': -1},
+                     {'quantity': 0}, {'quantity': 100}, {'quantity': None}, [2]):
+            with self.subTest(body=body):
+                self.assertEqual(self.post_json(self.add_url, body).status_code, 400)
+        for quantity in ('2.7', '-1', ' 2', '1e2', 'two'):
+            with self.subTest(quantity=quantity):
+                self.assertEqual(self.client.post(self.add_url, {'quantity': quantity}).status_code, 400)
+        response = self.client.post(self.add_url, b'{"quantity":', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.post_json(self.item_url, {'quantity': False}).status_code, 400)
+        self.assertFalse(CartItem.objects.exists())
+        self.assertEqual(self.stock(), 150)
+
+    def test_integer_and_digit_string_quantities_are_accepted(self):
+        response = self.post_json(self.add_url, {'quantity': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.post(self.add_url, {'quantity': '3'}).status_code, 200)
+        self.assertEqual(self.client.post(self.add_url).status_code, 200)
+        self.assertEqual(CartItem.objects.get().quantity, 6)
+        self.assertEqual(self.post_json(self.item_url, {'quantity': 4}).status_code, 200)
+        self.assertEqual(CartItem.objects.get().quantity, 4)
+
+    def test_missing_book_is_not_found(self):
+        missing = self.book.pk + 1000
+        for name in ('bookstore:api_cart_add', 'bookstore:api_cart_item'):
+            with self.subTest(name=name):
+                response = self.post_json(reverse(name, args=[missing]), {'quantity': 1})
+                self.assertEqual(response.status_code, 404)
+
+    def test_out_of_stock_is_a_conflict(self):
+        Book.objects.filter(pk=self.book.pk).update(stock=1)
+        self.assertEqual(self.post_json(self.add_url, {'quantity': 2}).status_code, 409)
+        self.post_json(self.add_url, {'quantity': 1})
+        self.assertEqual(self.post_json(self.item_url, {'quantity': 3}).status_code, 409)
+        self.assertEqual(CartItem.objects.get().quantity, 1)
+
+    def test_adds_may_not_push_a_line_past_the_cap(self):
+        self.post_json(self.add_url, {'quantity': 60})
+        response = self.post_json(self.add_url, {'quantity': 40})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(CartItem.objects.get().quantity, 60)
+        self.assertEqual(self.stock(), 90)
+        self.assertEqual(self.post_json(self.add_url, {'quantity': 39}).status_code, 200)
+        self.assertEqual(CartItem.objects.get().quantity, 99)
+        self.assertEqual(self.stock(), 51)
+
+
+class MetricsTests(TestCase):
+    """Histograms bucket like Prometheus, the endpoint checks its token and slow requests are logged."""
+
+    def setUp(self):
+        REGISTRY.reset()
+        self.addCleanup(REGISTRY.reset)
+        self.url = reverse('bookstore:metrics')
+
+    def test_histogram_buckets_are_upper_bounds(self):
+        histogram = Histogram((0.01, 0.1, 1.0))
+        for value in (0.005, 0.01, 0.05, 0.5, 3.0):
+            histogram.observe(value)
+        # A value equal to a bound falls in that bound's bucket (le = "less than or equal").
+        self.assertEqual(histogram.snapshot(), ([2, 1, 1, 1], 3.565))
+
+    def test_render_prometheus_output(self):
+        registry = MetricsRegistry()
+        home = (('route', 'bookstore:home'), ('method', 'GET'), ('status', '200'))
+        registry.increment('bookstore_requests_total', home)
+        registry.increment('bookstore_requests_total', home)
+        queries = registry.histogram('bookstore_db_queries', (('route', 'say "hi"\n'),), (0, 2, 5))
+        for value in (0, 2, 3, 9):
+            queries.observe(value)
+        self.assertEqual(render_prometheus(registry), '\n'.join([
+            '# HELP bookstore_db_queries Database queries run per request.',
+            '# TYPE bookstore_db_queries histogram',
+            'bookstore_db_queries_bucket{route="say \\"hi\\"\\n",le="0"} 1',
+            'bookstore_db_queries_bucket{route="say \\"hi\\"\\n",le="2"} 2',
+            'bookstore_db_queries_bucket{route="say \\"hi\\"\\n",le="5"} 3',
+            'bookstore_db_queries_bucket{route="say \\"hi\\"\\n",le="+Inf"} 4',
+            'bookstore_db_queries_sum{route="say \\"hi\\"\\n"} 14.0',
+            'bookstore_db_queries_count{route="say \\"hi\\"\\n"} 4',
+            '# HELP bookstore_requests_total Requests handled, by route, method and status code.',
+            '# TYPE bookstore_requests_total counter',
+            'bookstore_requests_total{route="bookstore:home",method="GET",status="200"} 2',
+        ]) + '\n')
+
+    def test_requests_are_recorded_per_route(self):
+        self.client.get(reverse('bookstore:home'))
+        self.client.get(reverse('bookstore:home'))
+        labels = (('route', 'bookstore:home'),)
+        key = ('bookstore_requests_total', labels + (('method', 'GET'), ('status', '200')))
+        self.assertEqual(REGISTRY.counters[key], 2)
+        counts, total = REGISTRY.histograms[('bookstore_request_duration_seconds', labels)].snapshot()
+        self.assertEqual(sum(counts), 2)
+        self.assertGreater(total, 0)
+        counts, total = REGISTRY.histograms[('bookstore_template_render_seconds', labels)].snapshot()
+        self.assertEqual(sum(counts), 2)
+        self.assertIn(('bookstore_db_queries', labels), REGISTRY.histograms)
+
+    def test_timed_template_adds_render_time_to_the_request(self):
+        template = engines.all()[0].from_string("Hello {{ name }}")
+        self.assertIsInstance(template, TimedTemplate)
+        self.assertEqual(template.render({'name': "reader"}), "Hello reader")
+
+        stats = RequestStats()
+        token = metrics._current_stats.set(stats)
+        try:
+            with mock.patch('bookstore.metrics.time.perf_counter', side_effect=[10.0, 10.25]):
+                self.assertEqual(template.render({'name': "again"}), "Hello again")
+        finally:
+            metrics._current_stats.reset(token)
+        self.assertEqual(stats.template_time, 0.25)
+
+    @override_settings(METRICS_TOKEN='scrape-me')
+    def test_endpoint_needs_the_token_or_a_staff_login(self):
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        self.assertEqual(self.client.get(self.url, headers={'Authorization': 'Bearer wrong'}).status_code, 403)
+        response = self.client.get(self.url, headers={'Authorization': 'Bearer scrape-me'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.assertIn('# TYPE bookstore_requests_total counter', response.content.decode())
+
+        self.client.force_login(User.objects.create_user('reader', password='secret'))
+        self.assertRedirects(self.client.get(self.url), reverse('bookstore:home'), fetch_redirect_response=False)
+        self.client.force_login(User.objects.create_user('staff', password='secret', is_staff=True))
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    @override_settings(METRICS_TOKEN=None)
+    def test_endpoint_without_a_configured_token_refuses_bearer_requests(self):
+        self.assertEqual(self.client.get(self.url, headers={'Authorization': 'Bearer '}).status_code, 403)
+
+    @override_settings(METRICS_SLOW_REQUEST_SECONDS=0, METRICS_SLOW_REQUEST_KEEP=1)
+    def test_slow_requests_are_logged_with_their_sql(self):
+        Book.objects.create(title="Logged", author="Someone", price="1.00")
+        with self.assertLogs('bookstore.slow_requests', 'WARNING') as logs:
+            self.client.get(reverse('bookstore:home'))
+            self.client.get(reverse('bookstore:book_list'))
+        self.assertEqual(len(logs.records), 2)
+        self.assertIn("Slow request GET /books/", logs.output[1])
+        self.assertTrue(any('FROM "bookstore_book"' in sql for _, sql in logs.records[1].sql))
+
+        slowest = REGISTRY.slowest_requests()
+        self.assertEqual(len(slowest), 1)
+        self.assertIn(slowest[0]['route'], {'bookstore:home', 'bookstore:book_list'})
+
+    @override_settings(METRICS_SLOW_REQUEST_SECONDS=60)
+    def test_fast_requests_are_not_logged(self):
+        with self.assertNoLogs('bookstore.slow_requests', 'WARNING'):
+            self.client.get(reverse('bookstore:home'))
+        self.assertEqual(REGISTRY.slowest_requests(), [])
+
+
+class RecommendationComputeTests(TestCase):
+    """compute() ranks the pairs counted across every chunk of orders."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('reader', password='secret')
+        self.a, self.b, self.c, self.d, self.e = (
+            Book.objects.create(title=title, author="Someone", price="1.00") for title in "ABCDE"
+        )
+        # With batch_size=2 the orders come in chunks (1, 2), (3, 4), (5, 6), (7,):
+        # A-B and A-C are counted in more than one chunk. Order 6 is the bulk order.
+        for number, basket in enumerate([
+            [self.a, self.b],
+            [self.a, self.b, self.c],
+            [self.a, self.c, self.a],
+            [self.a, self.b, self.d],
+            [self.c, self.d],
+            [self.a, self.b, self.c, self.d, self.e],
+            [self.e],
+        ]):
+            order = Order.objects.create(user=self.user, idempotency_key=str(number), total="0.00")
+            OrderLine.objects.bulk_create(
+                OrderLine(order=order, book=book, title=book.title, unit_price=book.price, quantity=1) for book in basket
+            )
+
+    def ranked(self):
+        return list(
+            BookRecommendation.objects.order_by('book__title', 'rank')
+            .values_list('book__title', 'rank', 'recommended__title', 'score')
+        )
+
+    def test_baskets_come_in_chunks_of_orders(self):
+        chunks = list(recommendations.baskets(batch_size=2))
+        a, b, c, d, e = (book.pk for book in (self.a, self.b, self.c, self.d, self.e))
+        self.assertEqual(chunks, [[(a, b), (a, b, c)], [(a, c), (a, b, d)], [(c, d), (a, b, c, d, e)], [(e,)]])
+
+    def test_count_pairs_skips_single_and_oversized_baskets(self):
+        self.assertEqual(
+            recommendations.count_pairs([(1, 2, 3), (1, 2), (5,), (1, 2, 3, 4)], max_basket=3),
+            Counter({(1, 2): 2, (2, 1): 2, (1, 3): 1, (3, 1): 1, (2, 3): 1, (3, 2): 1}),
+        )
+
+    def test_ranks_pairs_across_chunk_boundaries(self):
+        self.assertEqual(recommendations.compute(top=2, batch_size=2, max_basket=4), (7, 12, 8))
+        # Ties on the count go to the lower book id.
+        self.assertEqual(self.ranked(), [
+            ("A", 1, "B", 3), ("A", 2, "C", 2),
+            ("B", 1, "A", 3), ("B", 2, "C", 1),
+            ("C", 1, "A", 2), ("C", 2, "B", 1),
+            ("D", 1, "A", 1), ("D", 2, "B", 1),
+        ])
+        rows = self.ranked()
+        recommendations.compute(top=2, batch_size=1000, max_basket=4)
+        self.assertEqual(self.ranked(), rows)
+
+    def test_min_orders_drops_rare_pairs(self):
+        self.assertEqual(recommendations.compute(top=2, batch_size=2, max_basket=4, min_orders=2), (7, 12, 4))
+        self.assertEqual(self.ranked(), [("A", 1, "B", 3), ("A", 2, "C", 2), ("B", 1, "A", 3), ("C", 1, "A", 2)])
+
+    def test_larger_max_basket_counts_the_bulk_order(self):
+        recommendations.compute(top=2, batch_size=2, max_basket=5)
+        self.assertEqual(self.ranked(), [
+            ("A", 1, "B", 4), ("A", 2, "C", 3),
+            ("B", 1, "A", 4), ("B", 2, "C", 2),
+            ("C", 1, "A", 3), ("C", 2, "B", 2),
+            ("D", 1, "A", 2), ("D", 2, "B", 2),
+            ("E", 1, "A", 1), ("E", 2, "B", 1),
+        ])
+
+    def test_recompute_replaces_rows_without_deleted_books(self):
+        recommendations.compute(top=2, batch_size=2, max_basket=4)
+        self.b.delete()
+        # Without B the bulk order has four books left, so it now counts.
+        self.assertEqual(recommendations.compute(top=2, batch_size=2, max_basket=4), (7, 12, 8))
+        self.assertEqual(self.ranked(), [
+            ("A", 1, "C", 3), ("A", 2, "D", 2),
+            ("C", 1, "A", 3), ("C", 2, "D", 2),
+            ("D", 1, "A", 2), ("D", 2, "C", 2),
+            ("E", 1, "A", 1), ("E", 2, "C", 1),
+        ])
+
+
+class CatalogExportTests(TestCase):
+    """The staff export streams one CSV or NDJSON row per filtered book."""
+
+    def setUp(self):
+        self.url = reverse('bookstore:admin_book_export')
+        self.client.force_login(User.objects.create_user('staff', password='secret', is_staff=True))
+        self.tricky = Book.objects.create(
+            title='Eats, Shoots\nand "Leaves"', author="Lynne Truss", price="8.50", stock=3,
+            description="Commas, everywhere",
+        )
+        self.plain = Book.objects.create(title="Emma", author="Jane Austen", price="5.00", stock=1)
+        self.other = Book.objects.create(title="Persuasion", author="Jane Austen", price="12.00")
+
+    def export(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_csv_has_a_header_and_quotes_commas_and_newlines(self):
+        response, body = self.export()
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="books.csv"')
+        rows = list(csv.reader(io.StringIO(body)))
+        self.assertEqual(rows[0], ['id', 'title', 'author', 'description', 'price', 'stock', 'updated_at'])
+        self.assertEqual([row[:6] for row in rows[1:]], [
+            [str(self.tricky.pk), 'Eats, Shoots\nand "Leaves"', "Lynne Truss", "Commas, everywhere", "8.50", "3"],
+            [str(self.plain.pk), "Emma", "Jane Austen", "", "5.00", "1"],
+            [str(self.other.pk), "Persuasion", "Jane Austen", "", "12.00", "0"],
+        ])
+        self.assertIn('"Eats, Shoots\nand ""Leaves"""', body)
+
+    def test_filters_apply_to_both_formats(self):
+        _, body = self.export(author="jane austen", max_price="10")
+        rows = list(csv.reader(io.StringIO(body)))
+        self.assertEqual([row[1] for row in rows[1:]], ["Emma"])
+
+        response, body = self.export(format='ndjson', author="Jane Austen")
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        lines = body.splitlines()
+        self.assertEqual([json.loads(line)['title'] for line in lines], ["Emma", "Persuasion"])
+        self.assertEqual(json.loads(lines[0])['price'], "5.00")
+
+    def test_ndjson_keeps_one_record_per_line(self):
+        _, body = self.export(format='ndjson', author="Lynne Truss")
+        self.assertEqual(body.count('\n'), 1)
+        self.assertEqual(json.loads(body)['title'], 'Eats, Shoots\nand "Leaves"')
+
+    def test_bad_requests(self):
+        self.assertEqual(self.client.get(self.url, {'format': 'xml'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'min_price': 'cheap'}).status_code, 400)
+
+    def test_only_staff_can_export(self):
+        self.client.logout()
+        response = self.client.get(self.url)
+        self.assertRedirects(response, f"{reverse('bookstore:login')}?next={self.url}", fetch_redirect_response=False)
+        self.client.force_login(User.objects.create_user('reader', password='secret'))
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+
+class SqlitePragmaTests(SimpleTestCase):
+    """The production database profile sets its PRAGMAs on every new connection."""
+
+    script = (
+        "import django; django.setup()\n"
+        "from django.db import connection\n"
+        "with connection.cursor() as cursor:\n"
+        "    for name in ('journal_mode', 'busy_timeout', 'synchronous', 'temp_store'):\n"
+        "        print(cursor.execute(f'PRAGMA {name}').fetchone()[0])\n"
+    )
+
+    def read_pragmas(self, **env):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        environ = {
+            key: value for key, value in os.environ.items()
+            if not key.startswith('BOOKSTORE_') and key != 'DJANGO_SETTINGS_MODULE'
+        }
+        environ.update(env, DJANGO_SETTINGS_MODULE='bookstore_project.settings')
+        environ['BOOKSTORE_DB_NAME'] = os.path.join(directory, 'db.sqlite3')
+        # A fresh interpreter, so the profile's settings and the connection_created receiver apply.
+        result = subprocess.run(
+            [sys.executable, '-c', self.script],
+            cwd=settings.BASE_DIR, env=environ, capture_output=True, text=True, timeout=60,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        return result.stdout.split()
+
+    def test_production_profile_pragmas_are_applied(self):
+        # synchronous NORMAL is 1 and temp_store MEMORY is 2.
+        self.assertEqual(self.read_pragmas(BOOKSTORE_DB_PROFILE='production'), ['wal', '5000', '1', '2'])
+
+    @override_settings(SQLITE_PRAGMAS={'busy_timeout': 1234, 'journal_mode': 'WAL', 'synchronous': 'OFF'})
+    def test_configured_pragmas_are_read_back_from_a_new_connection(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        wrapper = SQLiteDatabaseWrapper(
+            {**connections['default'].settings_dict, 'NAME': os.path.join(directory, 'db.sqlite3')}, alias='pragma_check',
+        )
+        self.addCleanup(wrapper.close)
+        names = ('journal_mode', 'busy_timeout', 'synchronous')
+        with wrapper.cursor() as cursor:
+            values = [cursor.execute(f'PRAGMA {name}').fetchone()[0] for name in names]
+        self.assertEqual(values, ['wal', 1234, 0])
+
+    def test_development_profile_keeps_sqlite_defaults(self):
+        # busy_timeout 5000 is the driver's own default connect timeout.
+        self.assertEqual(self.read_pragmas(BOOKSTORE_DB_PROFILE='development'), ['delete', '5000', '2', '0'])
@@ -0,0 +1,144 @@
+"""
+Protects the server from floods of login and registration attempts.
+
+Each attempt first takes a token from two buckets in the AUTH_THROTTLE_CACHE_ALIAS
+cache: one for the client IP and one for the username. A bucket holds `burst`
+tokens and refills at `per_minute`. An empty bucket rejects the attempt with a
+429 before any password is hashed. The buckets are read and written without a
+cross-process lock, so concurrent attempts can slightly exceed a limit, but
+never by more than the number of attempts in flight.
+
+Attempts that get through then hash under hashing_slot(). This caps how many
+password hashes one process computes at once (PASSWORD_HASH_CONCURRENCY), so
+a burst of logins cannot occupy every worker thread, and catalog requests keep
+a thread to run on. A waiting attempt gives up after PASSWORD_HASH_WAIT
+seconds or, by default, after PASSWORD_HASH_WAIT_HASHES times the measured
+time a slot is held, so a couple of overlapping logins both get through.
+"""
+import hashlib
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+BUCKET_KEY = 'bookstore:throttle:{bucket}:{digest}'
+
+# Serializes the bucket updates of this process's threads.
+_lock = threading.Lock()
+_slots = None
+_slots_size = None
+# Moving average of how long a hashing slot is held, in seconds; None until measured.
+_hash_seconds = None
+# Assumed until the first slot is released: a slow server's 1,000,000-iteration hash.
+INITIAL_HASH_SECONDS = 1.0
+# Weight of the newest hold time in the moving average.
+HASH_SECONDS_SMOOTHING = 0.2
+
+
+class HashingBusy(Exception):
+    """No password hashing slot came free within hashing_wait() seconds."""
+
+
+def throttle_cache():
+    return caches[getattr(settings, 'AUTH_THROTTLE_CACHE_ALIAS', 'default')]
+
+
+def client_ip(request):
+    """
+    The client's address: REMOTE_ADDR, or, behind NUM_PROXIES reverse proxies,
+    the X-Forwarded-For entry the outermost proxy added.
+    """
+    proxies = getattr(settings, 'NUM_PROXIES', 0)
+    if proxies:
+        forwarded = [part.strip() for part in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',')]
+        forwarded = [part for part in forwarded if part]
+        if forwarded:
+            return forwarded[-min(proxies, len(forwarded))]
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def take_token(bucket, key, now=None):
+    """
+    Takes one token from `key`'s bucket. Returns 0 when it was allowed, else the
+    seconds until a token is available. Buckets missing from AUTH_THROTTLE_RATES
+    are unlimited.
+    """
+    rate = getattr(settings, 'AUTH_THROTTLE_RATES', {}).get(bucket)
+    if rate is None:
+        return 0
+    burst, per_minute = rate
+    per_second = per_minute / 60
+    now = time.time() if now is None else now
+    digest = hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]
+    cache_key = BUCKET_KEY.format(bucket=bucket, digest=digest)
+    cache = throttle_cache()
+    with _lock:
+        tokens, updated = cache.get(cache_key, (burst, now))
+        tokens = min(burst, tokens + max(0, now - updated) * per_second)
+        if tokens < 1:
+            return (1 - tokens) / per_second
+        tokens -= 1
+        # Once it would have refilled, an absent bucket is the same as a full one.
+        cache.set(cache_key, (tokens, now), timeout=math.ceil((burst - tokens) / per_second) + 1)
+    return 0
+
+
+def throttle_attempt(request, scope, username):
+    """
+    Charges an attempt against the scope's per-IP and per-username buckets
+    ('login:ip', 'login:username', ...). Returns 0 or the seconds to wait.
+    """
+    wait = take_token(f'{scope}:ip', client_ip(request))
+    if wait:
+        return wait
+    return take_token(f'{scope}:username', username.casefold())
+
+
+def hashing_wait():
+    """
+    Seconds an attempt waits for a hashing slot: PASSWORD_HASH_WAIT if set, else
+    PASSWORD_HASH_WAIT_HASHES times the average time a slot is held.
+    """
+    wait = getattr(settings, 'PASSWORD_HASH_WAIT', None)
+    if wait is not None:
+        return wait
+    held = INITIAL_HASH_SECONDS if _hash_seconds is None else _hash_seconds
+    return getattr(settings, 'PASSWORD_HASH_WAIT_HASHES', 2) * held
+
+
+def _record_hash_seconds(seconds):
+    global _hash_seconds
+    with _lock:
+        if _hash_seconds is None:
+            _hash_seconds = seconds
+        else:
+            _hash_seconds += HASH_SECONDS_SMOOTHING * (seconds - _hash_seconds)
+
+
+@contextmanager
+def hashing_slot():
+    """
+    Runs the block holding one of the process's PASSWORD_HASH_CONCURRENCY slots.
+    Raises HashingBusy if none comes free within hashing_wait() seconds.
+    """
+    global _slots, _slots_size
+    size = getattr(settings, 'PASSWORD_HASH_CONCURRENCY', None)
+    if not size:
+        yield
+        return
+    with _lock:
+        if _slots_size != size:
+            _slots, _slots_size = threading.BoundedSemaphore(size), size
+        slots = _slots
+    if not slots.acquire(timeout=hashing_wait()):
+        raise HashingBusy
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        slots.release()
+        _record_hash_seconds(time.perf_counter() - started)
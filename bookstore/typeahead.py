@@ -0,0 +1,270 @@
+"""
+As-you-type suggestions from an in-process prefix index.
+
+Each process keeps the normalized titles and authors of the whole catalog in
+sorted arrays and answers a prefix with a bisect, so typing never touches the
+database. The index is built on first use. Admin edits publish their change
+under a shared version counter in the catalog cache; every process replays
+the changes it missed on its next lookup, and rebuilds when they have left
+the cache or came from a bulk operation.
+
+Versions are numbered by a VersionCounter row, bumped with an UPDATE whose
+write lock is held until the change and the new version are in the cache.
+Publishers in different processes therefore never share a version, and the
+cached version never moves backwards.
+"""
+import threading
+import time
+import unicodedata
+from array import array
+from bisect import bisect_left, insort
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.db.models import F
+
+from .cache import catalog_cache, catalog_cache_timeout
+from .db import retry_on_busy
+from .models import Book, VersionCounter
+
+
+VERSION_KEY = 'bookstore:typeahead:version'
+VERSION_COUNTER = 'typeahead'
+CHANGE_KEY = 'bookstore:typeahead:change:{version}'
+
+# A process further behind than this rebuilds instead of replaying the changes.
+MAX_REPLAY = 100
+BUILD_CHUNK_SIZE = 10000
+MAX_PREFIX_LENGTH = 100
+TITLE_LIMIT = 8
+AUTHOR_LIMIT = 4
+
+
+def normalize(text):
+    """The case- and accent-insensitive form of keys and prefixes: 'Émile  Zola' -> 'emile zola'."""
+    decomposed = unicodedata.normalize('NFKD', text or '')
+    stripped = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return ' '.join(stripped.casefold().split())
+
+
+def _prefix_range(keys, prefix, limit):
+    """Indexes of the first `limit` keys starting with `prefix`."""
+    start = bisect_left(keys, prefix)
+    end = start
+    while end < len(keys) and end - start < limit and keys[end].startswith(prefix):
+        end += 1
+    return range(start, end)
+
+
+class PrefixIndex:
+    """
+    Sorted title and author keys with their display forms.
+
+    Titles are three parallel arrays (normalized key, book id, title) sorted by
+    key and id, which costs far less memory per book than a trie or a list of
+    tuples. Authors are kept once each, with the number of books they wrote.
+    """
+
+    def __init__(self, rows=(), version=None):
+        self.version = version
+        titles = []
+        self.authors = {}
+        for book_id, title, author in rows:
+            titles.append((normalize(title), book_id, title))
+            self._count_author(author, 1)
+        titles.sort()
+        self.title_keys = [key for key, _, _ in titles]
+        self.title_ids = array('q', (book_id for _, book_id, _ in titles))
+        self.title_labels = [title for _, _, title in titles]
+        self.author_keys = sorted(self.authors)
+
+    def __len__(self):
+        return len(self.title_keys)
+
+    def _count_author(self, author, delta):
+        """Adjusts an author's book count; returns True if the author appeared or disappeared."""
+        key = normalize(author)
+        entry = self.authors.get(key)
+        if entry is None:
+            if delta > 0:
+                self.authors[key] = [author, delta]
+            return delta > 0
+        entry[1] += delta
+        if entry[1] <= 0:
+            del self.authors[key]
+            return True
+        return False
+
+    def _find_title(self, key, book_id):
+        """(position, found) of a book's title entry, keeping entries ordered by key then id."""
+        position = bisect_left(self.title_keys, key)
+        while position < len(self.title_keys) and self.title_keys[position] == key:
+            if self.title_ids[position] >= book_id:
+                return position, self.title_ids[position] == book_id
+            position += 1
+        return position, False
+
+    def add(self, book_id, title, author):
+        key = normalize(title)
+        position, found = self._find_title(key, book_id)
+        if found:
+            # Already indexed, e.g. the edit landed while the index was being built.
+            return
+        self.title_keys.insert(position, key)
+        self.title_ids.insert(position, book_id)
+        self.title_labels.insert(position, title)
+        if self._count_author(author, 1):
+            insort(self.author_keys, normalize(author))
+
+    def remove(self, book_id, title, author):
+        position, found = self._find_title(normalize(title), book_id)
+        if not found:
+            return
+        del self.title_keys[position]
+        del self.title_ids[position]
+        del self.title_labels[position]
+        if self._count_author(author, -1):
+            key = normalize(author)
+            position = bisect_left(self.author_keys, key)
+            if position < len(self.author_keys) and self.author_keys[position] == key:
+                del self.author_keys[position]
+
+    def apply(self, change):
+        """Applies a published change: (book_id, old, new), each side (title, author) or None."""
+        book_id, old, new = change
+        if old is not None:
+            self.remove(book_id, *old)
+        if new is not None:
+            self.add(book_id, *new)
+
+    def suggest(self, prefix, title_limit=TITLE_LIMIT, author_limit=AUTHOR_LIMIT):
+        """Returns ([(book_id, title), ...], [author, ...]) for a normalized prefix."""
+        if not prefix:
+            return [], []
+        titles = [
+            (self.title_ids[i], self.title_labels[i])
+            for i in _prefix_range(self.title_keys, prefix, title_limit)
+        ]
+        authors = [
+            self.authors[self.author_keys[i]][0]
+            for i in _prefix_range(self.author_keys, prefix, author_limit)
+        ]
+        return titles, authors
+
+
+_lock = threading.Lock()
+_index = None
+
+
+def current_version():
+    # Seeded from the clock, like the catalog versions, so a counter lost from the
+    # cache never comes back at a value some process already has.
+    return catalog_cache().get_or_set(VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def build_index(version=None):
+    rows = Book.objects.order_by().values_list('id', 'title', 'author').iterator(chunk_size=BUILD_CHUNK_SIZE)
+    return PrefixIndex(rows, version=version)
+
+
+def _catch_up(index, version):
+    """Replays the changes published since `index` was current. Returns False if it must be rebuilt."""
+    if not index.version < version <= index.version + MAX_REPLAY:
+        return False
+    keys = [CHANGE_KEY.format(version=v) for v in range(index.version + 1, version + 1)]
+    changes = catalog_cache().get_many(keys)
+    if len(changes) != len(keys):
+        return False
+    for key in keys:
+        index.apply(changes[key])
+    index.version = version
+    return True
+
+
+def _current_index(version):
+    """The index caught up to `version`, or rebuilt. Call with _lock held."""
+    global _index
+    if _index is not None and _index.version != version and not _catch_up(_index, version):
+        _index = None
+    if _index is None:
+        _index = build_index(version)
+    return _index
+
+
+def preload():
+    """Builds the index now instead of on the first suggestion; returns the number of titles."""
+    version = current_version()
+    with _lock:
+        return len(_current_index(version))
+
+
+def suggest(query, title_limit=TITLE_LIMIT, author_limit=AUTHOR_LIMIT):
+    """Title and author suggestions for what the shopper has typed so far; see PrefixIndex.suggest."""
+    prefix = normalize(query[:MAX_PREFIX_LENGTH])
+    if not prefix:
+        return [], []
+    version = current_version()
+    with _lock:
+        return _current_index(version).suggest(prefix, title_limit, author_limit)
+
+
+async def asuggest(query, title_limit=TITLE_LIMIT, author_limit=AUTHOR_LIMIT):
+    """
+    suggest() for async views.
+
+    A current index answers in the event loop. Building or catching up runs
+    queries, and the lock may be held by a thread doing so, so those cases
+    hand over to suggest() on a worker thread instead of blocking the loop.
+    """
+    prefix = normalize(query[:MAX_PREFIX_LENGTH])
+    if not prefix:
+        return [], []
+    index = _index
+    if index is not None and index.version == current_version() and _lock.acquire(blocking=False):
+        try:
+            if index is _index:
+                return index.suggest(prefix, title_limit, author_limit)
+        finally:
+            _lock.release()
+    return await sync_to_async(suggest)(query, title_limit, author_limit)
+
+
+def book_changed(book_id, old=None, new=None):
+    """
+    Publishes a single book's change to every process's index once the transaction commits.
+
+    `old` and `new` are the book's (title, author) before and after; None when
+    the book was created or deleted.
+    """
+    if old == new:
+        return
+    transaction.on_commit(lambda: publish(1, (book_id, old, new)))
+
+
+def invalidate():
+    """Makes every process rebuild its index, e.g. after a bulk edit or an import."""
+    transaction.on_commit(lambda: publish(MAX_REPLAY + 1))
+
+
+@retry_on_busy
+def publish(step, change=None):
+    """
+    Bumps the shared version by `step` and stores `change` under the new version.
+    Returns the new version.
+
+    The cache's incr() is a get and a set on the file backend, so two processes
+    could both take the same version. Instead the UPDATE takes the database's
+    write lock first, and the transaction holds it until both cache writes
+    are done.
+    """
+    cache = catalog_cache()
+    with transaction.atomic():
+        counters = VersionCounter.objects.filter(name=VERSION_COUNTER)
+        if not counters.update(value=F('value') + step):
+            # The first bump carries on from the version the processes already hold.
+            VersionCounter.objects.create(name=VERSION_COUNTER, value=current_version() + step)
+        version = counters.values_list('value', flat=True).get()
+        if change is not None:
+            cache.set(CHANGE_KEY.format(version=version), change, catalog_cache_timeout())
+        cache.set(VERSION_KEY, version, timeout=None)
+    return version
@@ -7,6 +7,9 @@ urlpatterns = [
     
     path('', views.HomeView.as_view(), name='home'),
     path('books/', views.BookListView.as_view(), name='book_list'),
+    path('books/search/', views.BookSearchView.as_view(), name='book_search'),
+    path('books/suggest/', views.BookSuggestView.as_view(), name='book_suggest'),
+    path('authors/', views.AuthorIndexView.as_view(), name='author_index'),
     path('books/<int:book_id>/', views.BookDetailView.as_view(), name='book_detail'), 
     path('register/', views.UserRegistrationView.as_view(), name='register'), 
     path('login/', views.CustomLoginView.as_view(), name='login'), 
@@ -17,10 +20,29 @@ urlpatterns = [
     path('cart/', views.CartView.as_view(), name='cart_view'),
     path('add-to-cart/<int:book_id>/', views.AddToCartView.as_view(), name='add_to_cart'),
     path('payment/', views.PaymentView.as_view(), name='payment'),
+    path('orders/<int:order_id>/', views.OrderDetailView.as_view(), name='order_detail'),
+
+    
+    path('api/cart/', views.CartApiView.as_view(), name='api_cart'),
+    path('api/cart/add/<int:book_id>/', views.CartApiAddView.as_view(), name='api_cart_add'),
+    path('api/cart/items/<int:book_id>/', views.CartApiItemView.as_view(), name='api_cart_item'),
+    path('api/session/', views.SessionView.as_view(), name='session'),
+
+    
+    # Async versions of the read paths, for ASGI deployments (see README).
+    path('async/books/', views.AsyncBookListView.as_view(), name='async_book_list'),
+    path('async/books/suggest/', views.AsyncBookSuggestView.as_view(), name='async_book_suggest'),
+    path('async/books/<int:book_id>/', views.AsyncBookDetailView.as_view(), name='async_book_detail'),
+    path('async/api/cart/', views.AsyncCartApiView.as_view(), name='async_api_cart'),
 
     
     path('manage/books/', views.AdminBookListView.as_view(), name='admin_book_list'),
+    path('manage/books/bulk/', views.AdminBookBulkActionView.as_view(), name='admin_book_bulk'),
+    path('manage/books/export/', views.AdminBookExportView.as_view(), name='admin_book_export'),
     path('manage/books/add/', views.AdminBookCreateView.as_view(), name='admin_book_create'),
     path('manage/books/<int:book_id>/edit/', views.AdminBookUpdateView.as_view(), name='admin_book_update'),
     path('manage/books/<int:book_id>/delete/', views.AdminBookDeleteView.as_view(), name='admin_book_delete'),
+
+    
+    path('manage/metrics/', views.MetricsView.as_view(), name='metrics'),
 ]
\ No newline at end of file
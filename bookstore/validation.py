@@ -0,0 +1,70 @@
+from decimal import Decimal, InvalidOperation
+
+from .models import Book
+
+
+PRICE_QUANTUM = Decimal('0.01')
+
+
+def max_price():
+    """The exclusive upper bound DecimalField(max_digits, decimal_places) allows for Book.price."""
+    field = Book._meta.get_field('price')
+    return Decimal(10) ** (field.max_digits - field.decimal_places)
+
+
+def clean_price(price_str):
+    """Parses a price string. Returns (price, error); price is None when there is an error."""
+    if not price_str:
+        return None, "Price is required."
+    try:
+        price = Decimal(price_str).quantize(PRICE_QUANTUM)
+    except (InvalidOperation, ValueError):
+        return None, "Invalid price format (e.g., 12.99)."
+    if not price.is_finite():
+        return None, "Invalid price format (e.g., 12.99)."
+    if price < 0:
+        return None, "Price cannot be negative."
+    if price >= max_price():
+        return None, f"Price must be less than {max_price()}."
+    return price, None
+
+
+def clean_stock(stock_str, required=False):
+    """Parses a stock count. Returns (stock, error); a blank count is 0 unless `required`."""
+    if not stock_str:
+        return (None, "Stock is required.") if required else (0, None)
+    try:
+        stock = int(stock_str)
+    except (TypeError, ValueError):
+        return None, "Stock must be a whole number."
+    if stock < 0:
+        return None, "Stock cannot be negative."
+    return stock, None
+
+
+def clean_text(field_name, value):
+    """Checks a required Book text field. Returns an error message, or None if valid."""
+    label = field_name.capitalize()
+    if not value:
+        return f"{label} is required."
+    max_length = Book._meta.get_field(field_name).max_length
+    if len(value) > max_length:
+        return f"{label} cannot be longer than {max_length} characters."
+    return None
+
+
+def clean_book_fields(title, author, price_str):
+    """
+    Validates the fields of a book as entered in the staff form or an import file.
+
+    Returns (price, errors), where errors maps field names to messages.
+    """
+    errors = {}
+    for name, value in (('title', title), ('author', author)):
+        error = clean_text(name, value)
+        if error:
+            errors[name] = error
+    price, price_error = clean_price(price_str)
+    if price_error:
+        errors['price'] = price_error
+    return price, errors
@@ -1,42 +1,315 @@
+import json
+import math
+import re
+import uuid
+from decimal import Decimal
+
 from django.shortcuts import render, redirect, get_object_or_404
+from django.template.loader import render_to_string
 from django.views import View
 
 from django.contrib.auth import authenticate, login, logout
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User
 
 from django.urls import reverse_lazy, reverse
+from django.utils.http import urlencode
 from django.conf import settings 
 from django.contrib import messages
 
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 
-from .models import Book
-
-
-
-class HomeView(View):
+from django.db import transaction
+from django.db.models.functions import Substr
+from django.http import (
+    Http404, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, JsonResponse, StreamingHttpResponse,
+)
+from django.middleware.csrf import get_token
+from django.utils.cache import add_never_cache_headers, patch_cache_control
+from django.utils.crypto import constant_time_compare
+
+from . import facets, typeahead
+from .bulk import BulkActionError, apply_bulk_action
+from .cache import (
+    book_detail_key, bump_catalog_version, catalog_cache, catalog_cache_timeout, catalog_list_key,
+)
+from .cart import (
+    TooManyCopies, acart_summary, add_item, aget_cart, cart_lines, cart_summary, cart_total, get_cart,
+    get_or_create_cart, line_summary, merge_anonymous_cart, remove_item, set_quantity,
+)
+from .conditional import (
+    PublicPageMixin, abook_validators, acatalog_validators, book_validators, catalog_validators,
+    not_modified_response, set_validator_headers,
+)
+from .db import RetryOnBusyMixin, is_busy_error
+from .export import csv_lines, export_rows, ndjson_lines
+from .filters import filter_books, parse_book_filters
+from .inventory import OutOfStock, adjust_stock
+from .metrics import REGISTRY, render_prometheus
+from .models import Book, Order
+from .orders import CheckoutError, clean_idempotency_key, place_order
+from .pagination import apaginate_by_title, get_page_size, paginate_by_title
+from .query_budget import QueryBudgetMixin
+from .recommendations import arecommendations_for, bump_book_pages, recommendations_for
+from .routers import ReplicaReadMixin
+from .search import search_books
+from .throttle import HashingBusy, hashing_slot, throttle_attempt
+from .validation import clean_book_fields, clean_stock
+
+# Enough of the description for the card's truncatewords:20 without loading the full TextField.
+BOOK_CARD_EXCERPT_CHARS = 300
+# A form-encoded quantity: ASCII digits only, which str.isdigit() is not.
+DIGITS = re.compile(r'[0-9]+')
+
+
+def book_card_queryset():
+    """Books with just the columns a catalog card renders."""
+    return Book.objects.only('id', 'title', 'author', 'price').annotate(
+        excerpt=Substr('description', 1, BOOK_CARD_EXCERPT_CHARS)
+    )
+
+
+class HomeView(QueryBudgetMixin, PublicPageMixin, View):
     """Displays the home page."""
+    query_budget = 2
     def get(self, request, *args, **kwargs):
         return render(request, 'bookstore/home.html')
 
-class BookListView(View):
-    """Displays the list of available books."""
+class BookListView(QueryBudgetMixin, PublicPageMixin, ReplicaReadMixin, View):
+    """Displays the list of available books, one keyset page at a time, optionally by author and price band."""
+    query_budget = 5
     def get(self, request, *args, **kwargs):
-        books = Book.objects.all().order_by('title') 
-        context = {'books': books}
-        return render(request, 'bookstore/book_list.html', context)
+        page_size, after, before, author, band = params = self.read_params(request)
+        validators = catalog_validators(*params)
+        not_modified = not_modified_response(request, validators)
+        if not_modified is not None:
+            return not_modified
+
+        # The page is cached under the current catalog version, so any admin
+        # edit makes every cached page unreachable at once.
+        cache = catalog_cache()
+        cache_key = catalog_list_key('book_list', *params)
+        cached = cache.get(cache_key)
+        if cached is None:
+            page = paginate_by_title(self.books(author, band), page_size, after=after, before=before)
+            # Counts come from the facet table, never from aggregating Book.
+            total, bands = facets.band_counts(author)
+            cached = {'page': page, 'total': total, 'bands': bands}
+            cache.set(cache_key, cached, catalog_cache_timeout())
+        return self.render_page(request, params, cached, validators)
+
+    def read_params(self, request):
+        """(page size, after, before, author, price band) from the query string."""
+        band = request.GET.get('price', '')
+        if band not in facets.BAND_LABELS:
+            band = facets.ANY
+        return (
+            get_page_size(request),
+            request.GET.get('after'),
+            request.GET.get('before'),
+            request.GET.get('author', '').strip(),
+            band,
+        )
+
+    def books(self, author, band):
+        books = book_card_queryset()
+        if author:
+            books = books.filter(author=author)
+        if band:
+            books = books.filter(facets.band_filter(band))
+        return books
+
+    def render_page(self, request, params, cached, validators):
+        page_size, _, _, author, band = params
+        page = cached['page']
+        filters = {name: value for name, value in (('author', author), ('price', band)) if value}
+        context = {
+            'books': page.items,
+            'page': page,
+            'page_size': page_size,
+            'author': author,
+            'band': band,
+            'band_label': facets.BAND_LABELS.get(band),
+            'bands': cached['bands'],
+            'total': cached['total'],
+            'filter_query': urlencode(filters),
+            'author_query': urlencode({'author': author}) if author else '',
+        }
+        response = render(request, 'bookstore/book_list.html', context)
+        return set_validator_headers(response, validators)
+
+class AsyncBookListView(BookListView):
+    """BookListView on the async ORM, for ASGI deployments."""
+    async def get(self, request, *args, **kwargs):
+        page_size, after, before, author, band = params = self.read_params(request)
+        validators = await acatalog_validators(*params)
+        not_modified = not_modified_response(request, validators)
+        if not_modified is not None:
+            return not_modified
+
+        cache = catalog_cache()
+        cache_key = catalog_list_key('book_list', *params)
+        cached = await cache.aget(cache_key)
+        if cached is None:
+            page = await apaginate_by_title(self.books(author, band), page_size, after=after, before=before)
+            total, bands = await facets.aband_counts(author)
+            cached = {'page': page, 'total': total, 'bands': bands}
+            await cache.aset(cache_key, cached, catalog_cache_timeout())
+        return self.render_page(request, params, cached, validators)
+
+class AuthorIndexView(QueryBudgetMixin, PublicPageMixin, ReplicaReadMixin, View):
+    """Authors A-Z with their number of books, read from the facet table."""
+    query_budget = 3
+    page_size = 100
+    def get(self, request, *args, **kwargs):
+        initial = request.GET.get('letter', 'A').upper()
+        if initial not in facets.INITIALS:
+            initial = 'A'
+        after = request.GET.get('after', '')
+
+        cache = catalog_cache()
+        cache_key = catalog_list_key('author_index', initial, after)
+        authors = cache.get(cache_key)
+        if authors is None:
+            authors = facets.authors_by_initial(initial, after=after, limit=self.page_size + 1)
+            cache.set(cache_key, authors, catalog_cache_timeout())
 
-class BookDetailView(View):
-    """Displays the details of a single book."""
-    def get(self, request, book_id, *args, **kwargs):
-        book = get_object_or_404(Book, pk=book_id)
-        context = {'book': book}
-        return render(request, 'bookstore/book_detail.html', context)
+        context = {
+            'initials': facets.INITIALS,
+            'initial': initial,
+            'authors': [
+                {'name': name, 'count': count, 'query': urlencode({'author': name})}
+                for name, count in authors[:self.page_size]
+            ],
+            'next_query': urlencode({'letter': initial, 'after': authors[self.page_size - 1][0]})
+            if len(authors) > self.page_size else '',
+        }
+        return render(request, 'bookstore/author_index.html', context)
 
+class BookSearchView(QueryBudgetMixin, PublicPageMixin, View):
+    """Full-text search over book titles, authors and descriptions, best match first."""
+    query_budget = 4
+    template_name = 'bookstore/search_results.html'
 
+    def get(self, request, *args, **kwargs):
+        query = request.GET.get('q', '').strip()
+        page_size = get_page_size(request)
+        try:
+            page_number = max(1, int(request.GET.get('page', 1)))
+        except ValueError:
+            page_number = 1
+
+        books = []
+        if query:
+            # Fetch one extra row to learn whether there is a next page without a COUNT(*).
+            books = search_books(
+                query,
+                limit=page_size + 1,
+                offset=(page_number - 1) * page_size,
+                queryset=book_card_queryset(),
+            )
+        context = {
+            'query': query,
+            'books': books[:page_size],
+            'page_number': page_number,
+            'page_size': page_size,
+            'has_next': len(books) > page_size,
+            'has_previous': page_number > 1,
+        }
+        return render(request, self.template_name, context)
 
-class UserRegistrationView(View):
+class BookSuggestView(QueryBudgetMixin, View):
+    """As-you-type title and author suggestions (JSON), answered from the in-process typeahead index."""
+    query_budget = 1  # Only the request that builds the index touches the database.
+    def get(self, request, *args, **kwargs):
+        query = request.GET.get('q', '')
+        return self.suggestions(query, *typeahead.suggest(query))
+
+    def suggestions(self, query, titles, authors):
+        search_url = reverse('bookstore:book_search')
+        return JsonResponse({
+            'query': query,
+            'titles': [
+                {'id': book_id, 'title': title, 'url': reverse('bookstore:book_detail', args=[book_id])}
+                for book_id, title in titles
+            ],
+            'authors': [
+                {'name': author, 'url': f"{search_url}?{urlencode({'q': author})}"}
+                for author in authors
+            ],
+        })
+
+class AsyncBookSuggestView(BookSuggestView):
+    """BookSuggestView answering from the event loop while the index is current."""
+    async def get(self, request, *args, **kwargs):
+        query = request.GET.get('q', '')
+        return self.suggestions(query, *await typeahead.asuggest(query))
+
+class BookDetailView(QueryBudgetMixin, PublicPageMixin, ReplicaReadMixin, View):
+    """Displays the details of a single book and the books often bought with it."""
+    query_budget = 4
+    def get(self, request, book_id, *args, **kwargs):
+        validators = book_validators(book_id)
+        not_modified = not_modified_response(request, validators)
+        if not_modified is not None:
+            return not_modified
+
+        cache = catalog_cache()
+        cache_key = book_detail_key(book_id)
+        cached = cache.get(cache_key)
+        if cached is None:
+            book = get_object_or_404(Book, pk=book_id)
+            cached = {'book': book, 'recommendations': recommendations_for(book_id)}
+            cache.set(cache_key, cached, catalog_cache_timeout())
+        return self.render_page(request, cached, validators)
+
+    def render_page(self, request, cached, validators):
+        context = {'book': cached['book'], 'recommendations': cached['recommendations']}
+        response = render(request, 'bookstore/book_detail.html', context)
+        return set_validator_headers(response, validators)
+
+class AsyncBookDetailView(BookDetailView):
+    """BookDetailView on the async ORM, for ASGI deployments."""
+    async def get(self, request, book_id, *args, **kwargs):
+        validators = await abook_validators(book_id)
+        not_modified = not_modified_response(request, validators)
+        if not_modified is not None:
+            return not_modified
+
+        cache = catalog_cache()
+        cache_key = book_detail_key(book_id)
+        cached = await cache.aget(cache_key)
+        if cached is None:
+            try:
+                book = await Book.objects.aget(pk=book_id)
+            except Book.DoesNotExist:
+                raise Http404("No Book matches the given query.")
+            cached = {'book': book, 'recommendations': await arecommendations_for(book_id)}
+            await cache.aset(cache_key, cached, catalog_cache_timeout())
+        return self.render_page(request, cached, validators)
+
+
+
+def refuse_attempt(request, template_name, context, retry_after=None):
+    """
+    Re-renders a login or registration form without hashing anything: a 429 when
+    the attempt was throttled (`retry_after` seconds), else a 503 because every
+    password hashing slot stayed busy.
+    """
+    if retry_after:
+        messages.error(request, "Too many attempts. Please wait a little and try again.")
+        response = render(request, template_name, context, status=429)
+        response['Retry-After'] = str(math.ceil(retry_after))
+    else:
+        messages.error(request, "We are very busy right now. Please try again in a moment.")
+        response = render(request, template_name, context, status=503)
+        response['Retry-After'] = '1'
+    return response
+
+
+class UserRegistrationView(RetryOnBusyMixin, QueryBudgetMixin, View):
     """Handles user registration."""
+    query_budget = 20
     template_name = 'bookstore/register.html'
 
     def get(self, request, *args, **kwargs):
@@ -50,7 +323,10 @@ class UserRegistrationView(View):
         password = request.POST.get('password')
         password_confirm = request.POST.get('password_confirm')
 
-        
+        wait = throttle_attempt(request, 'register', username)
+        if wait:
+            return refuse_attempt(request, self.template_name, {'username': username, 'email': email}, wait)
+
         if not username or not password or not password_confirm:
             messages.error(request, "Username and password fields are required.")
             return render(request, self.template_name, {'username': username, 'email': email})
@@ -66,26 +342,46 @@ class UserRegistrationView(View):
         
 
         try:
-            user = User.objects.create_user(username=username, password=password, email=email)
-            login(request, user) 
+            # Hashed before the transaction, so the write lock is not held while it runs.
+            with hashing_slot():
+                encoded_password = make_password(password)
+        except HashingBusy:
+            return refuse_attempt(request, self.template_name, {'username': username, 'email': email})
+
+        try:
+            # One transaction, so a retry after SQLITE_BUSY never finds a half-registered user.
+            with transaction.atomic():
+                # What create_user() does, with the password already hashed.
+                user = User(
+                    username=User.normalize_username(username), email=User.objects.normalize_email(email),
+                    password=encoded_password,
+                )
+                user.save()
+                anonymous_session_key = request.session.session_key
+                login(request, user)
+                merge_anonymous_cart(anonymous_session_key, user)
             messages.success(request, f"Registration successful! Welcome, {username}.")
             return redirect(settings.LOGIN_REDIRECT_URL) 
         except Exception as e:
+            if is_busy_error(e):
+                raise
             
             messages.error(request, "An error occurred during registration. Please try again.")
             return render(request, self.template_name, {'username': username, 'email': email})
 
-class CustomLoginView(View):
+class CustomLoginView(QueryBudgetMixin, View):
     """Handles user login using manual form handling."""
+    # Merging an anonymous cart into an existing one takes a fixed number of queries.
+    query_budget = 25
     template_name = 'bookstore/login.html'
     redirect_authenticated_user = True
 
     def get(self, request, *args, **kwargs):
         next_url = request.GET.get('next', '')
-        if request.user.is_authenticated and self.redirect_authenticated_user:
-            
-            redirect_url = next_url if next_url else settings.LOGIN_REDIRECT_URL
-            return redirect(redirect_url)
+        if request.user.is_authenticated and self.redirect_authenticated_user and next_url:
+            return redirect(next_url)
+        # Without JavaScript, public pages always show the "Login" link; a
+        # logged-in visitor who follows it is told who they are instead.
         
         context = {'next': next_url}
         return render(request, self.template_name, context)
@@ -95,16 +391,29 @@ class CustomLoginView(View):
         password = request.POST.get('password')
         
         next_url_from_post = request.POST.get('next', '')
+        context = {'next': next_url_from_post, 'username': username}
+
+        wait = throttle_attempt(request, 'login', username)
+        if wait:
+            return refuse_attempt(request, self.template_name, context, wait)
 
         if not username or not password:
              messages.error(request, "Please enter both username and password.")
              
-             return render(request, self.template_name, {'next': next_url_from_post, 'username': username})
+             return render(request, self.template_name, context)
 
-        user = authenticate(request, username=username, password=password)
+        try:
+            # Also covers the rehash when the stored hash used another cost.
+            with hashing_slot():
+                user = authenticate(request, username=username, password=password)
+        except HashingBusy:
+            return refuse_attempt(request, self.template_name, context)
 
         if user is not None:
+            # login() rotates the session key, so remember the anonymous cart's key first.
+            anonymous_session_key = request.session.session_key
             login(request, user)
+            merge_anonymous_cart(anonymous_session_key, user)
             messages.info(request, f"Welcome back, {username}!")
             
             
@@ -121,11 +430,12 @@ class CustomLoginView(View):
             
             messages.error(request, "Invalid username or password.")
             
-            return render(request, self.template_name, {'next': next_url_from_post, 'username': username})
+            return render(request, self.template_name, context)
 
 
-class CustomLogoutView(View):
+class CustomLogoutView(QueryBudgetMixin, View):
     """Handles user logout."""
+    query_budget = 4
     def post(self, request, *args, **kwargs):
         
         logout(request)
@@ -141,97 +451,219 @@ class CustomLogoutView(View):
 
 
 
-class AddToCartView(View):
-    """Adds a book to the shopping cart stored in the session."""
+class AddToCartView(RetryOnBusyMixin, QueryBudgetMixin, View):
+    """Adds a book to the visitor's server-side shopping cart."""
+    query_budget = 11
     def post(self, request, book_id, *args, **kwargs):
-        book = get_object_or_404(Book, pk=book_id)
-        
-        cart = request.session.get('cart', {})
-        cart_key = str(book_id) 
-        current_quantity = cart.get(cart_key, 0)
-        cart[cart_key] = current_quantity + 1
-        request.session['cart'] = cart 
-        request.session.modified = True 
+        book = get_object_or_404(Book.objects.only('id', 'title'), pk=book_id)
+        cart = get_or_create_cart(request)
+        try:
+            add_item(cart, book.pk)
+        except OutOfStock:
+            messages.error(request, f"Sorry, '{book.title}' is out of stock.")
+            return redirect('bookstore:book_detail', book_id=book.pk)
         messages.success(request, f"'{book.title}' added to cart.")
         
         return redirect('bookstore:cart_view')
 
-    def get(self, request, *args, **kwargs):
-         
-        messages.warning(request, "Invalid action.")
-        return redirect('bookstore:book_list')
-
-class CartView(View):
+    def get(self, request, book_id, *args, **kwargs):
+        """
+        Confirmation page for the cart forms of public pages, which carry no
+        CSRF token and so submit here by GET; its form posts with a fresh one.
+        """
+        book = get_object_or_404(Book.objects.only('id', 'title', 'author', 'price'), pk=book_id)
+        response = render(request, 'bookstore/add_to_cart.html', {'book': book})
+        add_never_cache_headers(response)
+        return response
+
+class CartView(QueryBudgetMixin, View):
     """Displays the items currently in the shopping cart."""
+    query_budget = 5
     template_name = 'bookstore/cart.html'
 
     def get(self, request, *args, **kwargs):
-        cart_session = request.session.get('cart', {})
-        cart_items = []
-        total_price = 0.0
-        ids_to_remove_from_session = []
+        cart = get_cart(request)
+        # Lines for deleted books disappear with them (ON DELETE CASCADE), so
+        # there is nothing to repair here.
+        cart_items = list(cart_lines(cart))
+        context = {
+            'cart_items': cart_items,
+            'total_price': cart_total(cart) if cart_items else Decimal('0.00'),
+            'is_empty': not cart_items,
+            # Identifies this checkout, so submitting the payment form twice places one order.
+            'idempotency_key': uuid.uuid4().hex,
+        }
+        return render(request, self.template_name, context)
 
-        
-        book_ids = [int(book_id) for book_id in cart_session.keys() if book_id.isdigit()]
-        books_in_db = Book.objects.filter(pk__in=book_ids).in_bulk() 
 
-        for book_id_str, quantity in cart_session.items():
-            try:
-                book_id = int(book_id_str)
-                book = books_in_db.get(book_id) 
-
-                if book and isinstance(quantity, int) and quantity > 0:
-                    item_total = float(book.price) * quantity 
-                    cart_items.append({
-                        'book': book,
-                        'quantity': quantity,
-                        'item_total': item_total,
-                    })
-                    total_price += item_total
-                else:
-                    
-                    ids_to_remove_from_session.append(book_id_str)
-            except (ValueError, TypeError):
-                
-                 ids_to_remove_from_session.append(book_id_str)
 
+class CartApiMixin:
+    """Shared helpers for the JSON cart endpoints."""
+    max_quantity = 99
 
-        
-        if ids_to_remove_from_session:
-            cart_modified = False
-            current_cart = request.session.get('cart', {}) 
-            for book_id_str in ids_to_remove_from_session:
-                if book_id_str in current_cart:
-                    del current_cart[book_id_str]
-                    cart_modified = True
-            if cart_modified:
-                request.session['cart'] = current_cart 
-                request.session.modified = True
+    def read_quantity(self, request, default=None):
+        """
+        Reads `quantity` from a JSON or form-encoded body. Returns None if invalid.
 
+        JSON must send an integer (not true or 2.7), a form a string of digits.
+        """
+        if request.content_type == 'application/json':
+            try:
+                data = json.loads(request.body or b'{}')
+            except ValueError:
+                return None
+            if not isinstance(data, dict):
+                return None
+            quantity = data.get('quantity', default)
+        else:
+            quantity = request.POST.get('quantity', default)
+            if isinstance(quantity, str):
+                quantity = int(quantity) if DIGITS.fullmatch(quantity) else None
+        # bool is an int subclass, and JSON's true must not mean 1.
+        if isinstance(quantity, bool) or not isinstance(quantity, int):
+            return None
+        if quantity < 0 or quantity > self.max_quantity:
+            return None
+        return quantity
+
+    def book_missing(self, book_id):
+        if Book.objects.filter(pk=book_id).exists():
+            return None
+        return JsonResponse({'error': 'Book not found.'}, status=404)
+
+    def out_of_stock(self):
+        return JsonResponse({'error': 'Not enough copies of this book in stock.'}, status=409)
+
+    def too_many_copies(self):
+        return JsonResponse({'error': f"A cart line holds at most {self.max_quantity} copies."}, status=409)
+
+    def cart_response(self, cart, book_id=None, status=200):
+        data = {'cart': cart_summary(cart)}
+        if book_id is not None:
+            line = line_summary(cart, book_id)
+            data['line'] = line and {
+                'book_id': line['book_id'],
+                'title': line['book__title'],
+                'price': line['book__price'],
+                'quantity': line['quantity'],
+                'line_total': line['line_total'],
+            }
+        return JsonResponse(data, status=status)
+
+
+class CartApiView(QueryBudgetMixin, CartApiMixin, View):
+    """JSON summary of the visitor's cart (line count, item count, total)."""
+    query_budget = 4
+    def get(self, request, *args, **kwargs):
+        return self.cart_response(get_cart(request))
 
-        context = {
-            'cart_items': cart_items,
-            'total_price': total_price,
-            'is_empty': not bool(cart_items) 
-        }
-        return render(request, self.template_name, context)
+
+class AsyncCartApiView(CartApiView):
+    """CartApiView with async session, user and ORM access, for ASGI deployments."""
+    async def get(self, request, *args, **kwargs):
+        return JsonResponse({'cart': await acart_summary(await aget_cart(request))})
 
 
+class CartApiAddView(RetryOnBusyMixin, QueryBudgetMixin, CartApiMixin, View):
+    """JSON counterpart of AddToCartView: adds copies of a book and returns the new line and total."""
+    query_budget = 11
+    def post(self, request, book_id, *args, **kwargs):
+        quantity = self.read_quantity(request, default=1)
+        if not quantity:
+            return JsonResponse({'error': f"Quantity must be between 1 and {self.max_quantity}."}, status=400)
+        missing = self.book_missing(book_id)
+        if missing:
+            return missing
+        cart = get_or_create_cart(request)
+        try:
+            add_item(cart, book_id, quantity, max_quantity=self.max_quantity)
+        except OutOfStock:
+            return self.out_of_stock()
+        except TooManyCopies:
+            return self.too_many_copies()
+        return self.cart_response(cart, book_id)
 
-class PaymentView(LoginRequiredMixin, View):
-    """Simulates a payment process by clearing the cart."""
+
+class CartApiItemView(RetryOnBusyMixin, QueryBudgetMixin, CartApiMixin, View):
+    """JSON endpoint to set (POST) or remove (DELETE) a single cart line."""
+    query_budget = 11
+    def post(self, request, book_id, *args, **kwargs):
+        quantity = self.read_quantity(request)
+        if quantity is None:
+            return JsonResponse({'error': f"Quantity must be between 0 and {self.max_quantity}."}, status=400)
+        if quantity == 0:
+            return self.delete(request, book_id)
+        missing = self.book_missing(book_id)
+        if missing:
+            return missing
+        cart = get_or_create_cart(request)
+        try:
+            set_quantity(cart, book_id, quantity)
+        except OutOfStock:
+            return self.out_of_stock()
+        return self.cart_response(cart, book_id)
+
+    def delete(self, request, book_id, *args, **kwargs):
+        cart = get_cart(request)
+        if cart is not None:
+            remove_item(cart, book_id)
+        return self.cart_response(cart, book_id)
+
+
+class SessionView(QueryBudgetMixin, View):
+    """
+    The visitor-specific parts of public catalog pages (JSON): the nav user
+    menu, pending messages, a CSRF token and the cart's item count.
+    """
+    query_budget = 4
+    def get(self, request, *args, **kwargs):
+        response = JsonResponse({
+            'authenticated': request.user.is_authenticated,
+            'staff': request.user.is_staff,
+            'csrf_token': get_token(request),
+            'cart_items': cart_summary(get_cart(request))['items'],
+            'user_menu': render_to_string('bookstore/partials/user_menu.html', request=request),
+            'messages': render_to_string('bookstore/partials/messages.html', request=request),
+        })
+        add_never_cache_headers(response)
+        patch_cache_control(response, private=True)
+        return response
+
+
+
+class PaymentView(RetryOnBusyMixin, QueryBudgetMixin, LoginRequiredMixin, View):
+    """Checks the cart out into an order (the payment itself is simulated)."""
+    query_budget = 12
     login_url = reverse_lazy('bookstore:login') 
 
+    def post(self, request, *args, **kwargs):
+        try:
+            idempotency_key = clean_idempotency_key(
+                request.POST.get('idempotency_key') or request.headers.get('Idempotency-Key')
+            )
+            order, created = place_order(request.user, get_cart(request), idempotency_key)
+        except CheckoutError as exc:
+            messages.error(request, str(exc))
+            return redirect('bookstore:cart_view')
+        if created:
+            messages.success(request, f'Payment successful (simulation)! Order #{order.pk} has been placed.')
+        return redirect('bookstore:order_detail', order_id=order.pk)
+
     def get(self, request, *args, **kwargs):
-        
-        
-        if 'cart' in request.session:
-            request.session['cart'] = {}
-            request.session.modified = True
-            messages.success(request, 'Payment successful (simulation)! Your cart has been cleared.')
-        else:
-             messages.info(request, 'Your cart was already empty.')
-        return redirect('bookstore:book_list')
+        messages.info(request, 'Review your cart and confirm the payment.')
+        return redirect('bookstore:cart_view')
+
+
+class OrderDetailView(QueryBudgetMixin, LoginRequiredMixin, View):
+    """Shows one of the user's orders with the titles and prices it was placed at."""
+    query_budget = 4
+    login_url = reverse_lazy('bookstore:login')
+    template_name = 'bookstore/order_detail.html'
+
+    def get(self, request, order_id, *args, **kwargs):
+        order = get_object_or_404(Order.objects.filter(user=request.user), pk=order_id)
+        context = {'order': order, 'lines': order.lines.order_by('title', 'id')}
+        return render(request, self.template_name, context)
 
 
 
@@ -256,18 +688,105 @@ class StaffRequiredMixin(UserPassesTestMixin):
             return redirect(reverse('bookstore:home'))
 
 
-class AdminBookListView(StaffRequiredMixin, View):
+class AdminBookListView(QueryBudgetMixin, StaffRequiredMixin, View):
     """Displays list of books for admin management."""
+    query_budget = 4
     template_name = 'bookstore/admin/admin_book_list.html'
 
     def get(self, request, *args, **kwargs):
-        books = Book.objects.all().order_by('title')
-        context = {'books': books}
+        filters, error = parse_book_filters(request.GET)
+        if error:
+            messages.error(request, error)
+        books = filter_books(Book.objects.only('id', 'title', 'author', 'price', 'stock'), **filters)
+        page_size = get_page_size(request)
+        page = paginate_by_title(
+            books, page_size, after=request.GET.get('after'), before=request.GET.get('before')
+        )
+        context = {
+            'books': page.items,
+            'page': page,
+            'page_size': page_size,
+            'filters': filters,
+            'filter_query': urlencode(filters),
+            'matching_count': books.count(),
+        }
         return render(request, self.template_name, context)
 
 
-class AdminBookCreateView(StaffRequiredMixin, View):
+class AdminBookBulkActionView(RetryOnBusyMixin, QueryBudgetMixin, StaffRequiredMixin, View):
+    """Applies a price change, author change or deletion to many books in one statement."""
+    query_budget = 10
+
+    def post(self, request, *args, **kwargs):
+        filters, error = parse_book_filters(request.POST)
+        redirect_url = reverse('bookstore:admin_book_list')
+        if filters:
+            redirect_url = f"{redirect_url}?{urlencode(filters)}"
+        if error:
+            messages.error(request, error)
+            return redirect(redirect_url)
+
+        if request.POST.get('scope') == 'filtered':
+            books = filter_books(**filters)
+            # With no filter this is the whole catalog: only go ahead if the
+            # form echoes the count the list page showed.
+            if not filters and request.POST.get('confirm_count') != str(books.count()):
+                messages.error(
+                    request, "Nothing was changed: set a filter, or reload the list to act on every book."
+                )
+                return redirect(redirect_url)
+        else:
+            book_ids = [int(pk) for pk in request.POST.getlist('book_ids') if pk.isdigit()]
+            if not book_ids:
+                messages.warning(request, "No books were selected.")
+                return redirect(redirect_url)
+            books = Book.objects.filter(pk__in=book_ids)
+
+        action = request.POST.get('action', '')
+        try:
+            count = apply_bulk_action(books, action, request.POST.get('value'))
+        except BulkActionError as exc:
+            messages.error(request, f"Nothing was changed: {exc}")
+            return redirect(redirect_url)
+
+        verb = 'deleted' if action == 'delete' else 'updated'
+        messages.success(request, f"{count} book{'s' if count != 1 else ''} {verb}.")
+        return redirect(redirect_url)
+
+
+class AdminBookExportView(QueryBudgetMixin, StaffRequiredMixin, View):
+    """Streams the catalog as CSV or NDJSON, optionally filtered by author and price range."""
+    query_budget = 3
+    formats = {
+        'csv': (csv_lines, 'text/csv; charset=utf-8', 'csv'),
+        'ndjson': (ndjson_lines, 'application/x-ndjson; charset=utf-8', 'ndjson'),
+    }
+
+    def get(self, request, *args, **kwargs):
+        export_format = request.GET.get('format', 'csv')
+        if export_format not in self.formats:
+            return HttpResponseBadRequest("Unknown export format.")
+
+        filters, error = parse_book_filters(request.GET)
+        if error:
+            return HttpResponseBadRequest(error)
+
+        rows = export_rows(**filters)
+        render_lines, content_type, extension = self.formats[export_format]
+        response = StreamingHttpResponse(render_lines(rows), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="books.{extension}"'
+        return response
+
+    def handle_no_permission(self):
+        # A download link must not save the home page as books.csv.
+        if self.request.user.is_authenticated:
+            return HttpResponseForbidden("Only staff can export the catalog.")
+        return super().handle_no_permission()
+
+
+class AdminBookCreateView(RetryOnBusyMixin, QueryBudgetMixin, StaffRequiredMixin, View):
     """Handles creation of new books by admin."""
+    query_budget = 11
     template_name = 'bookstore/admin/admin_book_form.html'
 
     def get(self, request, *args, **kwargs):
@@ -280,21 +799,12 @@ class AdminBookCreateView(StaffRequiredMixin, View):
         author = request.POST.get('author', '').strip()
         description = request.POST.get('description', '').strip()
         price_str = request.POST.get('price', '').strip()
-        price = None 
 
         
-        errors = {}
-        if not title: errors['title'] = "Title is required."
-        if not author: errors['author'] = "Author is required."
-        if not price_str:
-            errors['price'] = "Price is required."
-        else:
-            try:
-                
-                price = float(price_str)
-                if price < 0: errors['price'] = "Price cannot be negative."
-            except ValueError:
-                errors['price'] = "Invalid price format (e.g., 12.99)."
+        price, errors = clean_book_fields(title, author, price_str)
+        stock, stock_error = clean_stock(request.POST.get('stock', '').strip())
+        if stock_error:
+            errors['stock'] = stock_error
 
         if errors:
              messages.error(request, "Please correct the errors below.")
@@ -308,15 +818,22 @@ class AdminBookCreateView(StaffRequiredMixin, View):
 
         
         try:
-            Book.objects.create(
-                title=title,
-                author=author,
-                description=description,
-                price=price 
-            )
+            with transaction.atomic():
+                book = Book.objects.create(
+                    title=title,
+                    author=author,
+                    description=description,
+                    price=price,
+                    stock=stock,
+                )
+                facets.record_change(new=(book.author, book.price))
+            bump_catalog_version(book.pk)
+            typeahead.book_changed(book.pk, new=(book.title, book.author))
             messages.success(request, f"Book '{title}' created successfully.")
             return redirect('bookstore:admin_book_list')
         except Exception as e:
+             if is_busy_error(e):
+                 raise
              
              messages.error(request, "An error occurred while creating the book.")
              context = {
@@ -327,8 +844,9 @@ class AdminBookCreateView(StaffRequiredMixin, View):
              return render(request, self.template_name, context)
 
 
-class AdminBookUpdateView(StaffRequiredMixin, View):
+class AdminBookUpdateView(RetryOnBusyMixin, QueryBudgetMixin, StaffRequiredMixin, View):
     """Handles updating existing books by admin."""
+    query_budget = 14
     template_name = 'bookstore/admin/admin_book_form.html'
 
     def get(self, request, book_id, *args, **kwargs):
@@ -339,24 +857,19 @@ class AdminBookUpdateView(StaffRequiredMixin, View):
 
     def post(self, request, book_id, *args, **kwargs):
         book = get_object_or_404(Book, pk=book_id)
+        indexed = (book.title, book.author)
+        faceted = (book.author, book.price)
         title = request.POST.get('title', '').strip()
         author = request.POST.get('author', '').strip()
         description = request.POST.get('description', '').strip()
         price_str = request.POST.get('price', '').strip()
-        price = None
 
         
-        errors = {}
-        if not title: errors['title'] = "Title is required."
-        if not author: errors['author'] = "Author is required."
-        if not price_str:
-            errors['price'] = "Price is required."
-        else:
-            try:
-                price = float(price_str)
-                if price < 0: errors['price'] = "Price cannot be negative."
-            except ValueError:
-                errors['price'] = "Invalid price format (e.g., 12.99)."
+        price, errors = clean_book_fields(title, author, price_str)
+        stock, stock_error = clean_stock(request.POST.get('stock', '').strip())
+        stock_original, original_error = clean_stock(request.POST.get('stock_original', '').strip(), required=True)
+        if stock_error or original_error:
+            errors['stock'] = stock_error or "Reload the form and try again."
 
         if errors:
              messages.error(request, "Please correct the errors below.")
@@ -370,14 +883,36 @@ class AdminBookUpdateView(StaffRequiredMixin, View):
 
         
         try:
-            book.title = title
-            book.author = author
-            book.description = description
-            book.price = price 
-            book.save() 
+            with transaction.atomic():
+                book.title = title
+                book.author = author
+                book.description = description
+                book.price = price 
+                # Stock is never saved from the form: apply only the staff's change, so
+                # copies reserved by shoppers since the form was opened stay reserved.
+                book.save(update_fields=['title', 'author', 'description', 'price'])
+                facets.record_change(old=faceted, new=(book.author, book.price))
+                adjust_stock(book.pk, stock - stock_original)
+            bump_book_pages(book.pk)
+            typeahead.book_changed(book.pk, old=indexed, new=(book.title, book.author))
             messages.success(request, f"Book '{book.title}' updated successfully.")
             return redirect('bookstore:admin_book_list')
+        except OutOfStock:
+             messages.error(request, "Please correct the errors below.")
+             book.refresh_from_db(fields=['stock'])
+             # Start the stock field over from the current count.
+             book_data = request.POST.copy()
+             book_data['stock'] = book_data['stock_original'] = book.stock
+             context = {
+                 'errors': {'stock': f"Only {book.stock} copies are left now; you cannot remove more than that."},
+                 'book_data': book_data,
+                 'book': book,
+                 'action_name': 'Update'
+             }
+             return render(request, self.template_name, context)
         except Exception as e:
+             if is_busy_error(e):
+                 raise
              
              messages.error(request, "An error occurred while updating the book.")
              context = {
@@ -389,8 +924,9 @@ class AdminBookUpdateView(StaffRequiredMixin, View):
              return render(request, self.template_name, context)
 
 
-class AdminBookDeleteView(StaffRequiredMixin, View):
+class AdminBookDeleteView(RetryOnBusyMixin, QueryBudgetMixin, StaffRequiredMixin, View):
     """Handles deletion of books by admin."""
+    query_budget = 16
     template_name = 'bookstore/admin/admin_book_confirm_delete.html'
 
     def get(self, request, book_id, *args, **kwargs):
@@ -404,11 +940,44 @@ class AdminBookDeleteView(StaffRequiredMixin, View):
         book = get_object_or_404(Book, pk=book_id)
         book_title = book.title 
         try:
-            book.delete()
+            with transaction.atomic():
+                bump_book_pages(book_id)
+                book.delete()
+                facets.record_change(old=(book.author, book.price))
+            typeahead.book_changed(book_id, old=(book_title, book.author))
             messages.success(request, f"Book '{book_title}' deleted successfully.")
             return redirect('bookstore:admin_book_list')
         except Exception as e:
+             if is_busy_error(e):
+                 raise
              
              messages.error(request, f"An error occurred while deleting the book '{book_title}'.")
              
-             return redirect('bookstore:admin_book_list')
\ No newline at end of file
+             return redirect('bookstore:admin_book_list')
+
+
+class MetricsView(QueryBudgetMixin, StaffRequiredMixin, View):
+    """
+    Exposes the request metrics in Prometheus text format to staff users, or to
+    scrapers presenting "Authorization: Bearer <METRICS_TOKEN>".
+    With ?slow=1, returns the slowest recorded requests and their SQL as JSON.
+    """
+    query_budget = 2
+
+    def test_func(self):
+        token = getattr(settings, 'METRICS_TOKEN', None)
+        header = self.request.headers.get('Authorization', '')
+        if token and header.startswith('Bearer '):
+            return constant_time_compare(header[len('Bearer '):], token)
+        return super().test_func()
+
+    def handle_no_permission(self):
+        # Scrapers cannot follow a login redirect: a bad or missing token is a plain 403.
+        if not self.request.user.is_authenticated:
+            return HttpResponseForbidden("A valid metrics token is required.")
+        return super().handle_no_permission()
+
+    def get(self, request, *args, **kwargs):
+        if request.GET.get('slow'):
+            return JsonResponse({'slowest_requests': REGISTRY.slowest_requests()})
+        return HttpResponse(render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
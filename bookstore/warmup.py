@@ -0,0 +1,67 @@
+"""
+Loads what Django otherwise loads on the first request.
+
+Django imports the views and compiles the URL patterns on the first request
+that resolves a URL, and compiles each template the first time it renders.
+With gunicorn's preload_app, the config calls warm_up() once in the master
+process, so every worker is forked with all of it in memory and its first
+request is as fast as the rest.
+"""
+import logging
+import time
+from pathlib import Path
+
+from django.apps import apps
+from django.db import DatabaseError
+from django.template import engines
+from django.urls import get_resolver, reverse
+
+from . import typeahead
+
+
+logger = logging.getLogger('bookstore.warmup')
+
+
+def load_urls():
+    """Imports every view and builds the resolver's reverse lookup tables."""
+    reverse('bookstore:home')
+    _, bookstore_urls = get_resolver().namespace_dict['bookstore']
+    return len(bookstore_urls.url_patterns)
+
+
+def template_names():
+    """The names of the bookstore app's templates."""
+    directory = Path(apps.get_app_config('bookstore').path) / 'templates'
+    return sorted(path.relative_to(directory).as_posix() for path in directory.rglob('*.html'))
+
+
+def load_templates():
+    """Compiles every bookstore template into the cached template loader."""
+    names = template_names()
+    for engine in engines.all():
+        for name in names:
+            engine.get_template(name)
+    return len(names)
+
+
+def load_typeahead():
+    """Builds the search suggestion index; skipped when the database is not migrated yet."""
+    try:
+        return typeahead.preload()
+    except DatabaseError as exc:
+        logger.warning("Skipped building the suggestion index: %s", exc)
+        return 0
+
+
+STEPS = (('urls', load_urls), ('templates', load_templates), ('typeahead', load_typeahead))
+
+
+def warm_up():
+    """Runs every warm-up step; returns {step: (count, seconds)}."""
+    timings = {}
+    for name, step in STEPS:
+        started = time.perf_counter()
+        count = step()
+        timings[name] = (count, time.perf_counter() - started)
+        logger.info("Warm-up: %s (%d) in %.1f ms", name, count, timings[name][1] * 1000)
+    return timings
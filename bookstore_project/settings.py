@@ -10,8 +10,12 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
+import warnings
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -20,12 +24,14 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 
 
 
-SECRET_KEY = 'django-insecure-ybkgy)bm-61=v_x-qpjm%y4**g71jyr!_u38skay^j)#fz@-5t'
+# Production deployments (the Docker image's gunicorn, see gunicorn.conf.py) set
+# SECRET_KEY, DEBUG=False and a comma-separated ALLOWED_HOSTS in the environment.
+SECRET_KEY = os.environ.get('SECRET_KEY') or 'django-insecure-ybkgy)bm-61=v_x-qpjm%y4**g71jyr!_u38skay^j)#fz@-5t'
 
 
-DEBUG = True
+DEBUG = (os.environ.get('DEBUG') or 'True').lower() in ('1', 'true', 'yes')
 
-ALLOWED_HOSTS = []
+ALLOWED_HOSTS = [host.strip() for host in os.environ.get('ALLOWED_HOSTS', '').split(',') if host.strip()]
 
 
 
@@ -42,6 +48,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'bookstore.health.HealthCheckMiddleware',
+    'bookstore.staticfiles.StaticFilesMiddleware',
+    'bookstore.metrics.RequestMetricsMiddleware',
+    'bookstore.routers.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -55,9 +65,8 @@ ROOT_URLCONF = 'bookstore_project.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
-        
-        'APP_DIRS': True, 
+        # The stock Django backend, plus render timing for the request metrics.
+        'BACKEND': 'bookstore.metrics.InstrumentedDjangoTemplates',
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.debug',
@@ -66,6 +75,12 @@ TEMPLATES = [
                 'django.contrib.messages.context_processors.messages',
                 
             ],
+            # Each template is compiled once per process and kept; under gunicorn they are
+            # all compiled before the workers fork (bookstore.warmup). runserver's
+            # autoreloader still picks up template edits.
+            'loaders': [
+                ('django.template.loaders.cached.Loader', ['django.template.loaders.app_directories.Loader']),
+            ],
         },
     },
 ]
@@ -79,13 +94,187 @@ WSGI_APPLICATION = 'bookstore_project.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.environ.get('BOOKSTORE_DB_NAME', BASE_DIR / 'db.sqlite3'),
     }
 }
 
+# PRAGMAs applied to every new SQLite connection (bookstore.db.configure_sqlite).
+SQLITE_PRAGMAS = {}
+# Write requests that still find the database locked after busy_timeout are retried
+# this many times in total, backing off from SQLITE_BUSY_RETRY_DELAY seconds.
+SQLITE_BUSY_RETRIES = 3
+SQLITE_BUSY_RETRY_DELAY = 0.05
+
+# BOOKSTORE_DB_PROFILE=production: WAL so readers never wait for the admin's writes,
+# persistent connections, and write transactions that take the lock up front
+# (IMMEDIATE), so they wait out busy_timeout instead of failing mid-transaction.
+# The transaction_mode option needs Django 5.1 or later.
+DB_PROFILE = os.environ.get('BOOKSTORE_DB_PROFILE', 'development')
+
+if DB_PROFILE == 'production':
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': int(os.environ.get('BOOKSTORE_CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {'transaction_mode': 'IMMEDIATE'},
+    })
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'cache_size': -64000,
+        'mmap_size': 268435456,
+        'temp_store': 'MEMORY',
+    }
 
+# Read replicas for catalog pages (bookstore.routers): BOOKSTORE_DB_REPLICAS is a
+# comma-separated list of SQLite files kept up to date by `manage.py refresh_replica`.
+# Views using ReplicaReadMixin read REPLICA_READ_MODELS from a replica, unless the
+# visitor wrote one of them in the last REPLICA_STICKY_SECONDS.
+DATABASE_REPLICAS = []
+for number, path in enumerate(filter(None, os.environ.get('BOOKSTORE_DB_REPLICAS', '').split(',')), start=1):
+    alias = f'replica{number}'
+    DATABASES[alias] = {**DATABASES['default'], 'NAME': path.strip(), 'TEST': {'MIRROR': 'default'}}
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['bookstore.routers.PrimaryReplicaRouter']
+# Only the catalog: replicas change only when refresh_replica runs, and a shopper must
+# see their own cart at once, so carts are always read from the primary.
+REPLICA_READ_MODELS = ['bookstore.Book', 'bookstore.BookFacet']
+REPLICA_STICKY_SECONDS = 5
+
+
+
+
+
+# Catalog pages are cached under a version counter that the staff book views bump.
+# locmem is per-process: with several server processes use the file backend
+# (BOOKSTORE_CACHE_BACKEND=file) so an admin edit invalidates every worker.
+CACHE_BACKEND = os.environ.get('BOOKSTORE_CACHE_BACKEND', 'locmem')
+# Server processes sharing these settings; gunicorn.conf.py sets it to its worker count.
+SERVER_PROCESSES = int(os.environ.get('BOOKSTORE_SERVER_PROCESSES', 1))
+
+# Sessions get their own cache, so culling catalog pages never logs anybody out, and
+# so do the login throttle's buckets, so a flood of attempts cannot evict either.
+if CACHE_BACKEND == 'file':
+    CACHE_LOCATION = Path(os.environ.get('BOOKSTORE_CACHE_LOCATION', BASE_DIR / 'cache'))
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': CACHE_LOCATION,
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        },
+        'sessions': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': CACHE_LOCATION / 'sessions',
+            'OPTIONS': {'MAX_ENTRIES': 100000},
+        },
+        'throttle': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': CACHE_LOCATION / 'throttle',
+            'OPTIONS': {'MAX_ENTRIES': 100000},
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'bookstore',
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        },
+        'sessions': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'bookstore-sessions',
+            'OPTIONS': {'MAX_ENTRIES': 100000},
+        },
+        'throttle': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'bookstore-throttle',
+            'OPTIONS': {'MAX_ENTRIES': 100000},
+        },
+    }
 
-
+CATALOG_CACHE_ALIAS = 'default'
+CATALOG_CACHE_TIMEOUT = 60 * 60
+
+# Session storage, chosen with BOOKSTORE_SESSION_PROFILE:
+#   db        sessions in the database, messages in a cookie with the session as overflow
+#             (Django's defaults)
+#   cached_db sessions read from the cache and written through to the database;
+#             messages only in a cookie
+#   cache     sessions only in the cache, lost when it is cleared
+# cached_db and cache need a cache shared by every server process, so they are only
+# the default (cached_db) with BOOKSTORE_CACHE_BACKEND=file; on locmem it is db.
+# Every engine skips saving a session whose data did not change (bookstore.sessions).
+SESSION_PROFILES = {
+    'db': {
+        'SESSION_ENGINE': 'bookstore.sessions.db',
+        'MESSAGE_STORAGE': 'django.contrib.messages.storage.fallback.FallbackStorage',
+    },
+    'cached_db': {
+        'SESSION_ENGINE': 'bookstore.sessions.cached_db',
+        'MESSAGE_STORAGE': 'django.contrib.messages.storage.cookie.CookieStorage',
+    },
+    'cache': {
+        'SESSION_ENGINE': 'bookstore.sessions.cache',
+        'MESSAGE_STORAGE': 'django.contrib.messages.storage.cookie.CookieStorage',
+    },
+}
+SESSION_PROFILE = os.environ.get('BOOKSTORE_SESSION_PROFILE', 'cached_db' if CACHE_BACKEND == 'file' else 'db')
+SESSION_ENGINE = SESSION_PROFILES[SESSION_PROFILE]['SESSION_ENGINE']
+MESSAGE_STORAGE = SESSION_PROFILES[SESSION_PROFILE]['MESSAGE_STORAGE']
+SESSION_CACHE_ALIAS = 'sessions'
+
+if SERVER_PROCESSES > 1 and CACHE_BACKEND == 'locmem':
+    if SESSION_PROFILE in ('cached_db', 'cache'):
+        # Each worker would keep its own copy of a session, so a logout handled by
+        # one worker would not end the session in the others.
+        raise ImproperlyConfigured(
+            f"BOOKSTORE_SESSION_PROFILE={SESSION_PROFILE} keeps sessions in a per-process locmem cache, "
+            f"but {SERVER_PROCESSES} server processes are configured. Set BOOKSTORE_CACHE_BACKEND=file "
+            f"or BOOKSTORE_SESSION_PROFILE=db."
+        )
+    warnings.warn(
+        f"{SERVER_PROCESSES} server processes share a per-process locmem cache: catalog edits and "
+        f"suggestion index changes reach only the worker that made them. Set BOOKSTORE_CACHE_BACKEND=file.",
+        RuntimeWarning,
+    )
+
+
+
+
+
+# New password hashes use PBKDF2 with PASSWORD_HASH_ITERATIONS (Django's default,
+# 1,000,000 in 5.2, when unset). Hashes stored with another count are rehashed at
+# the user's next login, so the cost can be raised or lowered at any time.
+PASSWORD_HASH_ITERATIONS = int(os.environ.get('BOOKSTORE_PASSWORD_HASH_ITERATIONS', 0)) or None
+PASSWORD_HASHERS = [
+    'bookstore.hashers.ConfigurablePBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+# Password hashes one process computes at once (bookstore.throttle); None removes the
+# limit. Other logins and registrations wait for a slot, then get a 503. The wait is
+# PASSWORD_HASH_WAIT seconds if set, else PASSWORD_HASH_WAIT_HASHES times the measured
+# time a hash holds its slot: long enough for overlapping legitimate logins to get
+# through, short enough that a flood's waiting requests soon give their threads back.
+PASSWORD_HASH_CONCURRENCY = 1
+PASSWORD_HASH_WAIT = None
+PASSWORD_HASH_WAIT_HASHES = 2
+
+# Login and registration attempts are limited per client IP and per username by token
+# buckets, checked before any password is hashed: {bucket: (burst, tokens per minute)}.
+# A bucket left out is unlimited.
+AUTH_THROTTLE_RATES = {
+    'login:ip': (20, 10),
+    'login:username': (5, 2),
+    'register:ip': (5, 2),
+    'register:username': (3, 1),
+}
+AUTH_THROTTLE_CACHE_ALIAS = 'throttle'
+# Reverse proxies in front of the app; the client IP is then read from X-Forwarded-For.
+NUM_PROXIES = int(os.environ.get('BOOKSTORE_NUM_PROXIES', 0))
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -120,10 +309,51 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# `collectstatic` gathers the static files here. Without DEBUG they get content-hashed
+# names and gzip variants (bookstore.staticfiles), and StaticFilesMiddleware serves
+# them with far-future caching; with DEBUG, runserver serves them from the apps.
+STATIC_ROOT = Path(os.environ.get('BOOKSTORE_STATIC_ROOT', BASE_DIR / 'staticfiles'))
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {
+        'BACKEND': (
+            'django.contrib.staticfiles.storage.StaticFilesStorage' if DEBUG
+            else 'bookstore.staticfiles.CompressedManifestStaticFilesStorage'
+        ),
+    },
+}
+
 
 
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 LOGIN_REDIRECT_URL = 'bookstore:book_list' 
-LOGOUT_REDIRECT_URL = 'bookstore:home'    
\ No newline at end of file
+LOGOUT_REDIRECT_URL = 'bookstore:home'    
+
+
+BOOK_LIST_PAGE_SIZE = 24
+BOOK_LIST_MAX_PAGE_SIZE = 100
+
+# Catalog pages are the same for every visitor; shared caches may keep them this long.
+PUBLIC_PAGE_MAX_AGE = 60
+
+# Copies added to a cart stay reserved this long after the line last changed;
+# `manage.py release_expired_reservations` returns lapsed ones to stock.
+CART_RESERVATION_SECONDS = 15 * 60
+
+
+# Request metrics (bookstore.metrics) are served at manage/metrics/ to staff users,
+# or to a Prometheus scraper sending "Authorization: Bearer <METRICS_TOKEN>".
+METRICS_TOKEN = os.environ.get('BOOKSTORE_METRICS_TOKEN')
+# Requests slower than this are logged with their SQL to 'bookstore.slow_requests'; None disables it.
+METRICS_SLOW_REQUEST_SECONDS = 0.5
+METRICS_SLOW_REQUEST_KEEP = 20
+
+# Liveness and readiness probes (bookstore.health), answered before any other middleware.
+HEALTH_LIVE_PATH = '/health/live/'
+HEALTH_READY_PATH = '/health/ready/'
+
+# Query budgets declared on the views (see bookstore.query_budget): 'off', 'warn' to log
+# views that exceed their budget (e.g. in staging), or 'raise' to fail the request.
+QUERY_BUDGET_MODE = os.environ.get('BOOKSTORE_QUERY_BUDGET_MODE', 'off')
@@ -0,0 +1,84 @@
+"""
+gunicorn settings for the production image: `gunicorn bookstore_project.wsgi`.
+
+gunicorn reads this file from the working directory. Every value can be
+overridden with a GUNICORN_* environment variable, or on the command line.
+
+preload_app imports Django in the master; when_ready() then loads the URLconf,
+compiles the templates and builds the suggestion index (bookstore.warmup)
+before any worker forks, so workers start with all of it in shared memory
+and do not pay for it on their first requests.
+"""
+import os
+import time
+
+
+started = time.perf_counter()
+
+
+def cpu_count():
+    """CPUs this process may run on, which respects a container's cpuset."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+bind = os.environ.get('GUNICORN_BIND', f"0.0.0.0:{os.environ.get('PORT', '8000')}")
+
+# Processes for CPU-bound rendering, threads to overlap waiting on SQLite and
+# clients. SQLite takes one writer at a time, so more processes than this
+# only add memory.
+worker_class = 'gthread'
+workers = env_int('GUNICORN_WORKERS', 2 * cpu_count() + 1)
+threads = env_int('GUNICORN_THREADS', 4)
+# Read by the settings, which refuse per-process caches for state the workers share.
+os.environ['BOOKSTORE_SERVER_PROCESSES'] = str(workers)
+
+preload_app = True
+
+# Recycle workers now and then so a slow leak cannot grow forever; with
+# preload_app a replacement is a cheap fork of the warmed-up master.
+max_requests = env_int('GUNICORN_MAX_REQUESTS', 2000)
+max_requests_jitter = max_requests // 10
+
+timeout = env_int('GUNICORN_TIMEOUT', 30)
+graceful_timeout = 30
+# Behind a load balancer that keeps connections open.
+keepalive = env_int('GUNICORN_KEEPALIVE', 5)
+
+# Worker heartbeats on tmpfs, not the container's overlay filesystem.
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+
+def when_ready(server):
+    from django.db import connections
+
+    from bookstore.warmup import warm_up
+
+    timings = warm_up()
+    # Workers open their own connections; none may be shared across the fork.
+    connections.close_all()
+    server.log.info(
+        "Warmed up (%s); ready %.0f ms after start, forking %d workers x %d threads",
+        ', '.join(f"{step} {seconds * 1000:.0f} ms" for step, (_, seconds) in timings.items()),
+        (time.perf_counter() - started) * 1000, server.num_workers, threads,
+    )
+
+
+def post_fork(server, worker):
+    worker.forked_at = time.perf_counter()
+
+
+def post_worker_init(worker):
+    worker.log.info("Worker %s ready %.1f ms after fork", worker.pid, (time.perf_counter() - worker.forked_at) * 1000)